@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# What an assembled collection was built from.
+#
+#   {
+#     "fingerprint": "<sha256 over everything below>",
+#     "params": {"namespace": "jctanner", "rewriter": 1, ...},
+#     "meta": "<sha256 of the collection's meta entry>",
+#     "sources": {
+#       "lib/ansible/modules/cloud/vmware/vmware_guest.py": {
+#         "size": 123, "mtime": 1546300800000000000, "sha256": "..."
+#       }
+#     }
+#   }
+#
+# A collection whose fingerprint comes out the same on the next run does
+# not need to be assembled again. Source digests are reused from the
+# previous manifest while a file's size and mtime are unchanged.
+
+import hashlib
+import json
+import os
+
+from release_manifest import sha256_file
+
+
+def read_manifest(filename):
+    try:
+        with open(filename, 'r') as f:
+            return json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def digest_sources(basedir, paths, previous=None):
+    '''Map each path (relative to basedir) to its size, mtime and sha256'''
+    previous = previous or {}
+    sources = {}
+    for path in paths:
+        relpath = os.path.relpath(path, basedir)
+        try:
+            st = os.stat(path)
+        except OSError:
+            sources[relpath] = None
+            continue
+        old = previous.get(relpath)
+        if old and old['size'] == st.st_size and old['mtime'] == st.st_mtime_ns:
+            sources[relpath] = old
+            continue
+        sources[relpath] = {
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'sha256': sha256_file(path),
+        }
+    return sources
+
+
+def build_manifest(meta, sources, **params):
+    '''The manifest for a meta entry, its digested sources and build params'''
+    meta_digest = hashlib.sha256(json.dumps(meta, sort_keys=True).encode('utf-8')).hexdigest()
+    sha = hashlib.sha256()
+    sha.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    sha.update(meta_digest.encode('utf-8'))
+    for relpath in sorted(sources):
+        sha.update(relpath.encode('utf-8'))
+        sha.update(b'\0')
+        sha.update((sources[relpath] or {}).get('sha256', 'missing').encode('utf-8'))
+        sha.update(b'\0')
+    return {
+        'fingerprint': sha.hexdigest(),
+        'params': params,
+        'meta': meta_digest,
+        'sources': sources,
+    }
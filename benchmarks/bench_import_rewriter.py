@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# Compare the old per-module_util line loop from _assemble_collections
+# against import_rewriter on synthetic modules importing many module_utils.
+#
+#   python benchmarks/bench_import_rewriter.py --count 500 --utils 30
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from import_rewriter import module_util_table
+from import_rewriter import rewrite_imports
+
+
+NAMESPACE = 'jctanner'
+NAME = 'network_ios'
+
+
+def make_module(idx, utils):
+    lines = [
+        '#!/usr/bin/python',
+        'from __future__ import absolute_import, division, print_function',
+        '__metaclass__ = type',
+        '',
+        'DOCUMENTATION = """',
+        'module: synthetic_%d' % idx,
+        '"""',
+        '',
+        'from ansible.module_utils.basic import AnsibleModule',
+    ]
+    for mu in utils:
+        lines.append('from ansible.module_utils.%s import helper_a, helper_b' % mu)
+    lines += ['', '', 'def main():']
+    lines += ['    x%d = helper_a(%d)' % (x, x) for x in range(400)]
+    lines += ['', '', "if __name__ == '__main__':", '    main()', '']
+    return '\n'.join(lines)
+
+
+def old_rewrite(mdata, module_utils):
+    # the single line case of the pre-rewriter loop, which is the one
+    # every module pays for
+    for mu in module_utils:
+        si = 'ansible.module_utils.%s' % mu
+        di = 'ansible_collections.%s.%s.plugins.module_utils.%s' % (NAMESPACE, NAME, mu)
+        mdlines = mdata.split('\n')
+        for idx, x in enumerate(mdlines):
+            if not x.startswith('from '):
+                continue
+            if si in x:
+                newx = x.replace(si, di)
+                if len(newx) < 160 and ('(' not in x) and '\\' not in x:
+                    mdlines[idx] = newx
+        mdata = '\n'.join(mdlines)
+    return mdata
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--utils', type=int, default=30)
+    args = parser.parse_args()
+
+    utils = ['network.ios.util%d' % x for x in range(args.utils)]
+    sources = [make_module(x, utils) for x in range(args.count)]
+    nbytes = sum([len(x) for x in sources])
+
+    t0 = time.time()
+    old = [old_rewrite(x, utils) for x in sources]
+    t_old = time.time() - t0
+
+    t0 = time.time()
+    table = module_util_table(utils, NAMESPACE, NAME)
+    new = [rewrite_imports(x, table)[0] for x in sources]
+    t_new = time.time() - t0
+
+    print('modules:         %s (%.1fMB)' % (len(sources), float(nbytes) / (1024 * 1024)))
+    print('module_utils:    %s' % len(utils))
+    print('line loop:       %.2fs (%.1fMB/s)' % (t_old, nbytes / max(t_old, 0.000001) / (1024 * 1024)))
+    print('import_rewriter: %.2fs (%.1fMB/s)' % (t_new, nbytes / max(t_new, 0.000001) / (1024 * 1024)))
+    print('speedup:         %.1fx' % (t_old / max(t_new, 0.000001)))
+    print('same output:     %s' % (old == new))
+
+
+if __name__ == '__main__':
+    main()
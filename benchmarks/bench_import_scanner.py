@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+# Compare the old per-file fgrep subprocess against import_scanner on a
+# synthetic tree of modules.
+#
+#   python benchmarks/bench_import_scanner.py --count 5000
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from import_scanner import scan_module_utils_tree
+
+
+MODULE_TEMPLATE = '''#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = """
+module: synthetic_%(idx)d
+short_description: synthetic module %(idx)d
+extends_documentation_fragment: vmware.documentation
+options:
+  name:
+    description: a name
+"""
+
+import json
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils._text import to_native
+from ansible.module_utils.vmware import (connect_to_api, find_obj,
+                                         vmware_argument_spec)
+from ansible.module_utils.network.common.utils import \\
+    to_list
+import ansible.module_utils.urls
+
+
+def main():
+    module = AnsibleModule(argument_spec=vmware_argument_spec())
+%(body)s
+    module.exit_json(changed=False)
+
+
+if __name__ == '__main__':
+    main()
+'''
+
+
+def make_tree(basedir, count):
+    body = '\n'.join(['    x%d = json.dumps({"k": %d})' % (x, x) for x in range(200)])
+    filenames = []
+    for idx in range(count):
+        dirn = os.path.join(basedir, 'group%d' % (idx % 50))
+        if not os.path.exists(dirn):
+            os.makedirs(dirn)
+        fn = os.path.join(dirn, 'synthetic_%d.py' % idx)
+        with open(fn, 'w') as f:
+            f.write(MODULE_TEMPLATE % {'idx': idx, 'body': body})
+        filenames.append(fn)
+    return filenames
+
+
+def fgrep_scan(filenames):
+    # the pre-scanner code path from _index_collections
+    results = {}
+    for mfn in filenames:
+        cmd = 'fgrep "from ansible.module_utils" %s' % mfn
+        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (so, se) = p.communicate()
+        mutils = so.decode('utf-8').split('\n')
+        mutils = [x.strip() for x in mutils if x.strip()]
+        mutils = [x.split()[1] for x in mutils]
+        mutils = ['.'.join(x.split('.')[2:]) for x in mutils]
+        results[mfn] = sorted(set(mutils))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=5000)
+    args = parser.parse_args()
+
+    basedir = tempfile.mkdtemp(prefix='gravity-bench-')
+    try:
+        filenames = make_tree(basedir, args.count)
+
+        t0 = time.time()
+        old = fgrep_scan(filenames)
+        t_old = time.time() - t0
+
+        t0 = time.time()
+        new = scan_module_utils_tree(filenames)
+        t_new = time.time() - t0
+
+        sample = filenames[0]
+        print('modules:       %s' % len(filenames))
+        print('fgrep:         %.2fs' % t_old)
+        print('import_scanner %.2fs' % t_new)
+        print('speedup:       %.1fx' % (t_old / max(t_new, 0.000001)))
+        print('fgrep found:   %s' % old[sample])
+        print('scanner found: %s' % new[sample])
+    finally:
+        shutil.rmtree(basedir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# Package a sample of assembled collections with each rpm payload
+# compression and compare build time, rpm size and read times.
+#
+#   GRAVITY_VAR_DIR=/var/cache/gravity python benchmarks/bench_rpm_compression.py \
+#       --sample 5 --settings gzip:9 gzip:6 xz:2 xz:6 zstd:19 none
+#
+# "query" is `rpm -qlp` when rpm is installed, or else the header read
+# repodata does, which is all rpm -qlp reads too. "unpack" decompresses
+# the payload, the part of an install that depends on the compression.
+
+import argparse
+import glob
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repodata import read_rpm
+from rpm_writer import COMPRESSIONS
+from rpm_writer import RpmWriter
+from rpm_writer import compressions
+from rpm_writer import decompress
+
+
+INSTALL_PATH = '/usr/share/ansible/collections/ansible_collections'
+
+
+def find_collections(top, sample, seed):
+    cdirs = sorted([
+        os.path.dirname(x)
+        for x in glob.glob(os.path.join(top, '*', 'ansible_collections', '*', '*', 'plugins'))
+    ])
+    if sample and sample < len(cdirs):
+        cdirs = sorted(random.Random(seed).sample(cdirs, sample))
+    return cdirs
+
+
+def parse_setting(setting):
+    (compression, _, level) = setting.partition(':')
+    if compression not in COMPRESSIONS:
+        raise SystemExit('unknown compression %s' % compression)
+    if compression not in compressions():
+        return None
+    return (compression, int(level) if level else COMPRESSIONS[compression][0])
+
+
+def best(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def build(cdir, dst, compression, level):
+    (ns, name) = cdir.rstrip('/').split('/')[-2:]
+    rpm = RpmWriter(
+        'ansible-collection-%s' % name,
+        '1.0.0',
+        prefix=os.path.join(INSTALL_PATH, ns, name),
+        compression=compression,
+        level=level
+    )
+    rpm.add_tree(cdir, 'plugins')
+    rpm.write(dst)
+
+
+def query(rpmfile):
+    if shutil.which('rpm'):
+        subprocess.check_output(['rpm', '-qlp', '--nosignature', rpmfile], stderr=subprocess.DEVNULL)
+    else:
+        read_rpm(rpmfile)
+
+
+def unpack(rpmfile, compression):
+    end = read_rpm(rpmfile)['header_end']
+    with open(rpmfile, 'rb') as f:
+        f.seek(end)
+        return len(decompress(f.read(), compression))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--collections',
+        default=os.path.join(os.environ.get('GRAVITY_VAR_DIR', '.cache'), 'collections'),
+        help='assembled collections, <version>/ansible_collections/<ns>/<name>'
+    )
+    parser.add_argument('--sample', type=int, default=5, help='collections to package (0 for all)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--settings', nargs='+',
+        default=['none', 'gzip:6', 'gzip:9', 'bzip2:9', 'xz:2', 'xz:6', 'zstd:3', 'zstd:19'],
+        help='compression[:level] to compare'
+    )
+    args = parser.parse_args()
+
+    cdirs = find_collections(args.collections, args.sample, args.seed)
+    if not cdirs:
+        raise SystemExit('no assembled collections in %s' % args.collections)
+    print('%d collections from %s, best of %d, query by %s' % (
+        len(cdirs), args.collections, args.repeat, 'rpm -qlp' if shutil.which('rpm') else 'header read'
+    ))
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print('%-10s %10s %10s %8s %10s %10s' % ('setting', 'build s', 'size MB', 'ratio', 'query ms', 'unpack s'))
+        for setting in args.settings:
+            parsed = parse_setting(setting)
+            if parsed is None:
+                print('%-10s needs the zstandard module' % setting)
+                continue
+            (compression, level) = parsed
+
+            totals = {'build': 0.0, 'size': 0, 'raw': 0, 'query': 0.0, 'unpack': 0.0}
+            for idx, cdir in enumerate(cdirs):
+                dst = os.path.join(tmpdir, '%s.rpm' % idx)
+                totals['build'] += best(lambda: build(cdir, dst, compression, level), args.repeat)
+                totals['size'] += os.path.getsize(dst)
+                totals['query'] += best(lambda: query(dst), args.repeat)
+                totals['unpack'] += best(lambda: unpack(dst, compression), args.repeat)
+                totals['raw'] += unpack(dst, compression)
+
+            print('%-10s %10.3f %10.2f %8.3f %10.2f %10.3f' % (
+                '%s:%s' % (compression, level),
+                totals['build'],
+                float(totals['size']) / (1024 * 1024),
+                float(totals['size']) / max(totals['raw'], 1),
+                totals['query'] * 1000,
+                totals['unpack'],
+            ))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Compare the old per-module str.replace loop from _assemble_collections
+# against task_rewriter on a synthetic network-sized collection.
+#
+#   python benchmarks/bench_task_rewriter.py --modules 300 --targets 400
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from task_rewriter import ModuleRefRewriter
+
+
+NAMESPACE = 'jctanner'
+NAME = 'network'
+PLATFORMS = ['ios', 'iosxr', 'nxos', 'eos', 'junos', 'vyos', 'aci', 'fortios']
+SUFFIXES = ['command', 'config', 'facts', 'user', 'vlan', 'interface', 'l2_interface',
+            'l3_interface', 'lldp', 'logging', 'static_route', 'system', 'banner',
+            'bgp', 'ospf', 'vrf', 'linkagg', 'lag_interfaces', 'acl', 'snmp']
+
+
+def make_modules(count):
+    modules = []
+    for platform in PLATFORMS:
+        for suffix in SUFFIXES:
+            modules.append('network/%s/%s_%s.py' % (platform, platform, suffix))
+            # names that are prefixes of others trip up substring matching
+            modules.append('network/%s/%s_%s_info.py' % (platform, platform, suffix))
+    return modules[:count]
+
+
+def make_tasks(names, count, seed):
+    rand = random.Random(seed)
+    tasks = []
+    for idx in range(count):
+        name = rand.choice(names)
+        tasks.append(
+            '- name: check %(name)s output %(idx)d\n'
+            '  %(name)s:\n'
+            '    provider: "{{ cli }}"\n'
+            '    lines: hostname test%(idx)d\n'
+            '  register: result\n'
+            '\n'
+            '- assert:\n'
+            '    that:\n'
+            '      - "result.changed == true"\n' % {'name': name, 'idx': idx}
+        )
+    return '\n'.join(tasks)
+
+
+def old_rewrite(ydata, modules):
+    for module in modules:
+        msrc = os.path.basename(module)
+        msrc = msrc.replace('.py', '')
+        msrc = msrc.replace('.ps1', '')
+        msrc = msrc.replace('.ps2', '')
+
+        mdst = '%s.%s.%s' % (NAMESPACE, NAME, msrc)
+
+        if msrc not in ydata or mdst in ydata:
+            continue
+
+        ydata = ydata.replace(msrc+':', mdst+':')
+    return ydata
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', type=int, default=300)
+    parser.add_argument('--targets', type=int, default=400)
+    parser.add_argument('--tasks', type=int, default=40)
+    args = parser.parse_args()
+
+    modules = make_modules(args.modules)
+    names = [os.path.basename(x).replace('.py', '') for x in modules]
+    files = [make_tasks(names, args.tasks, x) for x in range(args.targets)]
+    nbytes = sum([len(x) for x in files])
+
+    t0 = time.time()
+    old = [old_rewrite(x, modules) for x in files]
+    t_old = time.time() - t0
+
+    t0 = time.time()
+    refs = ModuleRefRewriter(modules, NAMESPACE, NAME)
+    new = [refs.rewrite(x)[0] for x in files]
+    t_new = time.time() - t0
+
+    # the old loop skips a module once its fqcn is in the file, and
+    # rewrites ios_facts: inside ios_facts_info: style names
+    differ = len([x for x in range(len(files)) if old[x] != new[x]])
+
+    print('modules:        %s' % len(modules))
+    print('task files:     %s (%.1fMB)' % (len(files), float(nbytes) / (1024 * 1024)))
+    print('replace loop:   %.2fs' % t_old)
+    print('task_rewriter:  %.2fs (including compile)' % t_new)
+    print('speedup:        %.1fx' % (t_old / max(t_new, 0.000001)))
+    print('files differing from the old output: %s' % differ)
+
+
+if __name__ == '__main__':
+    main()
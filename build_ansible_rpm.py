@@ -5,14 +5,19 @@ import os
 import shutil
 import sys
 
-from sh import createrepo
 from sh import find
 from sh import git
 from sh import make
 
 from logzero import logger
 
+from materialize import Materializer
+from path_whitelist import DROP
+from path_whitelist import PathWhitelist
+from repodata import update_repodata
 
+
+# what the plugin directories below keep, as paths relative to them
 FRAGMENT_WHITELIST = [
     '__init__.py',
     'default_callback.py',
@@ -21,30 +26,88 @@ FRAGMENT_WHITELIST = [
 
 
 MODULE_WHITELIST = [
-    'modules/__init__.py',
+    '__init__.py',
 ]
 
 
 MODULE_UTIL_WHITELIST = [
-    'module_utils/__init__.py',
-    'module_utils/common',
-    'module_utils/compat',
-    'module_utils/distro',
-    'module_utils/facts',
-    'module_utils/parsing',
-    '_text',
-    'basic',
+    '__init__.py',
+    'common',
+    'compat',
+    'distro',
+    'facts',
+    'parsing',
+    '_text.py',
+    'basic.py',
     'connection.py',
-    'json_utils',
-    'pycompat24',
+    'json_utils.py',
+    'pycompat24.py',
     'six',
-    'urls',
+    'urls.py',
 ]
 
 
+STAGING_WHITELIST = {
+    #'lib/ansible/utils/module_docs_fragments': FRAGMENT_WHITELIST,
+    'lib/ansible/plugins/doc_fragments': FRAGMENT_WHITELIST,
+    'lib/ansible/modules': MODULE_WHITELIST,
+    'lib/ansible/module_utils': MODULE_UTIL_WHITELIST,
+}
+
+
+# make writes into the build checkout, so it must not share inodes with
+# the source checkout: reflink (copy-on-write) or copy, never hardlink
+STAGING_MODES = ['reflink', 'copy']
+
+
+def stage_checkout(src_dir, dst_dir, materialize='reflink'):
+    '''Materialize src_dir in dst_dir, minus what the whitelists leave out
+
+    Only the files that are kept are cloned or copied, and whatever an
+    earlier staging left in dst_dir that is not kept is pruned. .git is
+    staged too, the Makefile takes the version and release from git.
+    Symlinks, to files or dirs, are staged as the same symlinks.
+    '''
+    if materialize not in STAGING_MODES:
+        raise ValueError('can not stage a build checkout with %s' % materialize)
+    whitelist = PathWhitelist(STAGING_WHITELIST)
+    mat = Materializer(mode=materialize)
+    for (dirpath, dirnames, filenames) in os.walk(src_dir):
+        reldir = os.path.relpath(dirpath, src_dir)
+        ddir = os.path.join(dst_dir, reldir)
+        if not os.path.exists(ddir):
+            os.makedirs(ddir)
+
+        # os.walk lists symlinked dirs but does not go into them
+        links = [x for x in dirnames if os.path.islink(os.path.join(dirpath, x))]
+        dirnames[:] = [
+            x for x in dirnames
+            if x not in links and whitelist.match(os.path.join(reldir, x)) != DROP
+        ]
+        for fn in filenames + links:
+            if whitelist.match(os.path.join(reldir, fn)) == DROP:
+                continue
+            fsrc = os.path.join(dirpath, fn)
+            fdst = os.path.join(ddir, fn)
+            if os.path.islink(fsrc):
+                mat.link(os.readlink(fsrc), fdst)
+                continue
+            if os.path.islink(fdst):
+                os.remove(fdst)
+            elif os.path.exists(fdst) and os.path.samefile(fsrc, fdst):
+                # hardlinked by an older staging
+                os.remove(fdst)
+            mat.place(fsrc, fdst)
+    mat.prune(dst_dir)
+    mat.report()
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--noclean', action='store_true')
+    parser.add_argument('--materialize', choices=STAGING_MODES, default='reflink',
+        help='how checkout files get into the build checkout (reflink falls back to copy)'
+    )
     args = parser.parse_args()
 
 
@@ -60,69 +123,8 @@ def main():
         logger.info('cloning source repo')
         git.clone('--branch=%s' % src_branch, src_repo, src_dir)
 
-    logger.info('copying source checkout to build checkout')
-    if os.path.exists(dst_dir):
-        shutil.rmtree(dst_dir)
-    shutil.copytree(src_dir, dst_dir)
-
-    logger.info('cleaning out fragments')
-    #mdfd = os.path.join(dst_dir, 'lib', 'ansible', 'utils', 'module_docs_fragments')
-    mdfd = os.path.join(dst_dir, 'lib', 'ansible', 'plugins', 'doc_fragments')
-    fragments = find(mdfd)
-    fragments = [x.strip() for x in fragments if x.strip()]
-    for ff in fragments:
-        if not os.path.exists(ff):
-            continue
-        if ff == mdfd:
-            continue
-        found = False
-        for wl in FRAGMENT_WHITELIST:
-            if wl in ff:
-                found = True
-                break
-        if not found:
-            if os.path.isdir(ff):
-                shutil.rmtree(ff)
-            else:
-                os.remove(ff)
-
-    logger.info('cleaning out modules')
-    module_files = find(os.path.join(dst_dir, 'lib', 'ansible', 'modules'))
-    module_files = [x.strip() for x in module_files]
-    for mf in module_files:
-        if mf.endswith('/modules'):
-            continue
-        if not os.path.exists(mf):
-            continue
-        found = False
-        for wl in MODULE_WHITELIST:
-            if wl in mf:
-                found = True
-                break
-        if not found:
-            if os.path.isdir(mf):
-                shutil.rmtree(mf)
-            else:
-                os.remove(mf)
-
-    logger.info('cleaning out module utils')
-    module_util_files = find(os.path.join(dst_dir, 'lib', 'ansible', 'module_utils'))
-    module_util_files = [x.strip() for x in module_util_files]
-    for muf in module_util_files:
-        if muf.endswith('/module_utils'):
-            continue
-        if not os.path.exists(muf):
-            continue
-        found = False
-        for wl in MODULE_UTIL_WHITELIST:
-            if wl in muf:
-                found = True
-                break
-        if not found:
-            if os.path.isdir(muf):
-                shutil.rmtree(muf)
-            else:
-                os.remove(muf)
+    logger.info('staging the whitelisted source checkout')
+    stage_checkout(src_dir, dst_dir, materialize=args.materialize)
 
     logger.info('running "make rpm"')
     try:
@@ -133,12 +135,8 @@ def main():
         print(e.stderr)
         sys.exit(1)
 
-    logger.info('cleaning out old repo metadata')
     #repodir = '/var/cache/gravity/repos/rpm'
     repodir = 'cache/repos/rpm'
-    repodata_dir = os.path.join(repodir, 'repodata')
-    if os.path.exists(repodata_dir):
-        shutil.rmtree(repodata_dir)
 
     logger.info('removing old ansible rpms from repo path')
     rpms = find(
@@ -160,8 +158,8 @@ def main():
     for rpm in rpms:
         shutil.copy(rpm.strip(), repodir)
 
-    logger.info('creating repo')
-    createrepo('.', _cwd=repodir)
+    logger.info('updating repo metadata')
+    update_repodata(repodir, 'cache/repos/rpm-repodata-cache.json')
 
 
 if __name__ == "__main__":
@@ -4,24 +4,66 @@ import argparse
 import json
 #import logging
 import glob
+import io
+import multiprocessing
 import os
 import requests
 import shutil
+import stat
 import subprocess
 import sys
+import tempfile
+import time
+import traceback
 import yaml
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
 from bs4 import BeautifulSoup
 from logzero import logger
-from sh import createrepo
-from sh import git
-from sh import find as shfind
+
+from assembly_manifest import build_manifest
+from assembly_manifest import digest_sources
+from assembly_manifest import read_manifest
+from devel_source import DevelSource
+from devel_source import worktree_label
+from devel_source import worktree_name
+from doc_fragments import find_doc_fragments
+from downloader import download_files
+from downloader import fetch_listing
+from downloader import make_session
+from galaxy_artifact import artifact_name
+from galaxy_artifact import build_artifact
+from import_rewriter import REWRITER_VERSION
+from import_rewriter import module_util_table
+from import_rewriter import rewrite_imports
+from import_rewriter import rewrite_unit_imports
+from import_scanner import find_module_utils_imports
+from index_cache import IndexCache
+from materialize import MODES as MATERIALIZE_MODES
+from materialize import Materializer
+from output_writer import OutputWriter
+from release_manifest import ReleaseManifest
+from release_source import extract_members
+from release_source import extract_releases
+from release_source import open_release
+from release_tests import ReleaseTestIndex
+from repodata import update_repodata
+from rpm_writer import COMPRESSIONS as RPM_COMPRESSIONS
+from rpm_writer import DEFAULT_COMPRESSION as RPM_DEFAULT_COMPRESSION
+from rpm_writer import RpmWriter
+from rpm_writer import compressions as rpm_compressions
+from task_rewriter import ModuleRefRewriter
 
 
 #DEVEL_URL = 'https://github.com/nitzmahone/ansible.git'
 DEVEL_URL = 'https://github.com/ansible/ansible.git'
 #DEVEL_BRANCH = 'collection_content_load'
 DEVEL_BRANCH = 'devel'
+# partial clone, or set a depth for a shallow one instead
+DEVEL_CLONE_FILTER = 'blob:none'
+DEVEL_DEPTH = None
 
 #VARDIR = os.environ.get('GRAVITY_VAR_DIR', '/var/cache/gravity')
 VARDIR = os.environ.get('GRAVITY_VAR_DIR', '.cache')
@@ -32,6 +74,19 @@ COLLECTION_NAMESPACE = 'jctanner'
 COLLECTION_PACKAGE_PREFIX = 'ansible-collection-'
 COLLECTION_PREFIX = ''
 COLLECTION_INSTALL_PATH = '/usr/share/ansible/collections/ansible_collections'
+INDEX_CACHE_MAX_ENTRIES = 200000
+# bump when _assemble_collection changes what it writes
+ASSEMBLY_VERSION = 3
+# where a release keeps its doc fragments, before and since 2.8
+DOC_FRAGMENT_DIRS = [
+    'lib/ansible/utils/module_docs_fragments/',
+    'lib/ansible/plugins/doc_fragments/',
+]
+RPM_BUILDERS = ['fpm', 'native']
+# the payload compressions fpm knows
+FPM_COMPRESSIONS = ['bzip2', 'gzip', 'none', 'xz']
+# bump when build_artifact changes what it writes
+GALAXY_ARTIFACT_VERSION = 1
 MODULE_UTIL_BLACKLIST = [
     '_text',
     'basic',
@@ -55,64 +110,6 @@ MODULE_UTIL_BLACKLIST = [
 ]
 
 
-def clean_extra_lines(rawtext):
-    lines = rawtext.split('\n')
-
-    imports_start = None
-    imports_stop = None
-    for idx,x in enumerate(lines):
-        if imports_start is None:
-            if x.startswith('from ') and not 'absolute_import' in x:
-                imports_start = idx
-                continue
-
-        if not x:
-            continue
-
-        if x.startswith('from '):
-            continue
-
-        if imports_start and imports_stop is None:
-            if x[0].isalnum():
-                imports_stop = idx
-                break
-
-    empty_lines = [x for x in range(imports_start, imports_stop)]
-    empty_lines = [x for x in empty_lines if not lines[x].strip()]
-
-    if not empty_lines:
-        return rawtext
-
-    if len(empty_lines) == 1:
-        return rawtext
-
-    # keep 2 empty lines between imports and definitions
-    if len(empty_lines) == 2 and (empty_lines[-1] - empty_lines[-2] == 1):
-        return rawtext
-
-    print(lines[imports_start:imports_stop])
-
-    while empty_lines:
-        try:
-            print('DELETING: %s' % lines[empty_lines[0]])
-        except IndexError as e:
-            print(e)
-            import epdb; epdb.st()
-        del lines[empty_lines[0]]
-        del empty_lines[0]
-        empty_lines = [x-1 for x in empty_lines]
-        if [x for x in empty_lines if x <= 0]:
-            break
-
-        if len(empty_lines) <= 2:
-            break
-
-        #import epdb; epdb.st()
-
-    rawtext = '\n'.join(lines)
-    return rawtext
-
-
 def _run_command(cmd):
     logger.debug(cmd)
     if not isinstance(cmd, bytes):
@@ -130,6 +127,21 @@ def _run_command(cmd):
     return (p.returncode, so, se)
 
 
+def write_json_atomic(filename, data):
+    # readers (and parallel indexers) never see a half written file
+    dirn = os.path.dirname(filename)
+    (fd, tmpfile) = tempfile.mkstemp(dir=dirn, prefix='.' + os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(data, indent=2, sort_keys=True))
+        os.chmod(tmpfile, 0o644)
+        os.rename(tmpfile, filename)
+    except Exception:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        raise
+
+
 def run_command(cmd=None):
     (rc, so, se) = _run_command(cmd)
     return {
@@ -162,9 +174,23 @@ def version_from_tar(tb):
             if fline.startswith('__version__'):
                 eversion = fline.strip().split()[-1].replace('"', '').replace("'", '')
                 break
+        if tb != 'devel.git':
+            # a devel ref worktree, kept apart from devel by build metadata
+            eversion = '%s+%s' % (eversion, worktree_label(tb))
     return eversion
 
 
+def _release_trees(releasedir, devel_only=False, devel_refs=None):
+    '''the tarballs, devel.git and the worktree of each extra devel ref'''
+    tarballs = []
+    if not devel_only:
+        tarballs += glob.glob('%s/*.tar.gz' % releasedir)
+    tarballs += ['devel.git']
+    for ref in (devel_refs or []):
+        tarballs.append(worktree_name(ref))
+    return sorted(tarballs)
+
+
 def is_current_tar(tarfile):
     thisversion = tarfile.replace('ansible-', '')
     if thisversion[0] != '2':
@@ -174,31 +200,39 @@ def is_current_tar(tarfile):
     return True
 
 
-def get_releases(refresh=False, devel_only=False):
+def get_releases(refresh=False, devel_only=False, extract=True, download_jobs=4,
+                 extract_jobs=4, extract_prefixes=None, devel_refs=None):
 
     cachedir = os.path.join(VARDIR, 'releases')
     if not os.path.exists(cachedir):
         os.makedirs(cachedir)
 
-    # make a devel checkout
+    # make (or update) the devel checkout, plus a worktree per extra ref
     dpath = os.path.join(cachedir, 'devel.git')
-    cmd = 'git clone %s %s' % (DEVEL_URL, dpath)
-    logger.info(cmd)
-    if not os.path.exists(dpath):
-        git.clone(DEVEL_URL, dpath)
-    if DEVEL_BRANCH:
-        (rc, so, se) = _run_command('cd %s; git branch | egrep --color=never ^\\* | head -n1' % dpath)
-        thisbranch = so.replace('*', '').strip()
-        if thisbranch != DEVEL_BRANCH:
-            logger.debug('%s != %s' % (thisbranch, DEVEL_BRANCH))
-            (rc, so, se) = _run_command('cd %s; git checkout %s' % (dpath, DEVEL_BRANCH))
-            assert rc == 0
+    devel = DevelSource(
+        DEVEL_URL,
+        dpath,
+        branch=DEVEL_BRANCH,
+        clone_filter=DEVEL_CLONE_FILTER,
+        depth=DEVEL_DEPTH
+    )
+    devel.update(fetch=refresh)
+    for ref in (devel_refs or []):
+        devel.add_worktree(ref, os.path.join(cachedir, worktree_name(ref)), fetch=refresh)
 
     if not devel_only:
+        # sizes, checksums and validators of everything fetched so far
+        manifest = ReleaseManifest(os.path.join(cachedir, 'manifest.json'))
+        session = make_session(pool_size=download_jobs)
         baseurl = 'https://releases.ansible.com/ansible/'
         logger.info('fetch %s' % baseurl)
-        rr = requests.get(baseurl)
-        soup = BeautifulSoup(rr.text, u'html.parser')
+        listing = fetch_listing(
+            session,
+            baseurl,
+            os.path.join(cachedir, 'index.html'),
+            manifest=manifest
+        )
+        soup = BeautifulSoup(listing, u'html.parser')
         links = soup.findAll('a')
         hrefs = [x.attrs['href'] for x in links]
         tarballs = [x for x in hrefs if x.endswith('tar.gz')]
@@ -214,114 +248,162 @@ def get_releases(refresh=False, devel_only=False):
         tarballs = sorted(tarballs)
         logger.info('%s tarballs found' % len(tarballs))
 
+        # fetch the tarballs, the manifest decides what needs the network
+        downloads = []
         for tb in tarballs:
-            # fetch the tarball
             logger.info('release tarball %s' % tb)
             url = baseurl + '/' + tb
             dst = os.path.join(cachedir, tb)
-            if not os.path.exists(dst):
-                logger.info('fetching %s' % url)
-                rr = requests.get(url, allow_redirects=True)
-                open(dst, 'wb').write(rr.content)
-
-            # extract the tarball
-            edir = tb.replace('.tar.gz', '')
-            epath = os.path.join(cachedir, edir)
-            if not os.path.exists(epath):
-                logger.info('extracting %s' % tb)
-                cmd = 'cd %s; tar xzvf %s' % (cachedir, tb)
-                p = subprocess.Popen(
-                    cmd,
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                )
-                (so, se) = p.communicate()
+            downloads.append((url, dst))
+        results = download_files(
+            downloads,
+            jobs=download_jobs,
+            session=session,
+            manifest=manifest,
+            revalidate=refresh
+        )
+        manifest.save()
+
+        if not extract:
+            for res in results:
+                if res['status'] not in ['fetched', 'resumed']:
+                    continue
+                # new bytes, the partial extraction assembly made is stale
+                epath = res['dst'].replace('.tar.gz', '')
+                if os.path.exists(epath):
+                    shutil.rmtree(epath)
+
+        if extract:
+            # extract the tarballs, unchanged ones are skipped by their marker
+            paths = []
+            digests = {}
+            for (url, dst) in downloads:
+                if not os.path.exists(dst):
+                    continue
+                paths.append(dst)
+                entry = manifest.get(url)
+                if entry:
+                    digests[dst] = entry.get('sha256')
+            extract_releases(
+                paths,
+                cachedir,
+                prefixes=extract_prefixes,
+                digests=digests,
+                jobs=extract_jobs
+            )
 
     return {}
 
 
-def index_collections(devel_only=False, refresh=False, filters=None, force=False):
+def index_collections(devel_only=False, refresh=False, filters=None, force=False, jobs=1, stream=False,
+                      devel_refs=None):
     #cachedir = os.path.join(VARDIR, 'collections')
     rpmdir = os.path.join(VARDIR, 'repos', 'rpm')
     releasedir = os.path.join(VARDIR, 'releases')
     colbasedir = os.path.join(VARDIR, 'collections')
 
-    tarballs = []
-    if not devel_only:
-        tarballs += glob.glob('%s/*.tar.gz' % releasedir)
-    tarballs += ['devel.git']
+    # create it here so the workers don't race on it
+    metadir = os.path.join(VARDIR, 'meta')
+    if not os.path.exists(metadir):
+        os.makedirs(metadir)
 
-    tarballs = sorted(tarballs)
+    tarballs = _release_trees(releasedir, devel_only=devel_only, devel_refs=devel_refs)
 
-    for tb in tarballs:
-        _index_collections(tb, releasedir, colbasedir, refresh=refresh, filters=filters)
+    results = []
+    if jobs and jobs > 1:
+        logger.info('indexing %s releases with %s jobs' % (len(tarballs), jobs))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(
+                    _index_release, tb, releasedir, colbasedir, refresh, filters, stream, force
+                )
+                for tb in tarballs
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+    else:
+        for tb in tarballs:
+            results.append(
+                _index_release(tb, releasedir, colbasedir, refresh, filters, stream, force)
+            )
 
+    results = sorted(results, key=lambda x: x['release'])
+    for res in results:
+        if res['error']:
+            logger.error('index %s failed after %.2fs: %s' % (res['release'], res['duration'], res['error']))
+        else:
+            logger.info('index %s finished in %.2fs' % (res['release'], res['duration']))
 
-def _index_collections(tb, releasedir, colbasedir, refresh=False, filters=None):
+    return results
 
-    metadir = os.path.join(VARDIR, 'meta')
-    if not os.path.exists(metadir):
-        os.makedirs(metadir)
 
-    istar = True
-    if not tb.endswith('tar.gz') or tb.endswith('.git'):
-        istar = False
+def _index_release(tb, releasedir, colbasedir, refresh, filters, stream=False, force=False):
+    # one release's failure is reported, it does not stop the others
+    res = {
+        'release': os.path.basename(tb),
+        'duration': None,
+        'error': None,
+        'traceback': None,
+    }
+    t0 = time.time()
+    try:
+        _index_collections(
+            tb,
+            releasedir,
+            colbasedir,
+            refresh=refresh,
+            filters=filters,
+            stream=stream,
+            force=force
+        )
+    except Exception as e:
+        res['error'] = '%s: %s' % (type(e).__name__, e)
+        res['traceback'] = traceback.format_exc()
+    res['duration'] = time.time() - t0
+    return res
 
-    logger.info('index %s' % tb)
-    tbbn = os.path.basename(tb)
 
-    if istar:
-        edir = tbbn.replace('.tar.gz', '')
-    else:
-        edir = tb
+def _scan_module_source(mfn, source):
+    # everything the index needs from one module file, keyed by its
+    # content in the index cache
+    scanned = {
+        'module_utils': [],
+        'docs_fragments': None,
+        'status': 'ok'
+    }
 
-    eversion = version_from_tar(tb)
+    #from random import randint
+    #from ansible.module_utils.basic import AnsibleModule
+    #from ansible.module_utils._text import to_text, to_native
+    #from ansible.module_utils.vmware import ...
+    scanned['module_utils'] = find_module_utils_imports(source, filename=mfn)
 
-    jf = os.path.join(metadir, 'ansible-' + eversion + '-meta.json')
-    if os.path.exists(jf) and not refresh:
-        return
+    if mfn.endswith('.py'):
+        (fragments, status) = find_doc_fragments(
+            io.StringIO(source.decode('utf-8', 'replace')),
+            filename=mfn
+        )
+        scanned['docs_fragments'] = fragments
+        scanned['status'] = status
 
-    cmd = 'cd %s/lib/ansible/modules ; find . -type d' % os.path.join(releasedir, edir)
-    logger.info(cmd)
-    (rc, so, se) = _run_command(cmd)
-    logger.info('%s rc: %s' % (cmd, rc))
-    if rc != 0:
-        logger.info(se)
-    dirs = [x.strip() for x in so.split('\n')if x.strip()]
+    return scanned
 
-    cmd = 'cd %s/lib/ansible/modules ; find . -type f' % os.path.join(releasedir, edir)
-    logger.info(cmd)
-    (rc, so, se) = _run_command(cmd)
-    logger.info('%s rc: %s' % (cmd, rc))
-    if rc != 0:
-        logger.info(se)
-    files = [x.strip() for x in so.split('\n') if x.strip()]
 
-    if filters:
-        for filen in files[:]:
-            include = True
-            for filtern in filters:
-                if filtern not in filen:
-                    include = False
-                    break
-            if not include:
-                files.remove(filen)
+def _new_collection(dirn, basedir, eversion):
+    return {
+        'basedir': basedir,
+        'name': COLLECTION_PREFIX + dirn.replace('/', '_'),
+        'version': eversion,
+        'action': [],
+        'modules': [],
+        'module_utils': [],
+        'docs_fragments': [],
+    }
 
-    collections = {}
-    for dirn in dirs:
-        dirn = dirn.lstrip('./')
-        if not dirn:
-            continue
-        collections[dirn] = {}
-        collections[dirn]['basedir'] = os.path.join(releasedir, edir)
-        collections[dirn]['name'] = COLLECTION_PREFIX + dirn.replace('/', '_')
-        collections[dirn]['version'] = eversion
-        collections[dirn]['action'] = []
-        collections[dirn]['modules'] = []
-        collections[dirn]['module_utils'] = []
-        collections[dirn]['docs_fragments'] = []
 
+def _scan_modules(files, release, basedir, cache):
+    # fn -> the parts of _scan_module_source the meta is built from
+    scanned = {}
     for fn in files:
 
         logger.info(fn)
@@ -331,95 +413,58 @@ def _index_collections(tb, releasedir, colbasedir, refresh=False, filters=None):
             continue
         if os.path.basename(fn) == '__init__.py':
             continue
-        collections[dirn]['modules'].append(fn)
-        mfn = os.path.join(releasedir, edir, 'lib', 'ansible', 'modules', fn)
+        mfn = os.path.join(basedir, 'lib', 'ansible', 'modules', fn)
+
+        source = release.read(mfn)
+        result = cache.get_or_compute(
+            source,
+            lambda x: _scan_module_source(mfn, x),
+            kind=os.path.splitext(mfn)[1]
+        )
+        if result['status'] != 'ok':
+            logger.info('%s %s' % (mfn, result['status']))
+        logger.info(result['module_utils'])
+
+        scanned[fn] = {
+            'module_utils': result['module_utils'],
+            'docs_fragments': result['docs_fragments'],
+        }
+    return scanned
 
-        #from random import randint
-        #from ansible.module_utils.basic import AnsibleModule
-        #from ansible.module_utils._text import to_text, to_native
-        #from ansible.module_utils.vmware import ...
-        cmd = 'fgrep "from ansible.module_utils" %s' % mfn
-        (rc, so, se) = _run_command(cmd)
-        if rc != 0:
-            logger.info('%s rc:%s' % (cmd, rc))
-            logger.info(se)
-        logger.info(so)
-        mutils = so.split('\n')
-        mutils = [x.strip() for x in mutils if x.strip()]
-        mutils = [x.split()[1] for x in mutils]
-
-        for idx,x in enumerate(mutils):
-            try:
-                parts = x.split('.')
-                mutils[idx] = '.'.join(parts[2:])
-            except:
-                logger.info('can not split %s' % x)
-
-        collections[dirn]['module_utils'] += mutils
-        collections[dirn]['module_utils'] = \
-            sorted(set(collections[dirn]['module_utils']))
-
-        if mfn.endswith('.py'):
-            docs = []
-            indocs = False
-            with open(mfn, 'r') as f:
-                for line in f.readlines():
-                    if line.startswith('DOCUMENTATION'):
-                        indocs = True
-                    if line.lstrip().startswith("'''") or line.lstrip().startswith('"""'):
-                        break
-                    if indocs:
-                        docs.append(line)
-
-            fragments = None
-            try:
-                ydocs = yaml.load(''.join(docs[1:]))
-                if ydocs is not None and 'extends_documentation_fragment' in ydocs:
-                    fragments = \
-                        ydocs['extends_documentation_fragment']
-            except Exception as e:
-                fragment_index = None
-                for idx,x in enumerate(docs):
-                    if 'extends_documentation_fragment' in x:
-                        fragment_index = idx
-                        break
-                if fragment_index is not None:
-                    try:
-                        fdoc = yaml.load(''.join(docs[fragment_index:]))
-                    except Exception as e:
-                        import epdb; epdb.st()
-                    fragments = fdoc.get('extends_documentation_fragment')
-                    #import epdb; epdb.st()
 
-            if fragments is not None and not isinstance(fragments, list):
-                fragments = [fragments]
-                #print(fragments)
-                #import epdb; epdb.st()
+def _aggregate_modules(collections, scanned, keys=None):
+    # (re)build modules, module_utils and docs_fragments of each collection
+    # from the per-module scan results
+    for k,v in collections.items():
+        if keys is None or k in keys:
+            v['modules'] = []
+            v['module_utils'] = []
+            v['docs_fragments'] = []
 
-                #if 'ipa.documentation' in fragments:
-                #    import epdb; epdb.st()
+    for fn in sorted(scanned.keys()):
+        dirn = os.path.dirname(fn)
+        if keys is not None and dirn not in keys:
+            continue
+        collections[dirn]['modules'].append(fn)
+        collections[dirn]['module_utils'] += scanned[fn]['module_utils']
+        if scanned[fn]['docs_fragments'] is not None:
+            collections[dirn]['docs_fragments'] += scanned[fn]['docs_fragments']
 
-            if fragments is not None:
-                collections[dirn]['docs_fragments'] += fragments
-                collections[dirn]['docs_fragments'] = \
-                    sorted(set(collections[dirn]['docs_fragments']))
+    for k,v in collections.items():
+        if keys is None or k in keys:
+            v['module_utils'] = sorted(set(v['module_utils']))
+            v['docs_fragments'] = sorted(set(v['docs_fragments']))
 
-    '''TBD
-    # look for action plugins
-    cmd = 'cd %s/lib/ansible/plugins/action ; find . -type f' % os.path.join(releasedir, edir)
-    (rc, so, se) = _run_command(cmd)
-    filens = [x.strip() for x in so.split('\n') if x.strip()]
-    filens = [x.replace('./', '', 1) for x in filens]
-    for filen in filens:
-        import epdb; epdb.st()
-    '''
 
+def _discover_tests(collections, release, rdir, keys=None):
     # find test(s)
-    rdir = os.path.join(releasedir, edir)
-    target_dir = os.path.join(rdir, 'test', 'integration', 'targets')
-    units_dir = os.path.join(rdir, 'test', 'units')
+    tindex = ReleaseTestIndex(rdir, entries=release.test_entries(), read=release.read)
+    units_dir = tindex.units_dir
 
     for k,v in collections.items():
+        if keys is not None and k not in keys:
+            continue
+
         units = []
         targets = []
         for module_filepath in v['modules']:
@@ -428,34 +473,21 @@ def _index_collections(tb, releasedir, colbasedir, refresh=False, filters=None):
             mname = mname.replace('.ps1', '')
             mname = mname.replace('.ps2', '')
 
-            mtdir = os.path.join(target_dir, mname)
-            if os.path.exists(mtdir):
+            if tindex.target_exists(mname):
                 targets.append(mname)
 
             mufile = 'test_' + mname + '.py'
-            cmd = 'find %s -type f -name "%s"' % (units_dir, mufile)
-            res = run_command(cmd)
-            if res['rc'] == 0:
-                units.append(res['so'].strip())
+            units.append('\n'.join(tindex.find_unit_files(mufile)))
 
         mudir = os.path.join(units_dir, 'modules', k)
-        if os.path.exists(mudir):
+        if tindex.unit_exists(mudir):
             thisdir = os.path.join('modules', k)
             units.append(thisdir)
 
-            cmd = 'find %s -type f -name "*.py"' % (mudir)
-            res = run_command(cmd)
-            unit_files = [x.strip() for x in res['so'].split('\n') if x.strip()]
-            for _uf in unit_files:
-                with open(_uf, 'r') as f:
-                    uflines = f.readlines()
-                ufdata = '\n'.join(uflines)
-
-                # need the conftest file for these tests
-                # .cache/releases/devel.git/test/units/modules/conftest.py
-                if 'patch_ansible_module' in ufdata:
-                    units.append('modules/conftest.py')
-                    #import epdb; epdb.st()
+            # need the conftest file for these tests
+            # .cache/releases/devel.git/test/units/modules/conftest.py
+            if tindex.uses_patch_ansible_module(mudir):
+                units.append('modules/conftest.py')
 
         if '/' in k:
             fudir = os.path.join(units_dir, 'module_utils', k.split('/')[1])
@@ -463,9 +495,9 @@ def _index_collections(tb, releasedir, colbasedir, refresh=False, filters=None):
         else:
             fudir = os.path.join(units_dir, 'module_utils', k)
             funame = os.path.join(units_dir, 'module_utils', 'test_' + k + '.py')
-        if os.path.exists(fudir):
+        if tindex.unit_exists(fudir):
             units.append(fudir.replace(units_dir + '/', ''))
-        if os.path.exists(funame):
+        if tindex.unit_exists(funame):
             units.append(funame.replace(units_dir + '/', ''))
 
         collections[k]['units'] = sorted(set([x for x in units[:] if x]))
@@ -473,18 +505,13 @@ def _index_collections(tb, releasedir, colbasedir, refresh=False, filters=None):
 
         # look for integration target imports
         for target in targets:
-            thistarget = os.path.join(target_dir, target)
-            cmd = 'find %s -type f -name "*.yml"' % (thistarget)
-            res = run_command(cmd)
-            yfiles = res['so'].split('\n')
-            yfiles = [x.strip() for x in yfiles if x.strip()]
+            yfiles = tindex.target_yaml_files(target)
 
             for yf in yfiles:
-                with open(yf, 'r') as f:
-                    _ydata = f.read()
+                _ydata = release.read(yf).decode('utf-8', 'replace')
 
                 try:
-                    ydata = yaml.load(_ydata.replace('!unsafe', ''))
+                    ydata = yaml.load(_ydata.replace('!unsafe', ''), Loader=yaml.SafeLoader)
                 except Exception as e:
                     logger.error(e)
                     #import epdb; epdb.st()
@@ -506,32 +533,227 @@ def _index_collections(tb, releasedir, colbasedir, refresh=False, filters=None):
                         if 'name' in task[key]:
                             dependency = task[key]['name']
                         else:
-                            logger.error('NO NAME!!!')
-                            import epdb; epdb.st()
+                            logger.warning('%s: %s without a role name, skipping it' % (yf, key))
+                            continue
 
                     if dependency:
                         if dependency not in collections[k]['targets']:
                             collections[k]['targets'].append(dependency)
 
+
+def _git_head(rdir):
+    if not os.path.exists(os.path.join(rdir, '.git')):
+        return None
+    (rc, so, se) = _run_command('cd %s; git rev-parse HEAD' % rdir)
+    if rc != 0:
+        logger.error(se)
+        return None
+    return so.strip()
+
+
+def _state_sha(sf):
+    # the git sha the meta was indexed at, if it was indexed from a checkout
+    if not os.path.exists(sf):
+        return None
+    with open(sf, 'r') as f:
+        return json.loads(f.read()).get('sha')
+
+
+def _tests_affected(collections, path):
+    # which collections' units/targets can change when this test file does
+    affected = set()
+    parts = path.split('/')
+    bn = parts[-1]
+    for k,v in collections.items():
+        mnames = [
+            os.path.splitext(os.path.basename(x))[0] for x in v['modules']
+        ]
+        if path.startswith('test/units/'):
+            if path.startswith('test/units/modules/' + k + '/'):
+                affected.add(k)
+            if bn.startswith('test_') and bn[5:].replace('.py', '') in mnames:
+                affected.add(k)
+            funame = k.split('/')[1] if '/' in k else k
+            if path.startswith('test/units/module_utils/'):
+                if parts[3] in [funame, 'test_' + funame + '.py']:
+                    affected.add(k)
+        elif path.startswith('test/integration/targets/') and len(parts) > 3:
+            if parts[3] in mnames or parts[3] in v.get('targets', []):
+                affected.add(k)
+    return affected
+
+
+def _index_collections_incremental(release, rdir, basedir, eversion, jf, sf, cache):
+    # patch the meta of a git checkout using the diff since the last index,
+    # returns (collections, state) or None when a full index is needed
+    if not os.path.exists(jf) or not os.path.exists(sf):
+        return None
+    with open(jf, 'r') as f:
+        collections = json.loads(f.read())
+    with open(sf, 'r') as f:
+        state = json.loads(f.read())
+
+    head = _git_head(rdir)
+    if not head or not state.get('sha'):
+        return None
+    if head == state['sha']:
+        logger.info('%s is still at %s' % (rdir, head))
+        return (collections, state)
+
+    cmd = 'cd %s; git diff --name-status --no-renames %s %s' % (rdir, state['sha'], head)
+    (rc, so, se) = _run_command(cmd)
+    if rc != 0:
+        logger.error('%s rc: %s' % (cmd, rc))
+        logger.error(se)
+        return None
+    changes = [x.split('\t', 1) for x in so.split('\n') if x.strip()]
+    logger.info('%s files changed between %s and %s' % (len(changes), state['sha'], head))
+
+    # pick up new and removed collection dirs
+    dirs = [x.lstrip('./') for x in release.module_dirs()]
+    dirs = [x for x in dirs if x]
+    affected = set()
+    for dirn in dirs:
+        if dirn not in collections:
+            collections[dirn] = _new_collection(dirn, basedir, eversion)
+            affected.add(dirn)
+    for dirn in list(collections.keys()):
+        if dirn not in dirs:
+            del collections[dirn]
+
+    modules_prefix = 'lib/ansible/modules/'
+    rescan = []
+    for (status, path) in changes:
+        if path.startswith(modules_prefix):
+            fn = path[len(modules_prefix):]
+            affected.add(os.path.dirname(fn))
+            state['modules'].pop(fn, None)
+            mfn = os.path.join(rdir, path)
+            if not status.startswith('D') and os.path.isfile(mfn) and not os.path.islink(mfn):
+                rescan.append('./' + fn)
+        elif path.startswith('lib/ansible/module_utils/') or 'doc_fragments' in path:
+            # the meta only records names, assembly picks up the content
+            logger.info('%s %s' % (status, path))
+
+    state['modules'].update(_scan_modules(rescan, release, basedir, cache))
+    affected = set([x for x in affected if x in collections])
+    _aggregate_modules(collections, state['modules'], keys=affected)
+
+    for (status, path) in changes:
+        if path.startswith('test/'):
+            affected.update(_tests_affected(collections, path))
+    _discover_tests(collections, release, rdir, keys=affected)
+
+    logger.info('reindexed %s collections: %s' % (len(affected), sorted(affected)))
+    state['sha'] = head
+    return (collections, state)
+
+
+def _index_collections(tb, releasedir, colbasedir, refresh=False, filters=None, stream=False, force=False):
+
+    metadir = os.path.join(VARDIR, 'meta')
+    if not os.path.exists(metadir):
+        os.makedirs(metadir)
+
+    istar = True
+    if not tb.endswith('tar.gz') or tb.endswith('.git'):
+        istar = False
+
+    logger.info('index %s' % tb)
+    tbbn = os.path.basename(tb)
+
+    if istar:
+        edir = tbbn.replace('.tar.gz', '')
+    else:
+        edir = tb
+
+    eversion = version_from_tar(tb)
+
+    jf = os.path.join(metadir, 'ansible-' + eversion + '-meta.json')
+
+    # what was indexed (git sha, per module results) for incremental runs
+    sf = os.path.join(metadir, 'ansible-' + eversion + '-meta.state.json')
+
+    rdir = os.path.join(releasedir, edir)
+    if os.path.exists(jf) and not refresh:
+        # a tarball's meta holds until --refresh, a checkout's until HEAD moves
+        if istar or _state_sha(sf) in [None, _git_head(rdir)]:
+            return
+
+    # the extracted tree, or the tarball itself when streaming
+    release = open_release(tb, releasedir, stream=stream)
+
+    with IndexCache(os.path.join(metadir, 'index-cache.sqlite'),
+                    max_entries=INDEX_CACHE_MAX_ENTRIES) as cache:
+        if not istar and not filters and not force:
+            res = _index_collections_incremental(release, rdir, rdir, eversion, jf, sf, cache)
+            if res is not None:
+                (collections, state) = res
+                write_json_atomic(jf, collections)
+                write_json_atomic(sf, state)
+                return
+
+        # sorted so the meta does not depend on directory or archive order
+        dirs = sorted(release.module_dirs())
+        files = sorted(release.module_files())
+
+        if filters:
+            for filen in files[:]:
+                include = True
+                for filtern in filters:
+                    if filtern not in filen:
+                        include = False
+                        break
+                if not include:
+                    files.remove(filen)
+
+        collections = {}
+        for dirn in dirs:
+            dirn = dirn.lstrip('./')
+            if not dirn:
+                continue
+            collections[dirn] = _new_collection(dirn, rdir, eversion)
+
+        #from random import randint
+        #from ansible.module_utils.basic import AnsibleModule
+        #from ansible.module_utils._text import to_text, to_native
+        #from ansible.module_utils.vmware import ...
+        scanned = _scan_modules(files, release, rdir, cache)
+        _aggregate_modules(collections, scanned)
+
+    '''TBD
+    # look for action plugins
+    cmd = 'cd %s/lib/ansible/plugins/action ; find . -type f' % os.path.join(releasedir, edir)
+    (rc, so, se) = _run_command(cmd)
+    filens = [x.strip() for x in so.split('\n') if x.strip()]
+    filens = [x.replace('./', '', 1) for x in filens]
+    for filen in filens:
+        import epdb; epdb.st()
+    '''
+
+    _discover_tests(collections, release, rdir)
+
     # store the meta ...
     jf = os.path.join(metadir, 'ansible-' + eversion + '-meta.json')
-    with open(jf, 'w') as f:
-        f.write(json.dumps(collections, indent=2, sort_keys=True))
+    write_json_atomic(jf, collections)
+
+    state = {
+        'release': tbbn,
+        'sha': None if istar or filters else _git_head(rdir),
+        'modules': scanned,
+    }
+    write_json_atomic(sf, state)
 
 
-def assemble_collections(refresh=False, devel_only=False, filters=None):
+def assemble_collections(refresh=False, devel_only=False, filters=None, materialize='auto', jobs=1,
+                         devel_refs=None):
     #cachedir = os.path.join(VARDIR, 'collections')
     rpmdir = os.path.join(VARDIR, 'repos', 'rpm')
     releasedir = os.path.join(VARDIR, 'releases')
     colbasedir = os.path.join(VARDIR, 'collections')
     metadir = os.path.join(VARDIR, 'meta')
 
-    tarballs = []
-    if not devel_only:
-        tarballs += glob.glob('%s/*.tar.gz' % releasedir)
-    tarballs += ['devel.git']
-
-    tarballs = sorted(tarballs)
+    tarballs = _release_trees(releasedir, devel_only=devel_only, devel_refs=devel_refs)
 
     for tb in tarballs:
         eversion = version_from_tar(tb)
@@ -539,27 +761,85 @@ def assemble_collections(refresh=False, devel_only=False, filters=None):
         with open(jf, 'r') as f:
             collections = json.loads(f.read())
 
-        _assemble_collections(collections, refresh=refresh, filters=filters)
+        if tb.endswith('.tar.gz'):
+            extract_assembly_members(tb, releasedir, collections)
+
+        _assemble_collections(
+            collections,
+            refresh=refresh,
+            filters=filters,
+            materialize=materialize,
+            jobs=jobs
+        )
+
+
+def _assembly_prefixes(collections, rdir=None):
+    # what _assemble_collections will read from the release tree, relative
+    # to the release top dir
+    prefixes = set()
+    # pre-2.8 fragments were not plugins, a release only has one of these
+    fragment_dirs = [
+        x for x in DOC_FRAGMENT_DIRS
+        if rdir and os.path.isdir(os.path.join(rdir, x))
+    ]
+    if not fragment_dirs:
+        # nothing extracted yet, so either
+        fragment_dirs = DOC_FRAGMENT_DIRS
+    for k,v in collections.items():
+        for mn in v.get('modules', []):
+            prefixes.add('lib/ansible/modules/' + mn)
+        for mu in v.get('module_utils', []):
+            if mu and mu not in MODULE_UTIL_BLACKLIST:
+                prefixes.add('lib/ansible/module_utils/' + mu.replace('.', '/') + '.py')
+        for df in v.get('docs_fragments', []):
+            for dfg in fragment_dirs:
+                prefixes.add(dfg + df.split('.')[0] + '.py')
+        for uf in v.get('units', []):
+            for _uf in uf.split('\n'):
+                if _uf.startswith(v['basedir'] + '/'):
+                    _uf = _uf[len(v['basedir']) + 1:]
+                else:
+                    _uf = 'test/units/' + _uf
+                prefixes.add(_uf)
+        for target in v.get('targets', []):
+            prefixes.add('test/integration/targets/' + target + '/')
+    return sorted(prefixes)
+
+
+def extract_assembly_members(tb, releasedir, collections):
+    # streamed (--stream) releases are never fully extracted, so pull out
+    # just what assembly is going to copy
+    rdir = os.path.join(releasedir, os.path.basename(tb).replace('.tar.gz', ''))
+    prefixes = [
+        x for x in _assembly_prefixes(collections, rdir)
+        if not os.path.exists(os.path.join(rdir, x.rstrip('/')))
+    ]
+    if not prefixes:
+        return
+    logger.info('extracting %s paths from %s' % (len(prefixes), tb))
+    extract_members(tb, releasedir, prefixes)
 
 
-def _assemble_collections(collections, refresh=False, filters=None):
+def _assemble_collections(collections, refresh=False, filters=None, materialize='auto', jobs=1):
     rpmdir = os.path.join(VARDIR, 'repos', 'rpm')
     releasedir = os.path.join(VARDIR, 'releases')
     colbasedir = os.path.join(VARDIR, 'collections')
     metadir = os.path.join(VARDIR, 'meta')
-    
-    if refresh and os.path.exists(colbasedir):
-        shutil.rmtree(colbasedir)
+
+    if refresh:
+        for version in sorted(set([v['version'] for v in collections.values() if v.get('version')])):
+            if os.path.exists(os.path.join(colbasedir, version)):
+                shutil.rmtree(os.path.join(colbasedir, version))
+    if not os.path.exists(os.path.join(colbasedir, 'manifests')):
+        os.makedirs(os.path.join(colbasedir, 'manifests'))
 
     # create the collections ...
-    assembled = []
-    for k,v in collections.items():
+    results = []
+    todo = []
+    for k,v in sorted(collections.items()):
         if k == '':
             continue
 
-        #if 'vmware' in k:
-        #    import epdb; epdb.st()
-
         logger.debug('%s %s' % (k, filters))
 
         if filters:
@@ -571,461 +851,675 @@ def _assemble_collections(collections, refresh=False, filters=None):
             if not include:
                 continue
 
-        #if 'vmware' in k:
-        #    import epdb; epdb.st()
-
         if not [x for x in v['modules'] if not x.endswith('__init__.py')]:
+            results.append({
+                'collection': k,
+                'status': 'skipped',
+                'reason': 'no modules',
+                'duration': 0.0,
+                'error': None,
+                'traceback': None,
+                'stats': {},
+            })
             continue
 
-        #cdir = os.path.join(colbasedir, v['name'], v['version'])
-        cdir = os.path.join(colbasedir, 'ansible_collections', COLLECTION_NAMESPACE, v['name'])
-
-        if refresh and os.path.exists(cdir):
-            shutil.rmtree(cdir)
-        if not os.path.exists(cdir):
-            os.makedirs(cdir)
-        apdir = os.path.join(cdir, 'plugins', 'action')
-        modir = os.path.join(cdir, 'plugins', 'modules')
-        mudir = os.path.join(cdir, 'plugins', 'module_utils')
-        dfdir = os.path.join(cdir, 'plugins', 'doc_fragments')
-        if not os.path.exists(apdir):
-            os.makedirs(apdir)
-        with open(os.path.join(apdir, '__init__.py'), 'w') as f:
-            f.write('')
-        if not os.path.exists(modir):
-            os.makedirs(modir)
-        with open(os.path.join(modir, '__init__.py'), 'w') as f:
-            f.write('')
-        if not os.path.exists(mudir):
-            os.makedirs(mudir)
-        with open(os.path.join(mudir, '__init__.py'), 'w') as f:
-            f.write('')
-        if not os.path.exists(dfdir):
-            os.makedirs(dfdir)
-
-        # create the galaxy.yml
-        gdata = {
-            'namespace': COLLECTION_NAMESPACE,
-            'name': v['name'],
-            'version': v['version'],
-            'authors': None,
-            'description': None,
-            'license': None,
-            'tags': None,
-            'dependencies': None,
-            'repository': None,
-            'documentation': None,
-            'homepage': None,
-            'issues': None
-        }
-        with open(os.path.join(cdir, 'galaxy.yml'), 'w') as f:
-            f.write(yaml.dump(gdata, default_flow_style=False))
+        todo.append((k, v))
+
+    # every collection has its own directory, so they can be built at once
+    if jobs and jobs > 1 and len(todo) > 1:
+        logger.info('assembling %s collections with %s jobs' % (len(todo), jobs))
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(_assemble_collection_job, k, v, colbasedir, refresh, materialize)
+                for (k, v) in todo
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+    else:
+        for (k, v) in todo:
+            results.append(_assemble_collection_job(k, v, colbasedir, refresh, materialize))
+
+    mat = Materializer(mode=materialize)
+    counts = {}
+    results = sorted(results, key=lambda x: x['collection'])
+    for res in results:
+        counts[res['status']] = counts.get(res['status'], 0) + 1
+        mat.add_stats(res['stats'])
+        if res['status'] == 'failed':
+            logger.error('assemble %s failed after %.2fs: %s' % (res['collection'], res['duration'], res['error']))
+            logger.debug(res['traceback'])
+        elif res['status'] == 'skipped':
+            logger.info('assemble %s skipped: %s' % (res['collection'], res['reason']))
+        else:
+            logger.info('assemble %s finished in %.2fs' % (res['collection'], res['duration']))
+    mat.report()
+    logger.info('%s assembled, %s skipped, %s failed' % (
+        counts.get('assembled', 0),
+        counts.get('skipped', 0),
+        counts.get('failed', 0)
+    ))
+
+    if not [x for x in results if x['status'] == 'assembled' or x['reason'] == 'unchanged']:
+        logger.error('no collections assembled')
+    return results
+
+
+def _assemble_collection_job(k, v, colbasedir, refresh, materialize):
+    # one collection's failure is reported, it does not stop the others
+    res = {
+        'collection': k,
+        'status': None,
+        'reason': None,
+        'duration': None,
+        'error': None,
+        'traceback': None,
+        'stats': {},
+    }
+    t0 = time.time()
+    # release files are linked in, never copied, unless they are rewritten
+    mat = Materializer(mode=materialize)
+    try:
+        cdir = _collection_dir(colbasedir, v)
+        mf = _assembly_manifest_file(colbasedir, v)
+        old = read_manifest(mf)
+        manifest = build_manifest(
+            v,
+            digest_sources(v['basedir'], _collection_sources(v), old.get('sources')),
+            namespace=COLLECTION_NAMESPACE,
+            rewriter=REWRITER_VERSION,
+            assembly=ASSEMBLY_VERSION
+        )
+        if not refresh and os.path.exists(cdir) and old.get('fingerprint') == manifest['fingerprint']:
+            res['status'] = 'skipped'
+            res['reason'] = 'unchanged'
+        else:
+            # drop the manifest first in case this build fails halfway,
+            # then whatever the previous build left that this one did not
+            # write, so unchanged files keep their mtimes
+            if os.path.exists(mf):
+                os.remove(mf)
+            _assemble_collection(k, v, colbasedir, refresh, mat)
+            mat.prune(cdir)
+            write_json_atomic(mf, manifest)
+            res['status'] = 'assembled'
+    except Exception as e:
+        res['status'] = 'failed'
+        res['error'] = '%s: %s' % (type(e).__name__, e)
+        res['traceback'] = traceback.format_exc()
+    res['stats'] = mat.stats
+    res['duration'] = time.time() - t0
+    return res
 
-        for mn in v['modules']:
-            src = os.path.join(v['basedir'], 'lib', 'ansible', 'modules', mn)
-            dst = os.path.join(modir, os.path.basename(mn))
-            shutil.copy(src, dst)
 
-            with open(dst, 'r') as f:
-                mdata = f.read()
-            _mdata = mdata[:]
+def _collection_dir(colbasedir, v):
+    # every release has its own tree, so each version is packaged from its own files
+    return os.path.join(colbasedir, v['version'], 'ansible_collections', COLLECTION_NAMESPACE, v['name'])
 
-            # were any lines nullified?
-            extralines = False
 
-            # fix the module util paths
-            for mu in v['module_utils']:
-                if not mu:
-                    continue
-                if mu in MODULE_UTIL_BLACKLIST:
-                    continue
+def _assembly_manifest_file(colbasedir, v):
+    # kept outside of the collection so it is not packaged with it
+    return os.path.join(
+        colbasedir, 'manifests', '%s.%s-%s.json' % (COLLECTION_NAMESPACE, v['name'], v['version'])
+    )
 
-                # ansible.module_utils.vmware
-                # ansible_collections.jctanner.cloud_vmware.module_utils.vmware
-                si = 'ansible.module_utils.%s' % mu
-                #di = 'ansible_collections.%s.%s.module_utils.%s' % (COLLECTION_NAMESPACE, v['name'], mu)
-                di = 'ansible_collections.%s.%s.plugins.module_utils.%s' % (COLLECTION_NAMESPACE, v['name'], mu)
-
-                #mdata = mdata.replace(si, di)
-                mdlines = mdata.split('\n')
-                for idx,x in enumerate(mdlines):
-                    #if not x.startswith('from ') or x.endswith('('):
-                    if not x.startswith('from '):
-                        continue
-                    if si in x:
-                        newx = x.replace(si, di)
-                        if len(newx) < 160 and ('(' not in x) and '\\' not in x:
-                            mdlines[idx] = newx
-                            continue
 
-                        if '(' in x and ')' not in x:
-                            x = ''
-                            tonull = []
-                            for thisx in range(idx, len(mdlines)):
-                                x += mdlines[thisx]
-                                tonull.append(thisx)
-                                if ')' in mdlines[thisx]:
-                                    break
-
-                            if len(tonull) > 1:
-                                extralines = True
-                            for tn in tonull:
-                                mdlines[tn] = ''
-
-                        if '\\' in x:
-                            x = ''
-                            tonull = []
-                            for thisx in range(idx, len(mdlines)):
-
-                                if thisx != idx and mdlines[thisx].startswith('from '):
-                                    break
-
-                                print('add %s' % mdlines[thisx])
-                                x += mdlines[thisx]
-                                tonull.append(thisx)
-
-
-                                if thisx != idx and (not mdlines[thisx].strip() or mdlines[thisx][0].isalnum()):
-                                    break
-                                print('add %s' % mdlines[thisx])
-                                #x += mdlines[thisx]
-                                #tonull.append(thisx)
-
-                            #print(tonull)
-                            #import epdb; epdb.st()
-                            if len(tonull) > 1:
-                                extralines = True
-                            for tn in tonull:
-                                mdlines[tn] = ''
-
-                            #print(tonull)
-                            #import epdb; epdb.st()
-
-                        #if len(newx) < 160:
-                        #    mdlines[idx] = newx
-                        #    continue
-
-                        # we have to use newlined imports for those that are >160 chars
-                        ximports = x[:]
-
-                        #if '(' in x and ')' not in x:
-                        #    import epdb; epdb.st()
-
-                        if si in ximports:
-                            ximports = ximports.replace(si, '')
-                        elif di in ximports:
-                            ximports = ximports.replace(di, '')
-                        ximports = ximports.replace('from', '')
-                        ximports = ximports.replace('import', '')
-                        ximports = ximports.replace('\\', '')
-                        ximports = ximports.replace('(', '')
-                        ximports = ximports.replace(')', '')
-                        ximports = ximports.split(',')
-                        ximports = [x.strip() for x in ximports if x.strip()]
-                        ximports = sorted(set(ximports))
-
-                        newx = 'from %s import (\n' % di
-                        for xi in ximports:
-                            newx += '    ' + xi + ',\n'
-                        newx += ')'
-                        #import epdb; epdb.st()
-                        mdlines[idx] = newx
-
-                mdata = '\n'.join(mdlines)
-
-            # FIXME: clean too many empty lines
-            if extralines:
-                mdata = clean_extra_lines(mdata)
-                #import epdb; epdb.st()
+def _tree_files(top):
+    files = []
+    for (dirpath, dirnames, filenames) in os.walk(top, followlinks=True):
+        for fn in filenames:
+            files.append(os.path.join(dirpath, fn))
+    return files
 
-            #if dst.endswith('vca_fw.py'):
-            #    import epdb; epdb.st()
 
-            # fix the docs fragments
-            # extends_documentation_fragment: vmware.documentation\n'
-            for df in v['docs_fragments']:
-                if not df:
-                    continue
-                if df not in mdata:
-                    continue
-                ddf = '%s.%s.%s' % (COLLECTION_NAMESPACE, v['name'], df)
-                #import epdb; epdb.st()
-                mdata = mdata.replace(
-                    'extends_documentation_fragment: ' + df,
-                    'extends_documentation_fragment: ' + ddf,
-                )
+def _collection_sources(v):
+    # every release file _assemble_collection reads for this collection
+    basedir = v['basedir']
+    sources = []
+    for mn in v['modules']:
+        sources.append(os.path.join(basedir, 'lib', 'ansible', 'modules', mn))
+    for mu in v['module_utils']:
+        if not mu.strip() or mu in MODULE_UTIL_BLACKLIST:
+            continue
+        src = os.path.join(basedir, 'lib', 'ansible', 'module_utils', mu.replace('.', '/') + '.py')
+        if os.path.exists(src):
+            sources.append(src)
+    dfg1 = os.path.join(basedir, 'lib', 'ansible', 'utils', 'module_docs_fragments')
+    dfg2 = os.path.join(basedir, 'lib', 'ansible', 'plugins', 'doc_fragments')
+    for df in (v.get('docs_fragments') or []):
+        dfg = dfg1 if os.path.exists(dfg1) else dfg2
+        sources.append(os.path.join(dfg, df.split('.')[0] + '.py'))
+    for uf in (v.get('units') or []):
+        fuf = os.path.join(basedir, 'test', 'units', uf)
+        if os.path.isdir(fuf):
+            sources += _tree_files(fuf)
+        else:
+            sources.append(fuf)
+    for target in (v.get('targets') or []):
+        sources += _tree_files(os.path.join(basedir, 'test', 'integration', 'targets', target))
+    return sorted(set(sources))
+
+
+def _assemble_collection(k, v, colbasedir, refresh, mat):
+    cdir = _collection_dir(colbasedir, v)
+
+    if refresh and os.path.exists(cdir):
+        shutil.rmtree(cdir)
+    # other workers create siblings of cdir at the same time
+    os.makedirs(cdir, exist_ok=True)
+    apdir = os.path.join(cdir, 'plugins', 'action')
+    modir = os.path.join(cdir, 'plugins', 'modules')
+    mudir = os.path.join(cdir, 'plugins', 'module_utils')
+    dfdir = os.path.join(cdir, 'plugins', 'doc_fragments')
+    if not os.path.exists(apdir):
+        os.makedirs(apdir)
+    mat.write(os.path.join(apdir, '__init__.py'), '')
+    if not os.path.exists(modir):
+        os.makedirs(modir)
+    mat.write(os.path.join(modir, '__init__.py'), '')
+    if not os.path.exists(mudir):
+        os.makedirs(mudir)
+    mat.write(os.path.join(mudir, '__init__.py'), '')
+    if not os.path.exists(dfdir):
+        os.makedirs(dfdir)
+
+    # create the galaxy.yml
+    gdata = {
+        'namespace': COLLECTION_NAMESPACE,
+        'name': v['name'],
+        'version': v['version'],
+        'authors': None,
+        'description': None,
+        'license': None,
+        'tags': None,
+        'dependencies': None,
+        'repository': None,
+        'documentation': None,
+        'homepage': None,
+        'issues': None
+    }
+    mat.write(os.path.join(cdir, 'galaxy.yml'), yaml.dump(gdata, default_flow_style=False))
+
+    # ansible.module_utils.vmware
+    # ansible_collections.jctanner.cloud_vmware.plugins.module_utils.vmware
+    mutable = module_util_table(
+        v['module_utils'],
+        COLLECTION_NAMESPACE,
+        v['name'],
+        blacklist=MODULE_UTIL_BLACKLIST
+    )
+
+    for mn in v['modules']:
+        src = os.path.join(v['basedir'], 'lib', 'ansible', 'modules', mn)
+        dst = os.path.join(modir, os.path.basename(mn))
 
-            #if dst.endswith('vca_fw.py'):
-            #    import epdb; epdb.st()
+        with open(src, 'r') as f:
+            mdata = f.read()
+        _mdata = mdata[:]
 
-            if mdata != _mdata:
-                logger.info('fixing imports in %s' % dst)
-                with open(dst, 'w') as f:
-                    f.write(mdata.rstrip() + '\n')
+        # fix the module util paths
+        (mdata, rewritten) = rewrite_imports(mdata, mutable, filename=dst)
 
-        for mu in v['module_utils']:
-            if not mu.strip():
+        # fix the docs fragments
+        # extends_documentation_fragment: vmware.documentation\n'
+        for df in v['docs_fragments']:
+            if not df:
                 continue
-            if mu in MODULE_UTIL_BLACKLIST:
+            if df not in mdata:
                 continue
-            src = os.path.join(
+            ddf = '%s.%s.%s' % (COLLECTION_NAMESPACE, v['name'], df)
+            #import epdb; epdb.st()
+            mdata = mdata.replace(
+                'extends_documentation_fragment: ' + df,
+                'extends_documentation_fragment: ' + ddf,
+            )
+
+        #if dst.endswith('vca_fw.py'):
+        #    import epdb; epdb.st()
+
+        if mdata != _mdata:
+            logger.info('fixing imports in %s' % dst)
+            mat.write(dst, mdata.rstrip() + '\n', like=src)
+        else:
+            mat.place(src, dst)
+
+    for mu in v['module_utils']:
+        if not mu.strip():
+            continue
+        if mu in MODULE_UTIL_BLACKLIST:
+            continue
+        src = os.path.join(
+            v['basedir'],
+            'lib',
+            'ansible',
+            'module_utils',
+            mu.replace('.', '/') + '.py'
+        )
+        dst = os.path.join(
+            mudir, mu.split('.')[-1] + '.py'
+        )
+        if os.path.exists(src):
+            mat.place(src, dst)
+
+    if v.get('docs_fragments') is not None:
+        for df in v['docs_fragments']:
+            # pre-2.8 these were not plugins
+            dfg1 = os.path.join(
                 v['basedir'],
                 'lib',
                 'ansible',
-                'module_utils',
-                mu.replace('.', '/') + '.py'
+                'utils',
+                'module_docs_fragments'
             )
-            dst = os.path.join(
-                mudir, mu.split('.')[-1] + '.py'
+            dfg2 = os.path.join(
+                v['basedir'],
+                'lib',
+                'ansible',
+                'plugins',
+                'doc_fragments'
             )
-            if os.path.exists(src):
-                shutil.copy(src, dst)
-
-        if v.get('docs_fragments') is not None:
-            for df in v['docs_fragments']:
-                # pre-2.8 these were not plugins
-                dfg1 = os.path.join(
-                    v['basedir'],
-                    'lib',
-                    'ansible',
-                    'utils',
-                    'module_docs_fragments'
-                )
-                dfg2 = os.path.join(
-                    v['basedir'],
-                    'lib',
-                    'ansible',
-                    'plugins',
-                    'doc_fragments'
-                )
 
-                if os.path.exists(dfg1):
-                    src = os.path.join(dfg1, df.split('.')[0] + '.py')
-                else:
-                    src = os.path.join(dfg2, df.split('.')[0] + '.py')
+            if os.path.exists(dfg1):
+                src = os.path.join(dfg1, df.split('.')[0] + '.py')
+            else:
+                src = os.path.join(dfg2, df.split('.')[0] + '.py')
 
-                dst = os.path.join(dfdir, df.split('.')[0] + '.py')
+            dst = os.path.join(dfdir, df.split('.')[0] + '.py')
 
-                if not os.path.exists(src):
-                    logger.error('%s DOES NOT EXIST!!!' % src)
-                    #import epdb; epdb.st()
-                    continue
+            if not os.path.exists(src):
+                logger.error('%s DOES NOT EXIST!!!' % src)
+                #import epdb; epdb.st()
+                continue
 
-                shutil.copy(src, dst)
+            mat.place(src, dst)
+            #import epdb; epdb.st()
+
+    if v.get('units'):
+
+        # need to fix these imports in the unit tests
+        module_names = set([os.path.basename(x).replace('.py', '') for x in v['modules']])
+
+        dst = os.path.join(cdir, 'test', 'unit')
+        if not os.path.exists(dst):
+            os.makedirs(dst)
+
+        # fix the module import paths to be relative as the files go in,
+        # so a file that comes out the same is not written again
+        #   from ansible.modules.cloud.vmware import vmware_guest
+        #   from ...plugins.modules import vmware_guest
+        def fix_unit(unit_file, udata):
+            if not unit_file.endswith('.py'):
+                return None
+            # test/unit/<subdirs> -> one dot per level plus one
+            depth = os.path.relpath(os.path.dirname(unit_file), cdir).split(os.sep)
+            rel_path = '.' * (len(depth) + 1)
+            (udata, changed) = rewrite_unit_imports(udata.decode('utf-8'), module_names, rel_path)
+            if changed:
+                return udata
+            return None
+
+        for uf in v['units']:
+            fuf = os.path.join(v['basedir'], 'test', 'units', uf)
+            if os.path.isdir(fuf):
                 #import epdb; epdb.st()
 
-        if v.get('units'):
+                fns = glob.glob('%s/*' % fuf)
+                for fn in fns:
+                    if os.path.isdir(fn):
+                        mat.copytree(fn, os.path.join(dst, os.path.basename(fn)), transform=fix_unit)
+                    else:
+                       mat.place(fn, os.path.join(dst, os.path.basename(fn)), transform=fix_unit)
+
+            elif os.path.isfile(fuf):
+                fuf_dst = os.path.join(dst, os.path.basename(fuf))
+                mat.place(fuf, fuf_dst, transform=fix_unit)
+
+
+    if v.get('targets'):
+        # one matcher for every module of the collection
+        refs = ModuleRefRewriter(v['modules'], COLLECTION_NAMESPACE, v['name'])
+        roles = {}
+
+        # set namespace for all module refs
+        def fix_tasks(yf, ydata):
+            if not yf.endswith('.yml') or os.path.basename(os.path.dirname(yf)) != 'tasks':
+                return None
+
+            (ydata, changed) = refs.rewrite(ydata.decode('utf-8'))
+            for role in refs.role_refs(ydata):
+                roles.setdefault(role, yf)
+
+            if changed:
+                logger.info('fixing module calls in %s' % yf)
+                return ydata
+            return None
+
+        dst = os.path.join(cdir, 'test', 'integration', 'targets')
+        if not os.path.exists(dst):
+            os.makedirs(dst)
+        for uf in v['targets']:
+            fuf = os.path.join(v['basedir'], 'test', 'integration', 'targets', uf)
+            duf = os.path.join(dst, os.path.basename(fuf))
+            mat.copytree(fuf, duf, transform=fix_tasks)
+
+        # roles are looked up in the targets dir, so they have to be there
+        for role in sorted(roles):
+            if not os.path.isdir(os.path.join(dst, role)):
+                logger.error('%s includes role %s which is not in %s' % (roles[role], role, v['name']))
+
+
+def _packaged_collections(devel_only=False, filters=None, devel_refs=None):
+    '''(k, v, cdir) of the assembled collections worth packaging'''
+    colbasedir = os.path.join(VARDIR, 'collections')
+    releasedir = os.path.join(VARDIR, 'releases')
 
-            # need to fix these imports in the unit tests
-            module_names = [os.path.basename(x).replace('.py', '') for x in v['modules']]
+    tarballs = _release_trees(releasedir, devel_only=devel_only, devel_refs=devel_refs)
 
-            dst = os.path.join(cdir, 'test', 'unit')
-            if not os.path.exists(dst):
-                os.makedirs(dst)
-            for uf in v['units']:
-                fuf = os.path.join(v['basedir'], 'test', 'units', uf)
-                if os.path.isdir(fuf):
-                    #import epdb; epdb.st()
-
-                    fns = glob.glob('%s/*' % fuf)
-                    for fn in fns:
-                        if os.path.isdir(fn):
-                            try:
-                                shutil.copytree(fn, os.path.join(dst, os.path.basename(fn)))
-                            except Exception as e:
-                                pass
-                        else:
-                           shutil.copy(fn, os.path.join(dst, os.path.basename(fn)))
-
-                elif os.path.isfile(fuf):
-                    fuf_dst = os.path.join(dst, os.path.basename(fuf))
-                    shutil.copy(fuf, fuf_dst)
-
-                cmd = 'find %s -type f -name "*.py"' % (dst)
-                res = run_command(cmd)
-                unit_files = sorted([x.strip() for x in res['so'].split('\n') if x.strip()])
-
-                for unit_file in unit_files:
-                    # fix the module import paths to be relative
-                    #   from ansible.modules.cloud.vmware import vmware_guest
-                    #   from ...plugins.modules import vmware_guest
-
-                    depth = unit_file.replace(cdir, '')
-                    depth = depth.lstrip('/')
-                    depth = os.path.dirname(depth)
-                    depth = depth.split('/')
-                    rel_path = '.'.join(['' for x in range(-1, len(depth))])
-                    
-                    with open(unit_file, 'r') as f:
-                        unit_lines = f.readlines()
-                    unit_lines = [x.rstrip() for x in unit_lines]
-
-                    changed = False
-
-                    for module in module_names:
-                        for li,line in enumerate(unit_lines):
-                            if line.startswith('from ') and line.endswith(module):
-                                unit_lines[li] = 'from %s.plugins.modules import %s' % (rel_path, module)
-                                changed = True
-
-                    if changed:
-                        with open(unit_file, 'w') as f:
-                            f.write('\n'.join(unit_lines) + '\n')
-                    #import epdb; epdb.st()
+    packaged = []
+    for tb in tarballs:
+        tbbn = os.path.basename(tb)
+        edir = tbbn.replace('.tar.gz', '')
+        eversion = version_from_tar(tb)
+        metadir = os.path.join(VARDIR, 'meta')
 
+        jf = os.path.join(metadir, 'ansible-' + eversion + '-meta.json')
+        if not os.path.exists(jf):
+            continue
 
-        if v.get('targets'):
-            dst = os.path.join(cdir, 'test', 'integration', 'targets')
-            if not os.path.exists(dst):
-                os.makedirs(dst)
-            for uf in v['targets']:
-                fuf = os.path.join(v['basedir'], 'test', 'integration', 'targets', uf)
-                duf = os.path.join(dst, os.path.basename(fuf))
-                if not os.path.exists(os.path.join(dst, os.path.basename(fuf))):
-                    try:
-                        shutil.copytree(fuf, duf)
-                    except Exception as e:
-                        import epdb; epdb.st()
+        with open(jf, 'r') as f:
+            collections = json.loads(f.read())
 
-                # set namespace for all module refs
-                cmd = 'find %s -type f -name "*.yml"' % (duf)
-                res = run_command(cmd)
-                yfiles = res['so'].split('\n')
-                yfiles = [x.strip() for x in yfiles if x.strip()]
+        for k,v in collections.items():
+            if k == '':
+                continue
+            if filters and [x for x in filters if x not in k]:
+                continue
+            if not [x for x in v['modules'] if not x.endswith('__init__.py')]:
+                continue
 
-                for yf in yfiles:
+            packaged.append((k, v, _collection_dir(colbasedir, v)))
 
-                    with open(yf, 'r') as f:
-                        ydata = f.read()
-                    _ydata = ydata[:]
+    return packaged
 
-                    if os.path.basename(os.path.dirname(yf)) == 'tasks':
 
-                        for module in v['modules']:
-                            msrc = os.path.basename(module)
-                            msrc = msrc.replace('.py', '')
-                            msrc = msrc.replace('.ps1', '')
-                            msrc = msrc.replace('.ps2', '')
+def _package_manifest(kind, dst, basedir, paths, **params):
+    '''(manifest file, whether dst is up to date, manifest) of a package
 
-                            mdst = '%s.%s.%s' % (COLLECTION_NAMESPACE, v['name'], msrc)
+    A package records the digest of the files it was built from and of
+    its build parameters, and is only rebuilt when that changes.
+    '''
+    mf = os.path.join(VARDIR, 'repos', 'manifests', kind, os.path.basename(dst) + '.json')
+    old = read_manifest(mf)
+    params['executables'] = sorted([
+        os.path.relpath(x, basedir) for x in paths if os.stat(x).st_mode & stat.S_IXUSR
+    ])
+    manifest = build_manifest(None, digest_sources(basedir, paths, old.get('sources')), **params)
+    unchanged = os.path.exists(dst) and old.get('fingerprint') == manifest['fingerprint']
+    return (mf, unchanged, manifest)
 
-                            if msrc not in ydata or mdst in ydata:
-                                continue
 
-                            #import epdb; epdb.st()
-                            ydata = ydata.replace(msrc+':', mdst+':')
+# set in each package worker, bounds how many publish at once
+_io_limit = None
 
-                    # fix import_role calls?
-                    #tasks = yaml.load(ydata)
-                    #import epdb; epdb.st()
 
-                    if ydata != _ydata:
-                        logger.info('fixing module calls in %s' % yf)
-                        with open(yf, 'w') as f:
-                            f.write(ydata)
+def _init_io_limit(limit):
+    global _io_limit
+    _io_limit = limit
 
-        assembled.append(k)
 
-    if not assembled:
-        logger.error('no collections assembled')
+def _run_package_jobs(kind, todo, job, job_args=(), jobs=1, results=None, manifests=None,
+                      io_jobs=None):
+    '''Run job(k, v, cdir, dst, *job_args) for each {dst: (k, v, cdir)}
 
+    The biggest collections go first so none of them is left running
+    alone at the end. At most io_jobs of them publish (compare against
+    the old package and move into place) at the same time. Returns the
+    job results plus those passed in.
+    '''
+    results = list(results or [])
+    sizes = {}
+    for (dst, (k, v, cdir)) in todo.items():
+        sizes[dst] = sum([os.path.getsize(x) for x in _tree_files(cdir)])
+    order = sorted(todo, key=lambda x: (-sizes[x], x))
+
+    # every package is its own file, so they can be built at once
+    if jobs and jobs > 1 and len(order) > 1:
+        logger.info('building %s %s packages with %s jobs' % (len(order), kind, jobs))
+        limit = None
+        if io_jobs and io_jobs < jobs:
+            limit = multiprocessing.BoundedSemaphore(io_jobs)
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_io_limit, initargs=(limit,)) as executor:
+            futures = [
+                executor.submit(job, todo[x][0], todo[x][1], todo[x][2], x, *job_args)
+                for x in order
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+    else:
+        for x in order:
+            results.append(job(todo[x][0], todo[x][1], todo[x][2], x, *job_args))
+
+    out = OutputWriter()
+    counts = {}
+    results = sorted(results, key=lambda x: x['package'])
+    for res in results:
+        counts[res['status']] = counts.get(res['status'], 0) + 1
+        out.add_stats(res['stats'])
+        if res['status'] == 'failed':
+            logger.error('package %s failed after %.2fs: %s' % (res['package'], res['duration'], res['error']))
+            logger.debug(res['traceback'])
+        elif res['status'] == 'skipped':
+            logger.debug('package %s skipped: %s' % (res['package'], res['reason']))
+        else:
+            logger.info('package %s built in %.2fs' % (res['package'], res['duration']))
+    out.report('%s packages' % kind)
+    logger.info('%s built, %s skipped, %s failed' % (
+        counts.get('built', 0),
+        counts.get('skipped', 0),
+        counts.get('failed', 0)
+    ))
+
+    # recorded only once the package is in place
+    built = set([x['package'] for x in results if x['status'] == 'built'])
+    for (dst, (mf, manifest)) in (manifests or {}).items():
+        if os.path.basename(dst) in built:
+            if not os.path.exists(os.path.dirname(mf)):
+                os.makedirs(os.path.dirname(mf))
+            write_json_atomic(mf, manifest)
+
+    write_json_atomic(
+        os.path.join(VARDIR, 'repos', '%s-build-summary.json' % kind),
+        [dict([(k, v) for (k, v) in x.items() if k != 'stats']) for x in results]
+    )
+    return results
 
-def build_rpms(refresh=False, devel_only=False):
 
-    colbasedir = os.path.join(VARDIR, 'collections')
-    rpmdir = os.path.join(VARDIR, 'repos', 'rpm')
-    releasedir = os.path.join(VARDIR, 'releases')
+def _package_result(k, dst, status=None, reason=None):
+    return {
+        'collection': k,
+        'package': os.path.basename(dst),
+        'status': status,
+        'reason': reason,
+        'duration': 0.0,
+        'error': None,
+        'traceback': None,
+        'stats': {},
+    }
 
-    #tarballs = glob.glob('%s/*.tar.gz' % releasedir)
-    #tarballs = sorted(tarballs)
 
-    tarballs = []
-    if not devel_only:
-        tarballs += glob.glob('%s/*.tar.gz' % releasedir)
-    tarballs += ['devel.git']
+def _publish_job(res, dst, build):
+    # one package's failure is reported, it does not stop the others.
+    # build(tmpfile) makes the package next to dst, which it then
+    # replaces, so a rebuild never leaves a missing or partial file
+    t0 = time.time()
+    out = OutputWriter()
+    tmpfile = os.path.join(os.path.dirname(dst), '.' + os.path.basename(dst))
+    try:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        logger.info('build %s' % dst)
+        build(tmpfile)
+        if _io_limit is None:
+            out.publish(tmpfile, dst)
+        else:
+            with _io_limit:
+                out.publish(tmpfile, dst)
+        res['status'] = 'built'
+    except Exception as e:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        res['status'] = 'failed'
+        res['error'] = '%s: %s' % (type(e).__name__, e)
+        res['traceback'] = traceback.format_exc()
+    res['stats'] = out.stats
+    res['duration'] = time.time() - t0
+    return res
 
-    tarballs = sorted(tarballs)
 
-    for tb in tarballs:
-        tbbn = os.path.basename(tb)
-        edir = tbbn.replace('.tar.gz', '')
-        eversion = version_from_tar(tb)
-        metadir = os.path.join(VARDIR, 'meta')
+def build_rpms(refresh=False, devel_only=False, filters=None, builder='fpm', jobs=1,
+               compression=RPM_DEFAULT_COMPRESSION, level=None, devel_refs=None, io_jobs=None):
 
-        jf = os.path.join(metadir, 'ansible-' + eversion + '-meta.json')
-        if not os.path.exists(jf):
+    rpmdir = os.path.join(VARDIR, 'repos', 'rpm')
+    if not os.path.exists(rpmdir):
+        os.makedirs(rpmdir)
+
+    results = []
+    todo = {}
+    manifests = {}
+    for (k, v, cdir) in _packaged_collections(devel_only=devel_only, filters=filters, devel_refs=devel_refs):
+        # create the package
+        #dstrpm = os.path.join(rpmdir, '%s-%s.rpm' % (v['name'], v['version']))
+        dstrpm = os.path.join(rpmdir, '%s%s-%s.rpm' % (
+            COLLECTION_PACKAGE_PREFIX, v['name'], v['version'])
+        )
+        (mf, unchanged, manifest) = _package_manifest(
+            'rpm',
+            dstrpm,
+            cdir,
+            _tree_files(os.path.join(cdir, 'plugins')),
+            name=COLLECTION_PACKAGE_PREFIX + v['name'],
+            version=v['version'],
+            prefix=os.path.join(COLLECTION_INSTALL_PATH, COLLECTION_NAMESPACE, v['name']),
+            namespace=COLLECTION_NAMESPACE,
+            builder=builder,
+            compression=compression,
+            level=level
+        )
+        if unchanged and not refresh:
+            results.append(_package_result(k, dstrpm, 'skipped', 'unchanged'))
             continue
+        todo[dstrpm] = (k, v, cdir)
+        manifests[dstrpm] = (mf, manifest)
 
-        with open(jf, 'r') as f:
-            collections = json.loads(f.read())
+    return _run_package_jobs('rpm', todo, _build_rpm_job, (builder, compression, level), jobs=jobs,
+                             results=results, manifests=manifests, io_jobs=io_jobs)
 
-        for k,v in collections.items():
-            # create the package
 
-            if k == '':
-                continue
-            if not [x for x in v['modules'] if not x.endswith('__init__.py')]:
-                continue
+def _build_rpm_job(k, v, cdir, dstrpm, builder, compression, level):
+    if builder == 'native':
+        build = lambda x: _native_rpm(v, cdir, x, compression, level)
+    else:
+        build = lambda x: _fpm_rpm(v, cdir, x, compression, level)
+    return _publish_job(_package_result(k, dstrpm), dstrpm, build)
+
+
+def _fpm_rpm(v, cdir, dstrpm, compression=RPM_DEFAULT_COMPRESSION, level=None):
+    '''Package a collection's plugins with fpm'''
+    cmd = [
+        'fpm',
+        '-t',
+        'rpm',
+        '-s',
+        'dir',
+        '-n',
+        COLLECTION_PACKAGE_PREFIX + v['name'],
+        '--version',
+        v['version'],
+        '-C',
+        cdir,
+        '--prefix',
+        os.path.join(COLLECTION_INSTALL_PATH, COLLECTION_NAMESPACE, v['name']),
+        #os.path.join(COLLECTION_INSTALL_PATH, COLLECTION_NAMESPACE),
+        '--rpm-compression',
+        compression,
+        '-p',
+        dstrpm,
+        'plugins'
+        #'modules',
+        #'module_utils',
+        #'module_docs_fragments'
+    ]
+    if level is not None:
+        cmd[-1:-1] = ['--rpm-compression-level', str(level)]
+    cmd = ' '.join(cmd)
+    logger.info(cmd)
+    (rc, so, se) = _run_command(cmd)
+    if rc != 0:
+        logger.info('%s rc: %s' % (cmd, rc))
+        logger.info(so)
+        logger.info(se)
+        raise Exception('fpm exited %s: %s' % (rc, se.strip().split('\n')[-1]))
 
-            cdir = os.path.join(colbasedir, v['name'], v['version'])
-            #dstrpm = os.path.join(rpmdir, '%s-%s.rpm' % (v['name'], v['version']))
-            dstrpm = os.path.join(rpmdir, '%s%s-%s.rpm' % (
-                COLLECTION_PACKAGE_PREFIX, v['name'], v['version'])
-            )
-            dstrpmdir = os.path.dirname(dstrpm)
-            if not os.path.exists(dstrpmdir):
-                os.makedirs(dstrpmdir)
 
-            if os.path.exists(dstrpm) and refresh:
-                os.remove(dstrpm)
+def _native_rpm(v, cdir, dstrpm, compression=RPM_DEFAULT_COMPRESSION, level=None):
+    '''Package a collection's plugins like _fpm_rpm, without leaving python'''
+    rpm = RpmWriter(
+        COLLECTION_PACKAGE_PREFIX + v['name'],
+        v['version'],
+        prefix=os.path.join(COLLECTION_INSTALL_PATH, COLLECTION_NAMESPACE, v['name']),
+        compression=compression,
+        level=level
+    )
+    rpm.add_tree(cdir, 'plugins')
+    rpm.write(dstrpm)
+
+
+def build_galaxy_artifacts(refresh=False, devel_only=False, filters=None, jobs=1, devel_refs=None,
+                           io_jobs=None):
+    '''ansible-galaxy installable tarballs of the assembled collections'''
+    galaxydir = os.path.join(VARDIR, 'repos', 'galaxy')
+    if not os.path.exists(galaxydir):
+        os.makedirs(galaxydir)
+
+    results = []
+    todo = {}
+    manifests = {}
+    for (k, v, cdir) in _packaged_collections(devel_only=devel_only, filters=filters, devel_refs=devel_refs):
+        dst = os.path.join(galaxydir, artifact_name(COLLECTION_NAMESPACE, v['name'], v['version']))
+        (mf, unchanged, manifest) = _package_manifest(
+            'galaxy',
+            dst,
+            cdir,
+            _tree_files(cdir),
+            namespace=COLLECTION_NAMESPACE,
+            name=v['name'],
+            version=v['version'],
+            artifact=GALAXY_ARTIFACT_VERSION
+        )
+        if unchanged and not refresh:
+            results.append(_package_result(k, dst, 'skipped', 'unchanged'))
+            continue
+        todo[dst] = (k, v, cdir)
+        manifests[dst] = (mf, manifest)
 
-            if not os.path.exists(dstrpm):
-                #import epdb; epdb.st()
-                logger.info('build %s' % dstrpm)
-                cmd = [
-                    'fpm',
-                    '-t',
-                    'rpm',
-                    '-s',
-                    'dir',
-                    '-n',
-                    COLLECTION_PACKAGE_PREFIX + v['name'],
-                    '--version',
-                    v['version'],
-                    '-C',
-                    cdir,
-                    '--prefix',
-                    os.path.join(COLLECTION_INSTALL_PATH, COLLECTION_NAMESPACE, v['name']),
-                    #os.path.join(COLLECTION_INSTALL_PATH, COLLECTION_NAMESPACE),
-                    '-p',
-                    dstrpm,
-                    'plugins'
-                    #'modules',
-                    #'module_utils',
-                    #'module_docs_fragments'
-                ]
-                cmd = ' '.join(cmd)
-                logger.info(cmd)
-                (rc, so, se) = _run_command(cmd)
-                if rc != 0:
-                    logger.info('%s rc: %s' % (cmd, rc))
-                    logger.info(so)
-                    logger.info(se)
-                    sys.exit(rc)
-                #if v['name'] == 'system':
-                #    import epdb; epdb.st()
+    return _run_package_jobs('galaxy', todo, _build_galaxy_job, jobs=jobs,
+                             results=results, manifests=manifests, io_jobs=io_jobs)
 
-    return {}
+
+def _build_galaxy_job(k, v, cdir, dst):
+    return _publish_job(_package_result(k, dst), dst, lambda x: build_artifact(cdir, x, version=v['version']))
 
 
-def build_repodata():
+def build_repodata(refresh=False):
     #repodir = '/var/cache/gravity/repos/rpm'
     repodir = os.path.join(VARDIR, 'repos', 'rpm')
-    repodata_dir = os.path.join(repodir, 'repodata')
-    if os.path.exists(repodata_dir):
-        shutil.rmtree(repodata_dir)
-    logger.info('creating repo')
-    createrepo('.', _cwd=repodir)
+    if not os.path.exists(repodir):
+        os.makedirs(repodir)
+    logger.info('updating repo metadata')
+    return update_repodata(
+        repodir,
+        os.path.join(VARDIR, 'repos', 'rpm-repodata-cache.json'),
+        force=refresh
+    )
 
 
 def get_issues_for_file(filename=None):
@@ -1053,35 +1547,121 @@ def main():
             'index',
             'assemble',
             'package',
-            'package_engine'
+            'package_engine',
+            'galaxy'
         ],
         default='all'
     )
     parser.add_argument('--refresh', action='store_true')
     parser.add_argument('--devel', dest='devel_only', action='store_true')
     parser.add_argument('--filter', nargs='+')
-    #parser.add_argument('--force', nargs='+')
+    parser.add_argument('--devel-refs', nargs='+',
+        help='extra branches or pull/<N> refs to check out as worktrees'
+    )
+    parser.add_argument('--stream', action='store_true',
+        help='index release tarballs without extracting them'
+    )
+    parser.add_argument('--jobs', type=int, default=1,
+        help='number of worker processes to use'
+    )
+    parser.add_argument('--io-jobs', type=int,
+        help='at most this many package jobs publishing at once (default: --jobs)'
+    )
+    parser.add_argument('--download-jobs', type=int, default=4,
+        help='number of concurrent release downloads'
+    )
+    parser.add_argument('--extract-prefixes', nargs='+',
+        help='release paths to extract (default: lib/ansible/ test/)'
+    )
+    parser.add_argument('--materialize', choices=MATERIALIZE_MODES, default='auto',
+        help='how unchanged release files get into collections (auto tries reflink, hardlink, copy)'
+    )
+    parser.add_argument('--rpm-builder', choices=RPM_BUILDERS, default='fpm',
+        help='build collection rpms with fpm or in-process'
+    )
+    parser.add_argument('--rpm-compression', choices=sorted(RPM_COMPRESSIONS),
+        default=RPM_DEFAULT_COMPRESSION,
+        help='collection rpm payload compression'
+    )
+    parser.add_argument('--rpm-compression-level', type=int,
+        help='payload compression level (default: the compression\'s own)'
+    )
+    parser.add_argument('--force', action='store_true',
+        help='reindex devel in full instead of from the git diff'
+    )
 
     args = parser.parse_args()
+    if args.rpm_builder == 'fpm' and args.rpm_compression not in FPM_COMPRESSIONS:
+        parser.error('fpm can not build %s rpms' % args.rpm_compression)
+    if args.rpm_builder == 'native' and args.rpm_compression not in rpm_compressions():
+        parser.error('%s rpms need the zstandard module' % args.rpm_compression)
+    packages = []
 
     if args.phase in ['all', 'releases', 'index', 'assemble']:
         logger.info('get releases')
-        get_releases(refresh=args.refresh, devel_only=args.devel_only)
+        get_releases(
+            refresh=args.refresh,
+            devel_only=args.devel_only,
+            extract=not args.stream,
+            download_jobs=args.download_jobs,
+            extract_jobs=max(args.jobs, 1),
+            extract_prefixes=args.extract_prefixes,
+            devel_refs=args.devel_refs
+        )
     if args.phase in ['all', 'index', 'releases', 'assemble']:
         logger.info('indexing collections', 'index', 'releases', 'assemble')
-        index_collections(refresh=args.refresh, devel_only=args.devel_only, filters=args.filter)
+        index_collections(
+            refresh=args.refresh,
+            devel_only=args.devel_only,
+            filters=args.filter,
+            jobs=args.jobs,
+            stream=args.stream,
+            force=args.force,
+            devel_refs=args.devel_refs
+        )
     if args.phase in ['all', 'assemble']:
         logger.info('assembling collections')
-        assemble_collections(refresh=args.refresh, devel_only=args.devel_only, filters=args.filter)
+        assemble_collections(
+            refresh=args.refresh,
+            devel_only=args.devel_only,
+            filters=args.filter,
+            materialize=args.materialize,
+            jobs=args.jobs,
+            devel_refs=args.devel_refs
+        )
     #if args.phase in ['all', 'package_engine']:
     #    logger.info('building ansible minimal package')
     #    build_ansible_rpm()
     if args.phase in ['all', 'package']:
         logger.info('building packages')
-        build_rpms(refresh=args.refresh, devel_only=args.devel_only, filters=args.filter)
+        packages = build_rpms(
+            refresh=args.refresh,
+            devel_only=args.devel_only,
+            filters=args.filter,
+            builder=args.rpm_builder,
+            jobs=args.jobs,
+            compression=args.rpm_compression,
+            level=args.rpm_compression_level,
+            devel_refs=args.devel_refs,
+            io_jobs=args.io_jobs
+        )
     if args.phase in ['all', 'package', 'package_engine']:
         logger.info('build repo meta')
-        build_repodata()
+        build_repodata(refresh=args.refresh)
+    # opt-in, 'all' is the rpm pipeline
+    if args.phase == 'galaxy':
+        logger.info('building galaxy artifacts')
+        packages += build_galaxy_artifacts(
+            refresh=args.refresh,
+            devel_only=args.devel_only,
+            filters=args.filter,
+            jobs=args.jobs,
+            devel_refs=args.devel_refs,
+            io_jobs=args.io_jobs
+        )
+    # whatever did build is published, but a failed package fails the run
+    if [x for x in packages if x['status'] == 'failed']:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
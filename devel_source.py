@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# The ansible/ansible checkout behind releases/devel.git.
+#
+# The clone is partial (--filter=blob:none, or shallow with a depth) so
+# only the blobs of what gets checked out are downloaded, and later runs
+# update it with a fetch instead of deleting and recloning. Other
+# branches or pull requests get their own git worktree on the same object
+# store:
+#
+#   devel = DevelSource(DEVEL_URL, 'releases/devel.git', branch='devel')
+#   devel.update()
+#   devel.add_worktree('pull/12345', 'releases/devel-pull-12345.git')
+#
+# Each worktree is indexed, assembled and packaged as a release of its own,
+# versioned <devel version>+<label>, e.g. 2.10.0.dev0+pull.12345.
+
+import os
+import re
+
+from logzero import logger
+from sh import git
+
+
+def normalize_ref(ref):
+    '''Map a branch name or pull/<N> to (remote ref, local tracking ref)'''
+    if ref.startswith('refs/'):
+        local = 'refs/remotes/origin/' + ref.split('/', 2)[2]
+        return (ref, local)
+    match = re.match(r'^(?:pull|pr)/(\d+)$', ref)
+    if match:
+        return (
+            'refs/pull/%s/head' % match.group(1),
+            'refs/remotes/origin/pull/%s' % match.group(1)
+        )
+    return ('refs/heads/%s' % ref, 'refs/remotes/origin/%s' % ref)
+
+
+def worktree_name(ref):
+    return 'devel-%s.git' % re.sub(r'[^\w.-]+', '-', ref).strip('-')
+
+
+def worktree_label(name):
+    '''pull.12345 for devel-pull-12345.git, fit for rpm and semver versions'''
+    label = os.path.basename(name)
+    if label.startswith('devel-'):
+        label = label[len('devel-'):]
+    if label.endswith('.git'):
+        label = label[:-len('.git')]
+    return re.sub(r'[^0-9A-Za-z.]+', '.', label).strip('.')
+
+
+class DevelSource(object):
+
+    def __init__(self, url, path, branch='devel', clone_filter='blob:none', depth=None):
+        self.url = url
+        self.path = path
+        self.branch = branch
+        self.clone_filter = clone_filter
+        self.depth = depth
+
+    def _git(self, *args):
+        return str(git(*args, _cwd=self.path)).strip()
+
+    def clone(self):
+        args = ['clone', '--no-checkout']
+        if self.depth:
+            args += ['--depth', str(self.depth), '--no-single-branch']
+        elif self.clone_filter:
+            args.append('--filter=%s' % self.clone_filter)
+        args += [self.url, self.path]
+        logger.info('git %s' % ' '.join(args))
+        git(*args)
+
+    def fetch(self, ref):
+        '''Fetch one ref into its remote tracking ref, returns its sha'''
+        (remote, local) = normalize_ref(ref)
+        args = ['fetch', '--no-tags']
+        if self.depth:
+            args += ['--depth', str(self.depth)]
+        args += ['origin', '+%s:%s' % (remote, local)]
+        logger.info('git %s' % ' '.join(args))
+        self._git(*args)
+        return self._git('rev-parse', local)
+
+    def tracking_sha(self, ref):
+        (remote, local) = normalize_ref(ref)
+        try:
+            return self._git('rev-parse', '--verify', '-q', local)
+        except Exception:
+            return None
+
+    def current_branch(self):
+        return self._git('rev-parse', '--abbrev-ref', 'HEAD')
+
+    def head(self):
+        return self._git('rev-parse', 'HEAD')
+
+    def update(self, fetch=True):
+        '''Clone if needed, fetch and check out the branch, returns the sha'''
+        cloned = False
+        if not os.path.exists(self.path):
+            self.clone()
+            cloned = True
+            fetch = True
+
+        sha = None
+        if not fetch:
+            sha = self.tracking_sha(self.branch)
+        if sha is None:
+            sha = self.fetch(self.branch)
+
+        (remote, local) = normalize_ref(self.branch)
+        # a fresh clone has HEAD at the branch but nothing checked out
+        if cloned or self.current_branch() != self.branch or self.head() != sha:
+            logger.info('checking out %s at %s' % (self.branch, sha))
+            self._git('checkout', '--force', '-B', self.branch, local)
+        return sha
+
+    def add_worktree(self, ref, path, fetch=True):
+        '''Check out ref in its own worktree sharing this clone's objects'''
+        sha = None
+        if not fetch:
+            sha = self.tracking_sha(ref)
+        if sha is None:
+            sha = self.fetch(ref)
+
+        path = os.path.abspath(path)
+        if os.path.exists(path):
+            if str(git('rev-parse', 'HEAD', _cwd=path)).strip() != sha:
+                logger.info('updating worktree %s to %s' % (path, sha))
+                git('checkout', '--force', '--detach', sha, _cwd=path)
+        else:
+            self._git('worktree', 'prune')
+            logger.info('adding worktree %s for %s at %s' % (path, ref, sha))
+            self._git('worktree', 'add', '--force', '--detach', path, sha)
+        return sha
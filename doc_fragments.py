@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# Pull extends_documentation_fragment out of a module's DOCUMENTATION
+# without loading the whole (often very large) docstring as yaml.
+#
+#   DOCUMENTATION = '''
+#   module: vmware_guest
+#   ...
+#   extends_documentation_fragment: vmware.documentation
+#   '''
+
+import re
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+from logzero import logger
+
+
+FRAGMENT_KEY = 'extends_documentation_fragment'
+
+DOCUMENTATION_RE = re.compile(r'''^DOCUMENTATION\s*=\s*[rRuU]?(\'\'\'|""")''')
+
+
+def _indent(line):
+    return len(line) - len(line.lstrip(' '))
+
+
+def read_documentation(lines):
+    '''Return the lines of the DOCUMENTATION docstring, stopping at its end'''
+    docs = []
+    quote = None
+    for line in lines:
+        if quote is None:
+            match = DOCUMENTATION_RE.match(line)
+            if match:
+                quote = match.group(1)
+                rest = line[match.end():]
+                if quote in rest:
+                    docs.append(rest[:rest.index(quote)])
+                    break
+                if rest.strip():
+                    docs.append(rest)
+            continue
+        if quote in line:
+            head = line[:line.index(quote)]
+            if head.strip():
+                docs.append(head)
+            break
+        docs.append(line)
+    return docs
+
+
+def _fragment_section(docs):
+    # the key line plus everything nested under it
+    start = None
+    for idx, line in enumerate(docs):
+        if line.lstrip().startswith(FRAGMENT_KEY + ':'):
+            start = idx
+            break
+    if start is None:
+        return None
+
+    key_indent = _indent(docs[start])
+    section = [docs[start]]
+    for line in docs[start + 1:]:
+        if not line.strip() or line.lstrip().startswith('#'):
+            section.append(line)
+            continue
+        indent = _indent(line)
+        if indent > key_indent:
+            section.append(line)
+        elif indent == key_indent and line.lstrip().startswith('- '):
+            section.append(line)
+        else:
+            break
+
+    return [x[key_indent:] if x[:key_indent].strip() == '' else x for x in section]
+
+
+def _fragments_from_text(section):
+    # last resort for sections yaml will not take
+    fragments = []
+    value = section[0].split(':', 1)[1].split('#')[0].strip()
+    if value.startswith('['):
+        fragments += [x.strip().strip('\'"') for x in value.strip('[]').split(',')]
+    elif value:
+        fragments.append(value.strip('\'"'))
+    for line in section[1:]:
+        line = line.split('#')[0].strip()
+        if line.startswith('- '):
+            fragments.append(line[2:].strip().strip('\'"'))
+    return [x for x in fragments if x]
+
+
+def _normalize(fragments):
+    if fragments is None:
+        return None
+    if not isinstance(fragments, list):
+        fragments = [fragments]
+    return [str(x) for x in fragments if x is not None]
+
+
+def find_doc_fragments(lines, filename='<unknown>'):
+    '''Return (fragments, status) for an iterable of module source lines
+
+    fragments is None when the module does not extend any, status is one of
+    ok, fallback (needed the full docstring), text (yaml failed) or error.
+    '''
+    docs = read_documentation(lines)
+    section = _fragment_section(docs)
+    if section is None:
+        return (None, 'ok')
+
+    try:
+        data = yaml.load(''.join(section), Loader=SafeLoader)
+        return (_normalize(data.get(FRAGMENT_KEY)), 'ok')
+    except Exception as e:
+        logger.debug('%s: targeted parse failed: %s' % (filename, e))
+
+    try:
+        data = yaml.load(''.join(docs), Loader=SafeLoader)
+        return (_normalize(data.get(FRAGMENT_KEY)), 'fallback')
+    except Exception as e:
+        logger.debug('%s: docstring parse failed: %s' % (filename, e))
+
+    try:
+        return (_fragments_from_text(section), 'text')
+    except Exception as e:
+        logger.error('%s: can not read %s: %s' % (filename, FRAGMENT_KEY, e))
+        return (None, 'error')
+
+
+def find_doc_fragments_file(filename):
+    '''Same as find_doc_fragments, reading only as far as the docstring end'''
+    with open(filename, 'r', errors='replace') as f:
+        return find_doc_fragments(f, filename=filename)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+# Fetch release tarballs over one pooled requests.Session.
+#
+# Bodies are streamed to <dst>.part and renamed into place once complete,
+# so a dead connection never leaves a truncated tarball where get_releases
+# would take it for a finished download. With a ReleaseManifest:
+#
+#   * files that match their manifest entry are not requested at all
+#     (or only revalidated with If-None-Match/If-Modified-Since)
+#   * a leftover .part file is resumed with a Range request, guarded by
+#     If-Range with the validator recorded in <dst>.part.json when it was
+#     started, and fetched again from the start when there is none
+#   * files that no longer match their recorded size/sha256 are refetched
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+
+from logzero import logger
+
+from release_manifest import sha256_file
+
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def make_session(pool_size=8):
+    '''A keep-alive session whose pool can serve pool_size threads at once'''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=3
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _mb(nbytes):
+    return float(nbytes) / (1024 * 1024)
+
+
+def _validators(entry):
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+    return headers
+
+
+def _adopt(session, url, dst, timeout):
+    # a file from before the manifest existed, keep it only if it is as
+    # big as the server says it should be
+    rr = session.head(url, allow_redirects=True, timeout=timeout)
+    rr.raise_for_status()
+    size = rr.headers.get('Content-Length')
+    if size is not None and int(size) != os.path.getsize(dst):
+        return None
+    return {
+        'path': dst,
+        'size': os.path.getsize(dst),
+        'mtime': os.stat(dst).st_mtime,
+        'sha256': sha256_file(dst),
+        'etag': rr.headers.get('ETag'),
+        'last_modified': rr.headers.get('Last-Modified'),
+    }
+
+
+def _part_validator(part):
+    '''The ETag or Last-Modified the server gave when part was started'''
+    try:
+        with open(part + '.json', 'r') as f:
+            info = json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+    # If-Range only works with strong validators
+    if info.get('etag') and not info['etag'].startswith('W/'):
+        return info['etag']
+    return info.get('last_modified')
+
+
+def _remove_part(part):
+    for fn in [part, part + '.json']:
+        if os.path.exists(fn):
+            os.remove(fn)
+
+
+def download_file(session, url, dst, manifest=None, revalidate=False,
+                  chunk_size=CHUNK_SIZE, timeout=60):
+    '''Bring dst up to date with url, returns a result dict instead of raising
+
+    status is one of cached (no request), not-modified (304), adopted,
+    fetched, resumed or failed.
+    '''
+    res = {
+        'url': url,
+        'dst': dst,
+        'status': None,
+        'bytes': 0,
+        'duration': None,
+        'error': None,
+    }
+    t0 = time.time()
+    part = dst + '.part'
+    try:
+        entry = manifest.get(url) if manifest else None
+        headers = {}
+
+        if os.path.exists(dst):
+            if manifest and entry and manifest.verify(url, dst):
+                if not revalidate:
+                    res['status'] = 'cached'
+                    return res
+                headers.update(_validators(entry))
+            elif manifest and not entry:
+                entry = _adopt(session, url, dst, timeout)
+                if entry:
+                    manifest.set(url, entry)
+                    res['status'] = 'adopted'
+                    return res
+                logger.error('%s is incomplete, fetching it again' % dst)
+                os.remove(dst)
+            elif manifest:
+                manifest.remove(url)
+                os.remove(dst)
+            else:
+                res['status'] = 'cached'
+                return res
+
+        # pick up where an interrupted download stopped
+        sha = hashlib.sha256()
+        offset = 0
+        if os.path.exists(part) and not headers:
+            validator = _part_validator(part)
+            if validator is None:
+                # without a validator a changed file would be spliced
+                # onto the old bytes
+                _remove_part(part)
+            elif os.path.getsize(part):
+                offset = os.path.getsize(part)
+                headers['Range'] = 'bytes=%s-' % offset
+                headers['If-Range'] = validator
+
+        with session.get(url, stream=True, allow_redirects=True, timeout=timeout, headers=headers) as rr:
+            if rr.status_code == 304:
+                res['status'] = 'not-modified'
+                return res
+            if offset and rr.status_code == 416:
+                # the .part is already complete (or longer than the file),
+                # a run died before renaming it
+                logger.info('%s can not be resumed, fetching it again' % part)
+                rr.close()
+                _remove_part(part)
+                return download_file(session, url, dst, manifest=manifest, revalidate=revalidate,
+                                     chunk_size=chunk_size, timeout=timeout)
+            rr.raise_for_status()
+
+            if offset and rr.status_code == 206:
+                res['status'] = 'resumed'
+                with open(part, 'rb') as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b''):
+                        sha.update(chunk)
+                mode = 'ab'
+            else:
+                res['status'] = 'fetched'
+                offset = 0
+                mode = 'wb'
+                with open(part + '.json', 'w') as f:
+                    f.write(json.dumps({
+                        'url': url,
+                        'etag': rr.headers.get('ETag'),
+                        'last_modified': rr.headers.get('Last-Modified'),
+                    }))
+
+            with open(part, mode) as f:
+                for chunk in rr.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    sha.update(chunk)
+                    res['bytes'] += len(chunk)
+
+            expected = rr.headers.get('Content-Length')
+            if expected is not None and int(expected) != res['bytes']:
+                raise IOError('got %s of %s bytes' % (res['bytes'], expected))
+
+            etag = rr.headers.get('ETag')
+            last_modified = rr.headers.get('Last-Modified')
+
+        os.chmod(part, 0o644)
+        os.rename(part, dst)
+        _remove_part(part)
+        if manifest:
+            manifest.set(url, {
+                'path': dst,
+                'size': os.path.getsize(dst),
+                'mtime': os.stat(dst).st_mtime,
+                'sha256': sha.hexdigest(),
+                'etag': etag,
+                'last_modified': last_modified,
+            })
+
+    except Exception as e:
+        # the .part file is kept so the next run can resume it
+        res['status'] = 'failed'
+        res['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        res['duration'] = time.time() - t0
+    return res
+
+
+def fetch_listing(session, url, cache_file, manifest=None, timeout=60):
+    '''Return the text of an index page, reusing cache_file on a 304'''
+    entry = manifest.get(url) if manifest else None
+    headers = {}
+    if entry and os.path.exists(cache_file):
+        headers = _validators(entry)
+    rr = session.get(url, headers=headers, timeout=timeout)
+    if rr.status_code == 304:
+        logger.info('%s not modified' % url)
+        with open(cache_file, 'r') as f:
+            return f.read()
+    rr.raise_for_status()
+    with open(cache_file, 'w') as f:
+        f.write(rr.text)
+    if manifest:
+        manifest.set(url, {
+            'path': cache_file,
+            'etag': rr.headers.get('ETag'),
+            'last_modified': rr.headers.get('Last-Modified'),
+        })
+    return rr.text
+
+
+def download_files(downloads, jobs=4, session=None, manifest=None, revalidate=False):
+    '''Fetch [(url, dst), ...] with up to jobs concurrent connections'''
+    if not downloads:
+        return []
+    if session is None:
+        session = make_session(pool_size=jobs)
+
+    results = []
+    lock = threading.Lock()
+    t0 = time.time()
+
+    def _fetch(url, dst):
+        res = download_file(session, url, dst, manifest=manifest, revalidate=revalidate)
+        with lock:
+            results.append(res)
+            done = len(results)
+        if res['error']:
+            logger.error('[%s/%s] %s failed: %s' % (done, len(downloads), url, res['error']))
+        elif res['bytes']:
+            logger.info('[%s/%s] %s %s %.1fMB in %.1fs (%.1fMB/s)' % (
+                done,
+                len(downloads),
+                res['status'],
+                os.path.basename(dst),
+                _mb(res['bytes']),
+                res['duration'],
+                _mb(res['bytes']) / max(res['duration'], 0.001)
+            ))
+        else:
+            logger.debug('[%s/%s] %s %s' % (done, len(downloads), res['status'], os.path.basename(dst)))
+        return res
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_fetch, url, dst) for (url, dst) in downloads]
+        for future in as_completed(futures):
+            future.result()
+
+    if manifest:
+        manifest.save()
+
+    duration = time.time() - t0
+    total = sum([x['bytes'] for x in results])
+    statuses = {}
+    for res in results:
+        statuses[res['status']] = statuses.get(res['status'], 0) + 1
+    logger.info('%s, %.1fMB in %.1fs (%.1fMB/s)' % (
+        ', '.join(['%s %s' % (v, k) for k,v in sorted(statuses.items())]),
+        _mb(total),
+        duration,
+        _mb(total) / max(duration, 0.001)
+    ))
+    return results
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+# Build the tarball `ansible-galaxy collection build` would make from an
+# assembled ansible_collections/<ns>/<name> tree.
+#
+#   build_artifact(cdir, 'jctanner-cloud_vmware-2.10.0.tar.gz')
+#
+# The tarball holds the collection's files (galaxy.yml excluded), plus
+# MANIFEST.json, made from galaxy.yml, and FILES.json, the sha256 of every
+# file. Each file is read once: the checksum is taken while tarfile
+# streams it into the archive, and the two json files go in at the end.
+#
+# The same tree always gives the same bytes. Entries are sorted, and the
+# mtimes, owners and modes (0644, or 0755 for dirs and executables) are
+# fixed. The gzip header carries no name or time.
+
+import fnmatch
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import stat
+import tarfile
+
+import yaml
+
+
+# 2019-01-01, unless SOURCE_DATE_EPOCH says otherwise
+ARTIFACT_MTIME = int(os.environ.get('SOURCE_DATE_EPOCH', 1546300800))
+
+# what ansible-galaxy leaves out of a build
+IGNORE_FILES = ['galaxy.yml', '*.pyc', '*.retry', '.*.tmp']
+IGNORE_DIRS = ['.git', '__pycache__', 'tests/output']
+
+COLLECTION_INFO = {
+    'namespace': None,
+    'name': None,
+    'version': None,
+    'authors': [],
+    'readme': 'README.md',
+    'tags': [],
+    'description': None,
+    'license': [],
+    'license_file': None,
+    'dependencies': {},
+    'repository': None,
+    'documentation': None,
+    'homepage': None,
+    'issues': None,
+}
+
+
+# ansible's 2.10.0.dev0, 2.9.0rc1 ...
+PRERELEASE_RE = re.compile(r'^(\d+\.\d+\.\d+)(?:\.?([a-z]+\d*))?(\+[0-9A-Za-z.]+)?$')
+
+
+def semver(version):
+    '''Galaxy wants semver, 2.10.0.dev0+pull.1 becomes 2.10.0-dev0+pull.1'''
+    match = PRERELEASE_RE.match(str(version))
+    if match:
+        (release, prerelease, build) = match.groups()
+        if prerelease:
+            release = '%s-%s' % (release, prerelease)
+        return release + (build or '')
+    return str(version)
+
+
+def artifact_name(namespace, name, version):
+    return '%s-%s-%s.tar.gz' % (namespace, name, semver(version))
+
+
+def collection_info(galaxy_yml):
+    '''MANIFEST.json's collection_info for a galaxy.yml'''
+    with open(galaxy_yml, 'r') as f:
+        gdata = yaml.safe_load(f.read()) or {}
+    info = {}
+    for (k, default) in COLLECTION_INFO.items():
+        value = gdata.get(k)
+        info[k] = default if value is None else value
+    if not isinstance(info['license'], list):
+        info['license'] = [info['license']]
+    info['version'] = semver(info['version'])
+    return info
+
+
+class _HashingReader(object):
+    '''Hand a file to tarfile and checksum what it reads'''
+
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha.update(data)
+        return data
+
+
+def _walk(cdir):
+    '''Sorted (relative path, is dir) below cdir, minus ignored files'''
+    entries = []
+    for (dirpath, dirnames, filenames) in os.walk(cdir):
+        reldir = os.path.relpath(dirpath, cdir)
+        dirnames[:] = [
+            x for x in dirnames
+            if x not in IGNORE_DIRS and os.path.normpath(os.path.join(reldir, x)) not in IGNORE_DIRS
+        ]
+        for dn in dirnames:
+            entries.append((os.path.normpath(os.path.join(reldir, dn)), True))
+        for fn in filenames:
+            relpath = os.path.normpath(os.path.join(reldir, fn))
+            if [x for x in IGNORE_FILES if fnmatch.fnmatch(relpath, x) or fnmatch.fnmatch(fn, x)]:
+                continue
+            entries.append((relpath, False))
+    return sorted(entries)
+
+
+def _tarinfo(name, mode, size=0, ftype=tarfile.REGTYPE):
+    ti = tarfile.TarInfo(name)
+    ti.type = ftype
+    ti.mode = mode
+    ti.size = size
+    ti.mtime = ARTIFACT_MTIME
+    ti.uid = ti.gid = 0
+    ti.uname = ti.gname = ''
+    return ti
+
+
+def _add_json(tar, name, data):
+    blob = json.dumps(data, indent=4, sort_keys=True).encode('utf-8')
+    ti = _tarinfo(name, 0o644, len(blob))
+    tar.addfile(ti, io.BytesIO(blob))
+    return hashlib.sha256(blob).hexdigest()
+
+
+def build_artifact(cdir, dst, version=None):
+    '''Write the galaxy tarball of the collection in cdir to dst
+
+    version, if given, is what the tarball is named for, and the
+    collection's galaxy.yml has to agree with it.
+    '''
+    info = collection_info(os.path.join(cdir, 'galaxy.yml'))
+    if version is not None and info['version'] != semver(version):
+        raise ValueError('%s has version %s, not %s' % (cdir, info['version'], semver(version)))
+    files = [{
+        'name': '.',
+        'ftype': 'dir',
+        'chksum_type': None,
+        'chksum_sha256': None,
+        'format': 1,
+    }]
+
+    with open(dst, 'wb') as raw:
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode='w', format=tarfile.PAX_FORMAT) as tar:
+                for (relpath, isdir) in _walk(cdir):
+                    path = os.path.join(cdir, relpath)
+                    if isdir:
+                        tar.addfile(_tarinfo(relpath, 0o755, ftype=tarfile.DIRTYPE))
+                        files.append({
+                            'name': relpath,
+                            'ftype': 'dir',
+                            'chksum_type': None,
+                            'chksum_sha256': None,
+                            'format': 1,
+                        })
+                        continue
+
+                    st = os.stat(path)
+                    mode = 0o755 if st.st_mode & stat.S_IXUSR else 0o644
+                    with open(path, 'rb') as f:
+                        reader = _HashingReader(f)
+                        tar.addfile(_tarinfo(relpath, mode, st.st_size), reader)
+                    files.append({
+                        'name': relpath,
+                        'ftype': 'file',
+                        'chksum_type': 'sha256',
+                        'chksum_sha256': reader.sha.hexdigest(),
+                        'format': 1,
+                    })
+
+                files_sha = _add_json(tar, 'FILES.json', {'files': files, 'format': 1})
+                _add_json(tar, 'MANIFEST.json', {
+                    'collection_info': info,
+                    'file_manifest_file': {
+                        'name': 'FILES.json',
+                        'ftype': 'file',
+                        'chksum_type': 'sha256',
+                        'chksum_sha256': files_sha,
+                        'format': 1,
+                    },
+                    'format': 1,
+                })
+
+    return {
+        'files': len([x for x in files if x['ftype'] == 'file']),
+        'version': info['version'],
+    }
@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+
+# Point a module's ansible.module_utils imports at its collection.
+#
+# One regex pass over the module finds the import statements that mention
+# module_utils, skipping strings and comments, and only those statements
+# go through tokenize. Just the dotted module names are replaced, so
+# parenthesized imports, backslash continuations, comments and indented
+# (try/except) imports are left as they were:
+#
+#   from ansible.module_utils.vmware import (a,
+#       b)
+#   -> from ansible_collections.<ns>.<name>.plugins.module_utils.vmware import (a,
+#       b)
+#   from ansible.module_utils import vmware
+#   -> from ansible_collections.<ns>.<name>.plugins.module_utils import vmware
+#   import ansible.module_utils.vmware as vmw
+#   -> import ansible_collections.<ns>.<name>.plugins.module_utils.vmware as vmw
+#
+# Single line imports that grow past MAX_LINE_LENGTH are wrapped in
+# parentheses, one name per line.
+
+import io
+import re
+import tokenize
+
+from logzero import logger
+
+from import_scanner import STATEMENT_RE
+
+
+MODULE_UTILS = 'ansible.module_utils'
+
+# bump when the output of rewrite_imports changes
+REWRITER_VERSION = 1
+
+MAX_LINE_LENGTH = 160
+
+# strings and comments are matched only to be skipped over
+SCAN_RE = re.compile(
+    r'''(?P<skip>#[^\n]*'''
+    r'''|"""[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"""'''
+    r"""|'''[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''"""
+    r'''|"[^"\\\n]*(?:\\.[^"\\\n]*)*"'''
+    r"""|'[^'\\\n]*(?:\\.[^'\\\n]*)*')"""
+    r'|(?P<statement>' + STATEMENT_RE.pattern + r')',
+    re.MULTILINE
+)
+
+# from a.b import c, d as e, all on one line, which most imports are
+SIMPLE_FROM_RE = re.compile(
+    r'^([ \t]*)from[ \t]+([\w.]+)[ \t]+import[ \t]+([\w, \t]+?)[ \t]*\n?$'
+)
+
+
+def module_util_table(module_utils, namespace, name, blacklist=None):
+    '''Map ansible.module_utils.<mu> to its path in namespace.name'''
+    table = {}
+    for mu in module_utils:
+        if not mu or (blacklist and mu in blacklist):
+            continue
+        table['%s.%s' % (MODULE_UTILS, mu)] = \
+            'ansible_collections.%s.%s.plugins.module_utils.%s' % (namespace, name, mu)
+    return table
+
+
+def _line_offsets(source):
+    offsets = [0, 0]
+    for line in io.StringIO(source):
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+
+class _Statement(object):
+
+    def __init__(self, keyword, row, indent):
+        self.keyword = keyword
+        self.row = row
+        self.indent = indent
+        # [(start, end, dotted name, aliased)] for the module names
+        self.modules = []
+        # the imported names of a from statement, with their aliases
+        self.names = []
+        self.names_start = None
+        self.names_end = None
+        self.multiline = False
+        self.parens = False
+
+
+def _statements(source):
+    '''Yield the import statements of source, one tokenize pass'''
+    stmt = None
+    dotted = None
+    state = None
+    at_start = True
+    words = []
+
+    readline = io.StringIO(source).readline
+    for tok in tokenize.generate_tokens(readline):
+        ttype = tok.type
+        tstr = tok.string
+
+        if ttype in (tokenize.NEWLINE, tokenize.ENDMARKER) or (ttype == tokenize.OP and tstr == ';'):
+            if stmt is not None:
+                if dotted:
+                    stmt.modules.append(tuple(dotted) + (False,))
+                if words:
+                    stmt.names.append(' '.join(words))
+                yield stmt
+            stmt = None
+            dotted = None
+            words = []
+            at_start = True
+            continue
+        if ttype in (tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT):
+            continue
+
+        if at_start:
+            at_start = False
+            if ttype == tokenize.NAME and tstr in ('from', 'import'):
+                stmt = _Statement(tstr, tok.start[0], tok.start[1])
+                state = 'module'
+            continue
+        if stmt is None:
+            continue
+        if tok.end[0] != stmt.row:
+            stmt.multiline = True
+
+        if state == 'module':
+            if ttype == tokenize.NAME and tstr in ('import', 'as'):
+                if dotted:
+                    stmt.modules.append(tuple(dotted) + (tstr == 'as',))
+                dotted = None
+                state = 'names' if tstr == 'import' else 'alias'
+            elif ttype == tokenize.OP and tstr == ',':
+                if dotted:
+                    stmt.modules.append(tuple(dotted) + (False,))
+                dotted = None
+            elif ttype == tokenize.NAME or (ttype == tokenize.OP and tstr == '.'):
+                if dotted is None:
+                    dotted = [tok.start, tok.end, tstr]
+                else:
+                    dotted[1] = tok.end
+                    dotted[2] += tstr
+            else:
+                stmt = None
+
+        elif state == 'alias':
+            if ttype == tokenize.OP and tstr == ',':
+                state = 'module'
+
+        elif ttype == tokenize.OP and tstr in ('(', ')'):
+            stmt.parens = True
+        else:
+            # from x import <names>
+            if stmt.names_start is None:
+                stmt.names_start = tok.start
+            stmt.names_end = tok.end
+            if ttype == tokenize.OP and tstr == ',':
+                if words:
+                    stmt.names.append(' '.join(words))
+                words = []
+            else:
+                words.append(tstr)
+
+
+def _simple_statement(text):
+    # the _Statement tokenize would have produced, without tokenizing
+    match = SIMPLE_FROM_RE.match(text)
+    if not match:
+        return None
+    stmt = _Statement('from', 1, len(match.group(1)))
+    stmt.modules.append(((1, match.start(2)), (1, match.end(2)), match.group(2), False))
+    stmt.names = [' '.join(x.split()) for x in match.group(3).split(',')]
+    if not all(stmt.names):
+        return None
+    stmt.names_start = (1, match.start(3))
+    stmt.names_end = (1, match.end(3))
+    return stmt
+
+
+def _to_offset(offsets, pos):
+    return offsets[pos[0]] + pos[1]
+
+
+def _statement_edits(text, table):
+    # ([(start, end, replacement)], statements rewritten) for text
+    offsets = _line_offsets(text)
+    edits = []
+    count = 0
+    simple = _simple_statement(text)
+    for stmt in ([simple] if simple else _statements(text)):
+        if not stmt.modules:
+            continue
+        if stmt.keyword == 'import':
+            for module in stmt.modules:
+                # without an alias the code refers to the old dotted
+                # path, so the statement has to stay
+                if module[3] and module[2] in table:
+                    edits.append((
+                        _to_offset(offsets, module[0]),
+                        _to_offset(offsets, module[1]),
+                        table[module[2]]
+                    ))
+                    count += 1
+            continue
+
+        (start, end, dotted) = stmt.modules[0][:3]
+        if dotted in table:
+            newname = table[dotted]
+        else:
+            # from ansible.module_utils.x import y where x.y is the module
+            targets = set()
+            for name in stmt.names:
+                child = table.get(dotted + '.' + name.split()[0])
+                if child is None:
+                    targets = None
+                    break
+                targets.add(child.rsplit('.', 1)[0])
+            if not targets or len(targets) != 1:
+                continue
+            newname = targets.pop()
+
+        edits.append((_to_offset(offsets, start), _to_offset(offsets, end), newname))
+        count += 1
+
+        # keep single line imports within the line length limit
+        line = text[offsets[start[0]]:offsets[start[0] + 1]].rstrip('\r\n')
+        if stmt.multiline or stmt.parens or len(line) - len(dotted) + len(newname) <= MAX_LINE_LENGTH:
+            continue
+        if stmt.names == ['*']:
+            continue
+        pad = ' ' * stmt.indent
+        wrapped = '(\n'
+        for name in stmt.names:
+            wrapped += '%s    %s,\n' % (pad, name)
+        wrapped += pad + ')'
+        edits.append((
+            _to_offset(offsets, stmt.names_start),
+            _to_offset(offsets, stmt.names_end),
+            wrapped
+        ))
+    return (edits, count)
+
+
+def rewrite_imports(source, table, filename='<unknown>'):
+    '''Return (source, rewritten statement count) with table applied'''
+    if MODULE_UTILS not in source or not table:
+        return (source, 0)
+
+    edits = []
+    count = 0
+    for match in SCAN_RE.finditer(source):
+        text = match.group('statement')
+        if text is None:
+            continue
+        try:
+            (these, rewritten) = _statement_edits(text, table)
+        except (tokenize.TokenError, IndentationError, SyntaxError) as e:
+            logger.error('can not rewrite %r in %s: %s' % (text.strip(), filename, e))
+            continue
+        for (start, end, replacement) in these:
+            edits.append((match.start() + start, match.start() + end, replacement))
+        count += rewritten
+
+    if not edits:
+        return (source, 0)
+    chunks = []
+    last = 0
+    for (start, end, replacement) in sorted(edits):
+        chunks.append(source[last:start])
+        chunks.append(replacement)
+        last = end
+    chunks.append(source[last:])
+    return (''.join(chunks), count)
+
+
+# from ansible.modules.cloud.vmware import vmware_guest
+# from ansible.modules.cloud.vmware.vmware_guest import main
+UNIT_IMPORT_RE = re.compile(
+    r'^([ \t]*)from[ \t]+ansible\.modules((?:\.\w+)*)[ \t]+import[ \t]+([^\n#(\\]+?)[ \t]*$',
+    re.MULTILINE
+)
+SINGLE_NAME_RE = re.compile(r'^(\w+)(?:[ \t]+as[ \t]+\w+)?$')
+
+
+def rewrite_unit_imports(source, modules, rel_path):
+    '''Return (source, count) with imports of modules made relative
+
+    modules is a set of module names, rel_path the leading dots that reach
+    the collection root from the test file's package:
+
+        from ansible.modules.cloud.vmware import vmware_guest
+        -> from ...plugins.modules import vmware_guest
+    '''
+    if 'ansible.modules' not in source:
+        return (source, 0)
+
+    rewritten = []
+
+    def _replace(match):
+        (indent, package, names) = match.groups()
+        last = package.split('.')[-1]
+        if last in modules:
+            rewritten.append(last)
+            return '%sfrom %splugins.modules.%s import %s' % (indent, rel_path, last, names)
+        single = SINGLE_NAME_RE.match(names)
+        if single and single.group(1) in modules:
+            rewritten.append(single.group(1))
+            return '%sfrom %splugins.modules import %s' % (indent, rel_path, names)
+        return match.group(0)
+
+    source = UNIT_IMPORT_RE.sub(_replace, source)
+    return (source, len(rewritten))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Find the ansible.module_utils imports of a module without shelling out.
+#
+#   from ansible.module_utils.basic import AnsibleModule      -> basic
+#   from ansible.module_utils.vmware import (a,               -> vmware
+#       b)
+#   from ansible.module_utils.network.common.utils import \   -> network.common.utils
+#       to_list
+#   from ansible.module_utils import six                       -> six
+#   import ansible.module_utils.urls                           -> urls
+
+import ast
+import re
+
+from logzero import logger
+
+
+MODULE_UTILS = 'ansible.module_utils'
+
+# locate candidate statements; each one is then parsed on its own so the
+# rest of the module never goes through the parser
+STATEMENT_RE = re.compile(
+    r'^[ \t]*(?:from[ \t]+ansible\.module_utils\b|import[ \t][^\n]*\bansible\.module_utils\.)'
+    r'(?:\([^)]*\)|\\\n|[^\n(])*',
+    re.MULTILINE
+)
+FROM_RE = re.compile(
+    r'^from[ \t]+ansible\.module_utils(?:\.([\w.]+))?[ \t]+import[ \t]+(.*)$',
+    re.DOTALL
+)
+
+
+def _strip_prefix(name):
+    if name == MODULE_UTILS:
+        return ''
+    return name[len(MODULE_UTILS) + 1:]
+
+
+def _is_module_utils(name):
+    return name == MODULE_UTILS or name.startswith(MODULE_UTILS + '.')
+
+
+def _names_from_ast(tree):
+    mutils = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom):
+            if node.level or not node.module or not _is_module_utils(node.module):
+                continue
+            if node.module == MODULE_UTILS:
+                # ansible/module_utils/__init__.py is empty, so these are submodules
+                for alias in node.names:
+                    mutils.add(alias.name)
+            else:
+                mutils.add(_strip_prefix(node.module))
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                if _is_module_utils(alias.name) and alias.name != MODULE_UTILS:
+                    mutils.add(_strip_prefix(alias.name))
+    return mutils
+
+
+def _names_from_statement(statement):
+    # used when a statement will not parse on its own (trailing comments
+    # inside continuations, py2-only syntax, etc)
+    mutils = set()
+    statement = statement.replace('\\\n', ' ')
+    match = FROM_RE.match(statement)
+    if match:
+        if match.group(1):
+            mutils.add(match.group(1))
+            return mutils
+        for name in match.group(2).strip().strip('()').split(','):
+            name = name.split('#')[0].strip()
+            if name:
+                mutils.add(name.split()[0])
+        return mutils
+
+    for name in statement[len('import'):].split(','):
+        name = name.split('#')[0].strip()
+        if not name:
+            continue
+        name = name.split()[0]
+        if _is_module_utils(name) and name != MODULE_UTILS:
+            mutils.add(_strip_prefix(name))
+    return mutils
+
+
+def find_module_utils_imports(source, filename='<unknown>'):
+    '''Return the sorted module_utils names imported by python source (str or bytes)'''
+    if isinstance(source, bytes):
+        source = source.decode('utf-8', 'replace')
+    if MODULE_UTILS not in source:
+        return []
+
+    mutils = set()
+    for match in STATEMENT_RE.finditer(source):
+        statement = match.group(0).strip()
+        try:
+            mutils.update(_names_from_ast(ast.parse(statement)))
+        except SyntaxError as e:
+            logger.debug('falling back to text scan in %s: %s' % (filename, e))
+            mutils.update(_names_from_statement(statement))
+
+    return sorted(mutils)
+
+
+def scan_module_utils_imports(filename):
+    '''Return the sorted module_utils names imported by a single file'''
+    with open(filename, 'rb') as f:
+        source = f.read()
+    return find_module_utils_imports(source, filename=filename)
+
+
+def scan_module_utils_tree(filenames):
+    '''Map each filename to its module_utils imports'''
+    return dict((fn, scan_module_utils_imports(fn)) for fn in filenames)
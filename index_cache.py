@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+# Per-file index results keyed by content digest.
+#
+# Consecutive releases share most module files byte for byte, so the
+# results of scanning a file (module_utils imports, doc fragments, parse
+# status) are stored under the sha256 of its content and reused by every
+# release that ships the same bytes. The store is a sqlite db so that
+# parallel indexers (index_collections --jobs) can share it.
+#
+#   with IndexCache('meta/index-cache.sqlite') as cache:
+#       result = cache.get_or_compute(source, scan, kind='.py')
+#
+# Closing flushes what was computed and evicts what is over the limit.
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from logzero import logger
+
+
+# bump when the shape or meaning of the cached data changes
+INDEX_CACHE_VERSION = 2
+
+
+class IndexCache(object):
+
+    # how many new entries to hold before committing
+    BATCH_SIZE = 500
+
+    def __init__(self, filename, max_entries=100000, version=INDEX_CACHE_VERSION):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # digest -> row, not yet committed
+        self._pending = {}
+        self._touched = set()
+
+        dirn = os.path.dirname(filename)
+        if dirn and not os.path.exists(dirn):
+            os.makedirs(dirn)
+
+        self.conn = sqlite3.connect(filename, timeout=120)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'digest TEXT PRIMARY KEY, '
+            'version INTEGER, '
+            'data TEXT, '
+            'last_used REAL)'
+        )
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)'
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def digest(data, kind=''):
+        # kind keeps e.g. .py and .ps1 results for identical bytes apart
+        sha = hashlib.sha256(kind.encode('utf-8') + b'\0')
+        sha.update(data)
+        return sha.hexdigest()
+
+    def get(self, digest):
+        if digest in self._pending:
+            self.hits += 1
+            return json.loads(self._pending[digest][2])
+        row = self.conn.execute(
+            'SELECT data FROM entries WHERE digest=? AND version=?',
+            (digest, self.version)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.add(digest)
+        return json.loads(row[0])
+
+    def put(self, digest, data):
+        self._pending[digest] = (digest, self.version, json.dumps(data), time.time())
+        if len(self._pending) >= self.BATCH_SIZE:
+            self.flush()
+
+    def get_or_compute(self, source, func, kind=''):
+        '''Return the cached result for source (bytes), calling func(source) on a miss'''
+        digest = self.digest(source, kind=kind)
+        data = self.get(digest)
+        if data is None:
+            data = func(source)
+            self.put(digest, data)
+        return data
+
+    def flush(self):
+        now = time.time()
+        with self.conn:
+            if self._pending:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO entries (digest, version, data, last_used) '
+                    'VALUES (?, ?, ?, ?)',
+                    list(self._pending.values())
+                )
+            if self._touched:
+                self.conn.executemany(
+                    'UPDATE entries SET last_used=? WHERE digest=?',
+                    [(now, x) for x in self._touched]
+                )
+        self._pending = {}
+        self._touched = set()
+
+    def evict(self):
+        # drop stale versions, then the least recently used entries over the limit
+        with self.conn:
+            cur = self.conn.execute('DELETE FROM entries WHERE version!=?', (self.version,))
+            self.evictions += cur.rowcount
+            count = self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            if count > self.max_entries:
+                cur = self.conn.execute(
+                    'DELETE FROM entries WHERE digest IN '
+                    '(SELECT digest FROM entries ORDER BY last_used ASC LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+                self.evictions += cur.rowcount
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (float(self.hits) / total) if total else 0.0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.evict()
+        self.conn.close()
+        stats = self.stats()
+        logger.info(
+            'index cache %s: %s hits, %s misses (%.1f%%), %s evicted' % (
+                self.filename,
+                stats['hits'],
+                stats['misses'],
+                stats['hit_rate'] * 100,
+                stats['evictions']
+            )
+        )
+        return stats
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+# Put release files into assembled collections without copying their bytes.
+#
+# Files that are used as-is are reflinked (copy-on-write clones, on btrfs,
+# xfs, ...) or hardlinked to the release tree, and copied only when
+# neither works, e.g. across filesystems. Files whose content changes are
+# written as new files and renamed over the destination (see
+# output_writer.OutputWriter, which this extends):
+#
+#   mat = Materializer()
+#   mat.place(src, dst)           # link or copy, unchanged content
+#   mat.place(src, dst, transform=fix)   # or write what fix(dst, data) returns
+#   mat.write(dst, data)          # new content, breaks any link
+#   mat.link(target, dst)         # a symlink, as the release has it
+#   mat.copytree(srcdir, dstdir)
+#   mat.report()
+#
+# A destination that already has the right content is left alone. A
+# hardlinked destination shares its inode with the release, so it must
+# never be opened for writing in place. Always go through write().
+
+import errno
+import os
+import shutil
+
+from logzero import logger
+
+from output_writer import OutputWriter
+from output_writer import same_files
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+MODES = ['auto', 'reflink', 'hardlink', 'copy']
+
+# linux/fs.h
+FICLONE = 0x40049409
+
+# errors meaning "this filesystem can not do that", not "this file is bad"
+UNSUPPORTED = (
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EINVAL,
+    errno.EMLINK,
+)
+
+
+def _tmpname(dst):
+    return os.path.join(
+        os.path.dirname(dst),
+        '.%s.%s.tmp' % (os.path.basename(dst), os.getpid())
+    )
+
+
+class Materializer(OutputWriter):
+
+    def __init__(self, mode='auto'):
+        if mode not in MODES:
+            raise ValueError('unknown materialize mode %s' % mode)
+        OutputWriter.__init__(self)
+        self.mode = mode
+        # (src dev, dst dir dev) pairs that failed to reflink or link
+        self.no_reflink = set()
+        self.no_hardlink = set()
+        self.stats.update({
+            'reflinked': 0,
+            'hardlinked': 0,
+            'copied': 0,
+            'linked': 0,
+            'current': 0,
+            'bytes_avoided': 0,
+            'bytes_copied': 0,
+        })
+
+    def _reflink(self, src, tmp):
+        if fcntl is None:
+            raise OSError(errno.EOPNOTSUPP, 'no fcntl')
+        with open(src, 'rb') as fs:
+            with open(tmp, 'wb') as fd:
+                try:
+                    fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+                except IOError:
+                    fd.close()
+                    os.remove(tmp)
+                    raise
+        shutil.copymode(src, tmp)
+
+    def place(self, src, dst, transform=None):
+        '''Make dst have src's content, sharing its data blocks if possible
+
+        transform(dst, data) may return new content for the file, which is
+        then written instead, or None to use src as it is.
+        '''
+        if transform is not None:
+            with open(src, 'rb') as f:
+                data = transform(dst, f.read())
+            if data is not None:
+                return self.write(dst, data, like=src)
+
+        st = os.stat(src)
+        self._output(dst)
+        if os.path.exists(dst):
+            dst_st = os.stat(dst)
+            if (dst_st.st_dev, dst_st.st_ino) == (st.st_dev, st.st_ino) or \
+                    (dst_st.st_mode == st.st_mode and same_files(src, dst)):
+                self.stats['current'] += 1
+                self.stats['bytes_avoided'] += st.st_size
+                return 'current'
+
+        key = (st.st_dev, os.stat(os.path.dirname(dst) or '.').st_dev)
+        tmp = _tmpname(dst)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+        how = None
+        if self.mode in ('auto', 'reflink') and key not in self.no_reflink:
+            try:
+                self._reflink(src, tmp)
+                how = 'reflinked'
+            except (IOError, OSError) as e:
+                if e.errno not in UNSUPPORTED:
+                    raise
+                self.no_reflink.add(key)
+
+        if how is None and self.mode in ('auto', 'hardlink') and key not in self.no_hardlink:
+            try:
+                os.link(src, tmp)
+                how = 'hardlinked'
+            except OSError as e:
+                if e.errno not in UNSUPPORTED:
+                    raise
+                self.no_hardlink.add(key)
+
+        if how is None:
+            shutil.copy(src, tmp)
+            how = 'copied'
+            self.stats['bytes_copied'] += st.st_size
+        else:
+            self.stats['bytes_avoided'] += st.st_size
+
+        os.rename(tmp, dst)
+        self.stats[how] += 1
+        return how
+
+    def link(self, target, dst):
+        '''Make dst a symlink to target, replacing whatever is there'''
+        self._output(dst)
+        if os.path.islink(dst) and os.readlink(dst) == target:
+            self.stats['current'] += 1
+            return 'current'
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            shutil.rmtree(dst)
+        tmp = _tmpname(dst)
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(target, tmp)
+        os.rename(tmp, dst)
+        self.stats['linked'] += 1
+        return 'linked'
+
+    def copytree(self, src, dst, transform=None):
+        '''shutil.copytree with place() for every file, merging into dst'''
+        for (dirpath, dirnames, filenames) in os.walk(src, followlinks=True):
+            ddir = os.path.join(dst, os.path.relpath(dirpath, src))
+            if not os.path.exists(ddir):
+                os.makedirs(ddir)
+            for fn in filenames:
+                fsrc = os.path.join(dirpath, fn)
+                if not os.path.exists(fsrc):
+                    # dangling symlink
+                    continue
+                self.place(os.path.realpath(fsrc), os.path.join(ddir, fn), transform=transform)
+
+    def report(self):
+        logger.info(
+            'materialized %s reflinked, %s hardlinked, %s current, %s copied,'
+            ' %s linked, %s written, %s unchanged, %s pruned files,'
+            ' %.1fMB avoided, %.1fMB copied, %.1fMB written' % (
+                self.stats['reflinked'],
+                self.stats['hardlinked'],
+                self.stats['current'],
+                self.stats['copied'],
+                self.stats['linked'],
+                self.stats['written'],
+                self.stats['unchanged'],
+                self.stats['pruned'],
+                float(self.stats['bytes_avoided']) / (1024 * 1024),
+                float(self.stats['bytes_copied']) / (1024 * 1024),
+                float(self.stats['bytes_written']) / (1024 * 1024),
+            )
+        )
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# Write generated files only when their bytes change.
+#
+# Every write goes through a temp file in the destination directory and a
+# rename, so readers never see a partial file, and is skipped outright
+# when the destination already holds the same bytes. Skipped files keep
+# their mtime, which is what rpm rebuild checks and rsync to the mirrors
+# go by.
+#
+#   out = OutputWriter()
+#   out.write(dst, data)          # 'written' or 'unchanged'
+#   out.publish(tmpfile, dst)     # move a finished file into place
+#   out.prune(topdir)             # drop files under topdir not output this run
+
+import os
+import shutil
+import tempfile
+
+from logzero import logger
+
+
+def same_content(filename, data):
+    '''True if filename exists and holds exactly data (bytes)'''
+    try:
+        if os.path.getsize(filename) != len(data):
+            return False
+        with open(filename, 'rb') as f:
+            return f.read() == data
+    except (IOError, OSError):
+        return False
+
+
+def same_files(fn1, fn2, chunk_size=1024 * 1024):
+    try:
+        if os.path.getsize(fn1) != os.path.getsize(fn2):
+            return False
+        with open(fn1, 'rb') as f1:
+            with open(fn2, 'rb') as f2:
+                while True:
+                    c1 = f1.read(chunk_size)
+                    if c1 != f2.read(chunk_size):
+                        return False
+                    if not c1:
+                        return True
+    except (IOError, OSError):
+        return False
+
+
+def _default_mode():
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+class OutputWriter(object):
+
+    def __init__(self):
+        # every path written, published or found unchanged this run
+        self.outputs = set()
+        self.stats = {
+            'written': 0,
+            'unchanged': 0,
+            'pruned': 0,
+            'bytes_written': 0,
+        }
+
+    def _output(self, dst):
+        self.outputs.add(os.path.abspath(dst))
+
+    def write(self, dst, data, like=None):
+        '''Replace dst with data (str or bytes) unless it already has it
+
+        A new file's mode comes from like, else the existing dst, else
+        the umask.
+        '''
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self._output(dst)
+        if same_content(dst, data) and (like is None or \
+                os.stat(like).st_mode == os.stat(dst).st_mode):
+            self.stats['unchanged'] += 1
+            return 'unchanged'
+        if like is None and os.path.exists(dst):
+            like = dst
+
+        (fd, tmp) = tempfile.mkstemp(dir=os.path.dirname(dst) or '.', prefix='.' + os.path.basename(dst))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            if like is not None:
+                shutil.copymode(like, tmp)
+            else:
+                os.chmod(tmp, _default_mode())
+            os.rename(tmp, dst)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        self.stats['written'] += 1
+        self.stats['bytes_written'] += len(data)
+        return 'written'
+
+    def publish(self, tmpfile, dst):
+        '''Rename a finished tmpfile over dst, or drop it if dst is the same'''
+        self._output(dst)
+        if same_files(tmpfile, dst):
+            os.remove(tmpfile)
+            self.stats['unchanged'] += 1
+            return 'unchanged'
+        size = os.path.getsize(tmpfile)
+        os.rename(tmpfile, dst)
+        self.stats['written'] += 1
+        self.stats['bytes_written'] += size
+        return 'written'
+
+    def prune(self, top):
+        '''Remove files (and then empty dirs) below top that were not output'''
+        for (dirpath, dirnames, filenames) in os.walk(top, topdown=False):
+            # symlinked dirs are not walked into, they go like files
+            links = [x for x in dirnames if os.path.islink(os.path.join(dirpath, x))]
+            for fn in filenames + links:
+                path = os.path.join(dirpath, fn)
+                if os.path.abspath(path) not in self.outputs:
+                    os.remove(path)
+                    self.stats['pruned'] += 1
+            if dirpath != top and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+
+    def add_stats(self, stats):
+        '''Fold in the stats of a writer used elsewhere (another process)'''
+        for (k, v) in stats.items():
+            self.stats[k] = self.stats.get(k, 0) + v
+
+    def report(self, what='files'):
+        logger.info('%s %s written, %s unchanged, %s pruned, %.1fMB written' % (
+            self.stats['written'],
+            what,
+            self.stats['unchanged'],
+            self.stats['pruned'],
+            float(self.stats['bytes_written']) / (1024 * 1024),
+        ))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Decide which paths of a tree to keep, when some of its directories are
+# restricted to a whitelist of what they may contain:
+#
+#   wl = PathWhitelist({'lib/ansible/modules': ['__init__.py']})
+#   wl.match('lib/ansible/modules/cloud')       # DROP
+#   wl.match('lib/ansible/modules/__init__.py') # KEEP
+#   wl.match('lib/ansible/modules')             # DESCEND
+#   wl.match('lib/ansible/cli')                 # KEEP, not restricted
+#
+# Everything outside a restricted directory is kept. Inside one, a path is
+# kept when it is a whitelisted path, below one, or above one. Paths are
+# compared component by component through a prefix trie, so matching is
+# exact ('six' is not 'sixty') and costs one dict lookup per component.
+
+import os
+
+
+KEEP = 'keep'
+DROP = 'drop'
+# an ancestor of something kept, whose entries need checking
+DESCEND = 'descend'
+
+
+class _Node(object):
+
+    def __init__(self):
+        self.children = {}
+        self.restricted = False
+        self.whitelisted = False
+
+
+def _parts(path):
+    return [x for x in os.path.normpath(path).split(os.sep) if x not in ('', '.')]
+
+
+class PathWhitelist(object):
+
+    def __init__(self, restricted):
+        '''restricted maps directories to the paths (relative to them) they keep'''
+        self.root = _Node()
+        for (top, paths) in restricted.items():
+            self._node(_parts(top)).restricted = True
+            for path in paths:
+                self._node(_parts(top) + _parts(path)).whitelisted = True
+
+    def _node(self, parts):
+        node = self.root
+        for part in parts:
+            node = node.children.setdefault(part, _Node())
+        return node
+
+    def match(self, relpath):
+        '''KEEP, DROP or DESCEND for a path relative to the tree'''
+        node = self.root
+        restricted = False
+        for part in _parts(relpath):
+            node = node.children.get(part)
+            if node is None:
+                return DROP if restricted else KEEP
+            if node.whitelisted:
+                return KEEP
+            restricted = restricted or node.restricted
+        return DESCEND
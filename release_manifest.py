@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# What get_releases knows about each file it has downloaded.
+#
+#   {
+#     "https://releases.ansible.com/ansible//ansible-2.7.0.tar.gz": {
+#       "path": ".cache/releases/ansible-2.7.0.tar.gz",
+#       "size": 11800011,
+#       "mtime": 1546300800.0,
+#       "sha256": "...",
+#       "etag": "\"5bb4...\"",
+#       "last_modified": "Thu, 04 Oct 2018 17:48:39 GMT"
+#     }
+#   }
+#
+# A file on disk only counts as downloaded when it matches its entry, so a
+# truncated or corrupted tarball is fetched again instead of kept forever.
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from logzero import logger
+
+
+def sha256_file(filename, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ReleaseManifest(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r') as f:
+                    self.entries = json.loads(f.read())
+            except ValueError as e:
+                logger.error('ignoring unreadable manifest %s: %s' % (filename, e))
+
+    def get(self, url):
+        with self.lock:
+            return self.entries.get(url)
+
+    def set(self, url, entry):
+        with self.lock:
+            self.entries[url] = entry
+
+    def remove(self, url):
+        with self.lock:
+            self.entries.pop(url, None)
+
+    def verify(self, url, path):
+        '''True if path is the complete file recorded for url'''
+        entry = self.get(url)
+        if not entry or not os.path.exists(path):
+            return False
+        st = os.stat(path)
+        if st.st_size != entry.get('size'):
+            logger.error('%s is %s bytes, expected %s' % (path, st.st_size, entry.get('size')))
+            return False
+        # unchanged since it was recorded, skip rehashing it
+        if st.st_mtime == entry.get('mtime'):
+            return True
+        if sha256_file(path) != entry.get('sha256'):
+            logger.error('%s does not match its recorded sha256' % path)
+            return False
+        entry['mtime'] = st.st_mtime
+        return True
+
+    def save(self):
+        dirn = os.path.dirname(self.filename) or '.'
+        with self.lock:
+            data = json.dumps(self.entries, indent=2, sort_keys=True)
+        (fd, tmpfile) = tempfile.mkstemp(dir=dirn, prefix='.' + os.path.basename(self.filename))
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.chmod(tmpfile, 0o644)
+        os.rename(tmpfile, self.filename)
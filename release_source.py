@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+
+# Where _index_collections reads a release from.
+#
+# DirectoryRelease is an extracted tarball or the devel.git checkout.
+# TarballRelease reads the same content straight out of a release
+# tarball in one streaming pass, without extracting anything. Both hand
+# out paths as if the tarball were extracted into releasedir, so the meta
+# they produce is interchangeable.
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+from logzero import logger
+
+from release_manifest import sha256_file
+from release_tests import find_entries
+from release_tests import read_file
+
+
+# paths (relative to the release top dir) the indexer looks at
+INDEX_PREFIXES = [
+    'lib/ansible/modules/',
+    'lib/ansible/module_utils/',
+    'lib/ansible/plugins/doc_fragments/',
+    'lib/ansible/utils/module_docs_fragments/',
+    'test/',
+]
+
+# members whose content the indexer reads
+INDEX_CONTENT_PREFIXES = [
+    'lib/ansible/modules/',
+    'test/units/modules/',
+]
+TARGETS_PREFIX = 'test/integration/targets/'
+
+# what a full (non --stream) extraction keeps of a release tarball
+EXTRACT_PREFIXES = [
+    'lib/ansible/',
+    'test/',
+]
+
+# written into an extracted release, records what it was extracted from
+EXTRACT_MARKER = '.gravity-extracted'
+
+
+def _member_kind(member):
+    if member.isdir():
+        return 'd'
+    if member.isfile() or member.islnk():
+        return 'f'
+    if member.issym():
+        return 'l'
+    return None
+
+
+def _member_relpath(name):
+    # ansible-2.7.0/lib/ansible/... -> lib/ansible/...
+    parts = name.lstrip('./').split('/', 1)
+    if len(parts) < 2:
+        return ''
+    return parts[1].rstrip('/')
+
+
+def _wanted(relpath, prefixes):
+    # prefixes match whole path components, a trailing / is optional
+    for prefix in prefixes:
+        prefix = prefix.rstrip('/')
+        if relpath == prefix or relpath.startswith(prefix + '/'):
+            return True
+    return False
+
+
+class DirectoryRelease(object):
+
+    def __init__(self, rdir):
+        self.rdir = rdir
+        self.modules_dir = os.path.join(rdir, 'lib', 'ansible', 'modules')
+
+    def _module_entries(self, kind):
+        entries = []
+        if kind == 'd' and os.path.isdir(self.modules_dir):
+            entries.append('.')
+        for (path, thiskind) in find_entries(self.modules_dir):
+            if thiskind == kind:
+                entries.append('.' + path[len(self.modules_dir):])
+        return entries
+
+    def module_dirs(self):
+        '''Same as `cd lib/ansible/modules; find . -type d`'''
+        return self._module_entries('d')
+
+    def module_files(self):
+        '''Same as `cd lib/ansible/modules; find . -type f`'''
+        return self._module_entries('f')
+
+    def test_entries(self):
+        return None
+
+    def read(self, path):
+        return read_file(path)
+
+
+class TarballRelease(object):
+
+    def __init__(self, tarball, rdir):
+        self.tarball = tarball
+        self.rdir = rdir
+        self.modules_dir = os.path.join(rdir, 'lib', 'ansible', 'modules')
+        self.entries = []
+        self.content = {}
+        self._scan()
+
+    def _scan(self):
+        logger.info('reading %s' % self.tarball)
+        with tarfile.open(self.tarball, 'r|gz') as tar:
+            for member in tar:
+                relpath = _member_relpath(member.name)
+                if not relpath or not _wanted(relpath, INDEX_PREFIXES):
+                    continue
+                kind = _member_kind(member)
+                if kind is None:
+                    continue
+                path = os.path.join(self.rdir, relpath)
+                self.entries.append((path, kind))
+
+                if kind != 'f':
+                    continue
+                if not _wanted(relpath, INDEX_CONTENT_PREFIXES) and \
+                        not (relpath.startswith(TARGETS_PREFIX) and relpath.endswith('.yml')):
+                    continue
+                if member.islnk():
+                    target = os.path.join(self.rdir, _member_relpath(member.linkname))
+                    self.content[path] = self.content.get(target, b'')
+                else:
+                    self.content[path] = tar.extractfile(member).read()
+
+        # find's order for an extracted tree is unknowable from the
+        # archive, sorted order is at least stable
+        self.entries = sorted(self.entries)
+
+    def _module_entries(self, kind):
+        entries = []
+        prefix = self.modules_dir + os.sep
+        for (path, thiskind) in self.entries:
+            if thiskind != kind:
+                continue
+            if path == self.modules_dir:
+                entries.append('.')
+            elif path.startswith(prefix):
+                entries.append('.' + path[len(self.modules_dir):])
+        return entries
+
+    def module_dirs(self):
+        return self._module_entries('d')
+
+    def module_files(self):
+        return self._module_entries('f')
+
+    def test_entries(self):
+        return self.entries
+
+    def read(self, path):
+        if path in self.content:
+            return self.content[path]
+        raise IOError('%s was not read from %s' % (path, self.tarball))
+
+
+def open_release(tb, releasedir, stream=False):
+    '''Return a DirectoryRelease or, for unextracted/streamed tarballs, a TarballRelease'''
+    if tb.endswith('.tar.gz'):
+        rdir = os.path.join(releasedir, os.path.basename(tb).replace('.tar.gz', ''))
+        tarball = os.path.join(releasedir, os.path.basename(tb))
+        if stream or not os.path.exists(rdir):
+            return TarballRelease(tarball, rdir)
+        return DirectoryRelease(rdir)
+    return DirectoryRelease(os.path.join(releasedir, tb))
+
+
+def extract_members(tarball, destdir, prefixes):
+    '''Extract the members of tarball under any of prefixes into destdir
+
+    prefixes are relative to the release top dir (lib/ansible/modules/x.py,
+    test/integration/targets/x/). Returns the number of members extracted.
+    '''
+    count = 0
+    with tarfile.open(tarball, 'r|gz') as tar:
+        for member in tar:
+            relpath = _member_relpath(member.name)
+            if not relpath or not _wanted(relpath, prefixes):
+                continue
+            try:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extract(member, destdir, filter='data')
+                else:
+                    tar.extract(member, destdir)
+                count += 1
+            except Exception as e:
+                logger.error('can not extract %s from %s: %s' % (member.name, tarball, e))
+    return count
+
+
+def _read_marker(epath):
+    try:
+        with open(os.path.join(epath, EXTRACT_MARKER), 'r') as f:
+            return json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def extract_release(tarball, releasedir, prefixes=None, digest=None):
+    '''Extract the prefixes of a release tarball to releasedir/<release>
+
+    The tree is built in a temp dir and renamed into place, and is skipped
+    entirely when its marker says it came from the same tarball digest
+    with the same prefixes.
+    '''
+    if prefixes is None:
+        prefixes = EXTRACT_PREFIXES
+    prefixes = sorted(prefixes)
+    edir = os.path.basename(tarball).replace('.tar.gz', '')
+    epath = os.path.join(releasedir, edir)
+    res = {
+        'release': edir,
+        'status': None,
+        'members': 0,
+        'duration': None,
+        'error': None,
+    }
+    t0 = time.time()
+    tmpdir = None
+    try:
+        if digest is None:
+            digest = sha256_file(tarball)
+        marker = {'sha256': digest, 'prefixes': prefixes}
+        if _read_marker(epath) == marker:
+            res['status'] = 'current'
+            return res
+
+        logger.info('extracting %s' % tarball)
+        tmpdir = tempfile.mkdtemp(dir=releasedir, prefix='.' + edir + '.')
+        res['members'] = extract_members(tarball, tmpdir, prefixes)
+        topdirs = os.listdir(tmpdir)
+        if len(topdirs) != 1:
+            raise Exception('expected one top level dir in %s, found %s' % (tarball, topdirs))
+        tree = os.path.join(tmpdir, topdirs[0])
+        with open(os.path.join(tree, EXTRACT_MARKER), 'w') as f:
+            f.write(json.dumps(marker))
+
+        # swap the new tree in, the old one goes away after
+        if os.path.exists(epath):
+            old = os.path.join(tmpdir, '.old')
+            os.rename(epath, old)
+        os.rename(tree, epath)
+        res['status'] = 'extracted'
+    except Exception as e:
+        res['status'] = 'failed'
+        res['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        if tmpdir and os.path.exists(tmpdir):
+            shutil.rmtree(tmpdir)
+        res['duration'] = time.time() - t0
+    return res
+
+
+def extract_releases(tarballs, releasedir, prefixes=None, digests=None, jobs=4):
+    '''extract_release for many tarballs across a process pool'''
+    if digests is None:
+        digests = {}
+    results = []
+    if jobs and jobs > 1 and len(tarballs) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(extract_release, tb, releasedir, prefixes, digests.get(tb))
+                for tb in tarballs
+            ]
+            for future in as_completed(futures):
+                results.append(future.result())
+    else:
+        for tb in tarballs:
+            results.append(extract_release(tb, releasedir, prefixes, digests.get(tb)))
+
+    for res in sorted(results, key=lambda x: x['release']):
+        if res['error']:
+            logger.error('extract %s failed: %s' % (res['release'], res['error']))
+        elif res['status'] == 'extracted':
+            logger.info('extracted %s members of %s in %.1fs' % (
+                res['members'], res['release'], res['duration']
+            ))
+    return results
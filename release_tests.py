@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# One walk of a release's test/units and test/integration/targets trees.
+#
+# _index_collections used to run a find(1) per module (test_<module>.py),
+# per unit directory (*.py) and per integration target (*.yml). This
+# indexes both trees once so those lookups are dictionary hits. Walk order
+# follows find's (directory order, depth first) so multiple matches come
+# back in the same order as before.
+#
+# The index can also be fed entries from somewhere other than the disk
+# (see release_source.TarballRelease), as (path, kind) pairs where kind is
+# 'f' for regular files, 'd' for directories and 'l' for symlinks that
+# resolve.
+
+import os
+
+
+def walk_like_find(top):
+    '''Yield the DirEntry objects below top in the order find(1) prints them'''
+    try:
+        entries = list(os.scandir(top))
+    except OSError:
+        return
+    for entry in entries:
+        yield entry
+        if entry.is_dir(follow_symlinks=False):
+            for child in walk_like_find(entry.path):
+                yield child
+
+
+def find_entries(top):
+    '''walk_like_find as (path, kind) pairs'''
+    for entry in walk_like_find(top):
+        if entry.is_symlink():
+            if os.path.exists(entry.path):
+                yield (entry.path, 'l')
+        elif entry.is_dir():
+            yield (entry.path, 'd')
+        elif entry.is_file():
+            yield (entry.path, 'f')
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class ReleaseTestIndex(object):
+
+    def __init__(self, rdir, entries=None, read=read_file):
+        self.rdir = rdir
+        self.units_dir = os.path.join(rdir, 'test', 'units')
+        self.target_dir = os.path.join(rdir, 'test', 'integration', 'targets')
+        self.read = read
+
+        # test/units
+        self.unit_paths = set()
+        # symlinks the walk did not follow
+        self.unit_links = set()
+        self.unit_files_by_name = {}
+        self.patched_dirs = set()
+
+        # test/integration/targets
+        self.targets = set()
+        self.target_yaml = {}
+
+        if entries is None:
+            self._index_units(find_entries(self.units_dir))
+            self._index_targets(find_entries(self.target_dir))
+        else:
+            units = []
+            targets = []
+            for (path, kind) in entries:
+                if path.startswith(self.units_dir + os.sep):
+                    units.append((path, kind))
+                elif path.startswith(self.target_dir + os.sep):
+                    targets.append((path, kind))
+            self._index_units(units)
+            self._index_targets(targets)
+
+    def _index_units(self, entries):
+        modules_dir = os.path.join(self.units_dir, 'modules') + os.sep
+        for (path, kind) in entries:
+            self.unit_paths.add(path)
+            if kind == 'l':
+                self.unit_links.add(path)
+            if kind != 'f':
+                continue
+
+            name = os.path.basename(path)
+            self.unit_files_by_name.setdefault(name, []).append(path)
+
+            # tests that need test/units/modules/conftest.py
+            if name.endswith('.py') and path.startswith(modules_dir):
+                if b'patch_ansible_module' not in self.read(path):
+                    continue
+                dirn = os.path.dirname(path)
+                while dirn.startswith(self.units_dir) and dirn not in self.patched_dirs:
+                    self.patched_dirs.add(dirn)
+                    dirn = os.path.dirname(dirn)
+
+    def _index_targets(self, entries):
+        prefix = self.target_dir + os.sep
+        for (path, kind) in entries:
+            relpath = path[len(prefix):].split(os.sep)
+            if len(relpath) == 1:
+                self.targets.add(relpath[0])
+            if kind == 'f' and path.endswith('.yml'):
+                self.target_yaml.setdefault(relpath[0], []).append(path)
+
+    def find_unit_files(self, filename):
+        '''Paths of every file under test/units with this basename'''
+        return self.unit_files_by_name.get(filename, [])
+
+    def unit_exists(self, path):
+        if path in self.unit_paths:
+            return True
+        # below a symlinked dir, which only the filesystem can tell
+        dirn = os.path.dirname(path)
+        while dirn.startswith(self.units_dir + os.sep):
+            if dirn in self.unit_links:
+                return os.path.exists(path)
+            dirn = os.path.dirname(dirn)
+        return False
+
+    def uses_patch_ansible_module(self, dirn):
+        '''True if any .py file below dirn calls patch_ansible_module'''
+        return dirn in self.patched_dirs
+
+    def target_exists(self, name):
+        return name in self.targets
+
+    def target_yaml_files(self, name):
+        return self.target_yaml.get(name, [])
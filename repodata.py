@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+
+# Keep a yum/dnf repo's repodata up to date without createrepo.
+#
+#   update_repodata('cache/repos/rpm', 'cache/repos/rpm-repodata-cache.json')
+#
+# Each rpm's primary, filelists and other xml is generated once and kept
+# in the cache, keyed by path with the size and mtime it had. A run only
+# reads the headers of new or changed rpms and then joins the cached
+# pieces. The metadata files are named after their checksum, so they are
+# written next to the ones in use, and repomd.xml is renamed over the
+# old one last. A client sees either the old repo or the new one, and
+# files from the previous generation stay until the next run for anyone
+# holding the old repomd.xml.
+
+import gzip
+import hashlib
+import json
+import os
+import stat
+import struct
+import time
+
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from logzero import logger
+
+from output_writer import OutputWriter
+from release_manifest import sha256_file
+
+
+CACHE_VERSION = 1
+
+REPO_NS = 'http://linux.duke.edu/metadata/repo'
+COMMON_NS = 'http://linux.duke.edu/metadata/common'
+FILELISTS_NS = 'http://linux.duke.edu/metadata/filelists'
+OTHER_NS = 'http://linux.duke.edu/metadata/other'
+RPM_NS = 'http://linux.duke.edu/metadata/rpm'
+
+# tags read from the headers
+SIG_PAYLOADSIZE = 1007
+NAME = 1000
+VERSION = 1001
+RELEASE = 1002
+EPOCH = 1003
+SUMMARY = 1004
+DESCRIPTION = 1005
+BUILDTIME = 1006
+BUILDHOST = 1007
+SIZE = 1009
+VENDOR = 1011
+LICENSE = 1014
+PACKAGER = 1015
+GROUP = 1016
+URL = 1020
+ARCH = 1022
+OLDFILENAMES = 1027
+FILEMODES = 1030
+FILEFLAGS = 1037
+SOURCERPM = 1044
+ARCHIVESIZE = 1046
+PROVIDENAME = 1047
+REQUIREFLAGS = 1048
+REQUIRENAME = 1049
+REQUIREVERSION = 1050
+CONFLICTFLAGS = 1053
+CONFLICTNAME = 1054
+CONFLICTVERSION = 1055
+CHANGELOGTIME = 1080
+CHANGELOGNAME = 1081
+CHANGELOGTEXT = 1082
+OBSOLETENAME = 1090
+PROVIDEFLAGS = 1112
+PROVIDEVERSION = 1113
+OBSOLETEFLAGS = 1114
+OBSOLETEVERSION = 1115
+DIRINDEXES = 1116
+BASENAMES = 1117
+DIRNAMES = 1118
+
+DEPENDENCIES = [
+    ('provides', PROVIDENAME, PROVIDEFLAGS, PROVIDEVERSION),
+    ('requires', REQUIRENAME, REQUIREFLAGS, REQUIREVERSION),
+    ('conflicts', CONFLICTNAME, CONFLICTFLAGS, CONFLICTVERSION),
+    ('obsoletes', OBSOLETENAME, OBSOLETEFLAGS, OBSOLETEVERSION),
+]
+SENSE_FLAGS = {2: 'LT', 4: 'GT', 8: 'EQ', 10: 'LE', 12: 'GE'}
+# RPMSENSE_PREREQ, RPMSENSE_SCRIPT_PRE, RPMSENSE_SCRIPT_POST
+SENSE_PRE = 0x40 | 0x200 | 0x400
+RPMFILE_GHOST = 0x40
+
+
+def read_header(f):
+    '''{tag: value} of the header at f's position, leaving f after it'''
+    magic = f.read(16)
+    if len(magic) != 16 or magic[:3] != b'\x8e\xad\xe8':
+        raise ValueError('bad rpm header magic')
+    (nindex, size) = struct.unpack('>II', magic[8:])
+    index = f.read(nindex * 16)
+    data = f.read(size)
+    if len(index) != nindex * 16 or len(data) != size:
+        raise ValueError('truncated rpm header')
+    tags = {}
+    for idx in range(nindex):
+        (tag, tagtype, offset, count) = struct.unpack('>iiii', index[idx * 16:idx * 16 + 16])
+        if offset < 0 or offset > size:
+            raise ValueError('rpm header tag %s is out of bounds' % tag)
+        if tagtype in (6, 9):
+            # STRING, I18NSTRING (the first, "C", translation)
+            tags[tag] = data[offset:data.index(b'\0', offset)].decode('utf-8', 'replace')
+        elif tagtype == 8:
+            values = []
+            for x in range(count):
+                end = data.index(b'\0', offset)
+                values.append(data[offset:end].decode('utf-8', 'replace'))
+                offset = end + 1
+            tags[tag] = values
+        elif tagtype in (2, 3, 4, 5):
+            fmt = {2: 'B', 3: 'H', 4: 'I', 5: 'Q'}[tagtype]
+            width = struct.calcsize(fmt)
+            if count < 0 or offset + width * count > size:
+                raise ValueError('rpm header tag %s is out of bounds' % tag)
+            tags[tag] = list(struct.unpack('>%d%s' % (count, fmt), data[offset:offset + width * count]))
+        else:
+            tags[tag] = data[offset:offset + count]
+    return tags
+
+
+def read_rpm(filename):
+    '''The signature and main headers of an rpm and where the main one is'''
+    with open(filename, 'rb') as f:
+        if f.read(96)[:4] != b'\xed\xab\xee\xdb':
+            raise ValueError('%s is not an rpm' % filename)
+        signature = read_header(f)
+        # the signature header is padded to 8 bytes
+        f.seek(-f.tell() % 8, 1)
+        start = f.tell()
+        header = read_header(f)
+        end = f.tell()
+    return {
+        'signature': signature,
+        'header': header,
+        'header_start': start,
+        'header_end': end,
+    }
+
+
+def _first(tags, tag, default=None):
+    value = tags.get(tag, default)
+    if isinstance(value, list):
+        return value[0] if value else default
+    return value
+
+
+def _attr(value):
+    return escape(str(value), {'"': '&quot;'})
+
+
+def _version(h):
+    return '<version epoch="%s" ver="%s" rel="%s"/>' % (
+        _first(h, EPOCH, 0), _attr(h.get(VERSION, '')), _attr(h.get(RELEASE, ''))
+    )
+
+
+def _files(h):
+    '''[(path, type)] with type None, 'dir' or 'ghost' '''
+    if BASENAMES in h:
+        dirnames = h.get(DIRNAMES, [])
+        paths = [dirnames[d] + b for (d, b) in zip(h.get(DIRINDEXES, []), h[BASENAMES])]
+    else:
+        paths = h.get(OLDFILENAMES, [])
+    modes = h.get(FILEMODES, [0] * len(paths))
+    flags = h.get(FILEFLAGS, [0] * len(paths))
+    files = []
+    for (path, mode, flag) in zip(paths, modes, flags):
+        ftype = None
+        if flag & RPMFILE_GHOST:
+            ftype = 'ghost'
+        elif stat.S_ISDIR(mode):
+            ftype = 'dir'
+        files.append((path, ftype))
+    return files
+
+
+def _file_xml(path, ftype):
+    if ftype:
+        return '<file type="%s">%s</file>' % (ftype, escape(path))
+    return '<file>%s</file>' % escape(path)
+
+
+def _in_primary(path):
+    # the files dependency solvers need without fetching filelists
+    return path.startswith('/etc/') or 'bin/' in path or path == '/usr/lib/sendmail'
+
+
+def _dependencies(h, name, nametag, flagtag, versiontag):
+    names = h.get(nametag, [])
+    if not names:
+        return ''
+    flags = h.get(flagtag, [0] * len(names))
+    versions = h.get(versiontag, [''] * len(names))
+    entries = []
+    for (dep, flag, version) in zip(names, flags, versions):
+        if dep.startswith('rpmlib('):
+            continue
+        entry = '<rpm:entry name="%s"' % _attr(dep)
+        if SENSE_FLAGS.get(flag & 0xe) and version:
+            (epoch, ver, rel) = ('0', version, None)
+            if ':' in ver:
+                (epoch, ver) = ver.split(':', 1)
+            if '-' in ver:
+                (ver, rel) = ver.rsplit('-', 1)
+            entry += ' flags="%s" epoch="%s" ver="%s"' % (SENSE_FLAGS[flag & 0xe], _attr(epoch), _attr(ver))
+            if rel is not None:
+                entry += ' rel="%s"' % _attr(rel)
+        if name == 'requires' and flag & SENSE_PRE:
+            entry += ' pre="1"'
+        entries.append(entry + '/>')
+    if not entries:
+        return ''
+    return '<rpm:%s>\n%s\n</rpm:%s>\n' % (name, '\n'.join(entries), name)
+
+
+def package_metadata(filename, href):
+    '''The primary, filelists and other xml of one rpm'''
+    rpm = read_rpm(filename)
+    h = rpm['header']
+    st = os.stat(filename)
+    pkgid = sha256_file(filename)
+    name = _attr(h.get(NAME, ''))
+    arch = _attr(h.get(ARCH, 'noarch'))
+    files = _files(h)
+
+    archive = _first(rpm['signature'], SIG_PAYLOADSIZE) or _first(h, ARCHIVESIZE, 0)
+    primary = (
+        '<package type="rpm">\n'
+        '  <name>%s</name>\n'
+        '  <arch>%s</arch>\n'
+        '  %s\n'
+        '  <checksum type="sha256" pkgid="YES">%s</checksum>\n'
+        '  <summary>%s</summary>\n'
+        '  <description>%s</description>\n'
+        '  <packager>%s</packager>\n'
+        '  <url>%s</url>\n'
+        '  <time file="%s" build="%s"/>\n'
+        '  <size package="%s" installed="%s" archive="%s"/>\n'
+        '  <location href="%s"/>\n'
+        '  <format>\n'
+        '    <rpm:license>%s</rpm:license>\n'
+        '    <rpm:vendor>%s</rpm:vendor>\n'
+        '    <rpm:group>%s</rpm:group>\n'
+        '    <rpm:buildhost>%s</rpm:buildhost>\n'
+        '    <rpm:sourcerpm>%s</rpm:sourcerpm>\n'
+        '    <rpm:header-range start="%s" end="%s"/>\n'
+        '%s'
+        '%s'
+        '  </format>\n'
+        '</package>\n'
+    ) % (
+        name,
+        arch,
+        _version(h),
+        pkgid,
+        escape(h.get(SUMMARY, '')),
+        escape(h.get(DESCRIPTION, '')),
+        escape(h.get(PACKAGER, '')),
+        escape(h.get(URL, '')),
+        int(st.st_mtime),
+        _first(h, BUILDTIME, 0),
+        st.st_size,
+        _first(h, SIZE, 0),
+        archive,
+        _attr(href),
+        escape(h.get(LICENSE, '')),
+        escape(h.get(VENDOR, '')),
+        escape(h.get(GROUP, '')),
+        escape(h.get(BUILDHOST, '')),
+        escape(h.get(SOURCERPM, '')),
+        rpm['header_start'],
+        rpm['header_end'],
+        ''.join([_dependencies(h, *x) for x in DEPENDENCIES]),
+        ''.join(['    %s\n' % _file_xml(*x) for x in files if _in_primary(x[0])]),
+    )
+
+    filelists = '<package pkgid="%s" name="%s" arch="%s">\n  %s\n%s</package>\n' % (
+        pkgid, name, arch, _version(h),
+        ''.join(['  %s\n' % _file_xml(*x) for x in files])
+    )
+
+    changelogs = []
+    for (ctime, author, text) in zip(h.get(CHANGELOGTIME, []), h.get(CHANGELOGNAME, []), h.get(CHANGELOGTEXT, [])):
+        changelogs.append('  <changelog author="%s" date="%s">%s</changelog>\n' % (
+            _attr(author), ctime, escape(text)
+        ))
+    other = '<package pkgid="%s" name="%s" arch="%s">\n  %s\n%s</package>\n' % (
+        pkgid, name, arch, _version(h), ''.join(changelogs)
+    )
+
+    return {
+        'size': st.st_size,
+        'mtime': st.st_mtime_ns,
+        'pkgid': pkgid,
+        'primary': primary,
+        'filelists': filelists,
+        'other': other,
+    }
+
+
+def _find_rpms(repodir):
+    rpms = []
+    for (dirpath, dirnames, filenames) in os.walk(repodir):
+        # builds in progress write hidden .<name>.rpm files
+        dirnames[:] = sorted([x for x in dirnames if x != 'repodata' and not x.startswith('.')])
+        for fn in sorted(filenames):
+            if fn.endswith('.rpm') and not fn.startswith('.'):
+                rpms.append(os.path.relpath(os.path.join(dirpath, fn), repodir))
+    return rpms
+
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.loads(f.read())
+    except (IOError, OSError, ValueError):
+        return {}
+    if cache.get('version') != CACHE_VERSION:
+        return {}
+    return cache.get('packages', {})
+
+
+def _repomd_files(repomd):
+    '''{type: (href, open checksum)} listed in a repomd.xml'''
+    try:
+        root = ElementTree.parse(repomd).getroot()
+    except (IOError, OSError, ElementTree.ParseError):
+        return {}
+    files = {}
+    for data in root.findall('{%s}data' % REPO_NS):
+        location = data.find('{%s}location' % REPO_NS)
+        checksum = data.find('{%s}open-checksum' % REPO_NS)
+        if location is not None:
+            files[data.get('type')] = (
+                location.get('href'),
+                checksum.text if checksum is not None else None
+            )
+    return files
+
+
+def update_repodata(repodir, cache_file, force=False):
+    '''Bring repodir/repodata up to date with the rpms in repodir'''
+    t0 = time.time()
+    cache = {} if force else _read_cache(cache_file)
+    packages = {}
+    counts = {'packages': 0, 'read': 0, 'cached': 0, 'removed': 0}
+    for relpath in _find_rpms(repodir):
+        filename = os.path.join(repodir, relpath)
+        st = os.stat(filename)
+        old = cache.get(relpath)
+        if old and old['size'] == st.st_size and old['mtime'] == st.st_mtime_ns:
+            packages[relpath] = old
+            counts['cached'] += 1
+            continue
+        try:
+            packages[relpath] = package_metadata(filename, relpath)
+            counts['read'] += 1
+        except (IOError, OSError, ValueError) as e:
+            logger.error('leaving %s out of the repo: %s' % (relpath, e))
+    counts['packages'] = len(packages)
+    counts['removed'] = len([x for x in cache if x not in packages])
+
+    order = sorted(packages)
+    documents = {
+        'primary': '<metadata xmlns="%s" xmlns:rpm="%s" packages="%s">\n%s</metadata>\n' % (
+            COMMON_NS, RPM_NS, len(order), ''.join([packages[x]['primary'] for x in order])
+        ),
+        'filelists': '<filelists xmlns="%s" packages="%s">\n%s</filelists>\n' % (
+            FILELISTS_NS, len(order), ''.join([packages[x]['filelists'] for x in order])
+        ),
+        'other': '<otherdata xmlns="%s" packages="%s">\n%s</otherdata>\n' % (
+            OTHER_NS, len(order), ''.join([packages[x]['other'] for x in order])
+        ),
+    }
+
+    repodata_dir = os.path.join(repodir, 'repodata')
+    repomd = os.path.join(repodata_dir, 'repomd.xml')
+    if not os.path.exists(repodata_dir):
+        os.makedirs(repodata_dir)
+    current = _repomd_files(repomd)
+
+    out = OutputWriter()
+    entries = []
+    now = int(time.time())
+    changed = False
+    for mdtype in ['primary', 'filelists', 'other']:
+        data = ('<?xml version="1.0" encoding="UTF-8"?>\n' + documents[mdtype]).encode('utf-8')
+        open_checksum = hashlib.sha256(data).hexdigest()
+        if mdtype in current and current[mdtype][1] == open_checksum and \
+                os.path.exists(os.path.join(repodir, current[mdtype][0])):
+            # keep the file (and its timestamp) clients already have
+            href = current[mdtype][0]
+            with open(os.path.join(repodir, href), 'rb') as f:
+                gzdata = f.read()
+        else:
+            changed = True
+            gzdata = gzip.compress(data, 9, mtime=0)
+            href = 'repodata/%s-%s.xml.gz' % (hashlib.sha256(gzdata).hexdigest(), mdtype)
+            out.write(os.path.join(repodir, href), gzdata)
+        entries.append(
+            '<data type="%s">\n'
+            '  <checksum type="sha256">%s</checksum>\n'
+            '  <open-checksum type="sha256">%s</open-checksum>\n'
+            '  <location href="%s"/>\n'
+            '  <timestamp>%s</timestamp>\n'
+            '  <size>%s</size>\n'
+            '  <open-size>%s</open-size>\n'
+            '</data>\n' % (
+                mdtype,
+                hashlib.sha256(gzdata).hexdigest(),
+                open_checksum,
+                href,
+                int(os.stat(os.path.join(repodir, href)).st_mtime),
+                len(gzdata),
+                len(data),
+            )
+        )
+
+    if changed or len(current) != len(entries):
+        out.write(repomd, (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<repomd xmlns="%s" xmlns:rpm="%s">\n'
+            '<revision>%s</revision>\n'
+            '%s'
+            '</repomd>\n'
+        ) % (REPO_NS, RPM_NS, now, ''.join(entries)))
+
+        # everything but this generation and the one before goes
+        keep = set(['repodata/repomd.xml'])
+        keep.update([x[0] for x in current.values()])
+        keep.update([x[0] for x in _repomd_files(repomd).values()])
+        for fn in os.listdir(repodata_dir):
+            path = os.path.join(repodata_dir, fn)
+            if 'repodata/' + fn not in keep and os.path.isfile(path):
+                os.remove(path)
+
+    # the cache is written last, a failed run just reads the rpms again
+    out.write(cache_file, json.dumps({'version': CACHE_VERSION, 'packages': packages}, sort_keys=True))
+
+    counts['changed'] = changed
+    counts['duration'] = time.time() - t0
+    logger.info('repodata for %s rpms (%s read, %s cached, %s removed) %s in %.2fs' % (
+        counts['packages'],
+        counts['read'],
+        counts['cached'],
+        counts['removed'],
+        'updated' if changed else 'unchanged',
+        counts['duration'],
+    ))
+    return counts
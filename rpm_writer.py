@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+
+# Build simple noarch directory rpms in-process instead of running fpm.
+#
+#   rpm = RpmWriter('ansible-collection-cloud_vmware', '2.10.0',
+#                   prefix='/usr/share/ansible/collections/...')
+#   rpm.add_tree(cdir, 'plugins')     # like fpm -s dir -C cdir plugins
+#   rpm.write('ansible-collection-cloud_vmware-2.10.0.rpm')
+#
+# The file is the usual rpm v3 layout: a 96 byte lead, the signature
+# header (sizes and digests), the main header and a compressed cpio
+# ("newc") payload. Both headers carry an immutable region, files are
+# listed sorted with sha256 digests, and the rpmlib() requires say which
+# payload features are used, so any rpm >= 4.6 can read and install it.
+# Like fpm without --directories, only files and symlinks are packaged,
+# directories are not owned.
+#
+# The payload is gzip'd by default. compression= picks bzip2, xz, zstd
+# (when the zstandard module is installed) or none instead, and level=
+# overrides the default level of each.
+#
+# The same files give the same rpm: the build time defaults to the newest
+# file's mtime (or SOURCE_DATE_EPOCH), the build host is fixed and the
+# compressed payload carries no timestamp.
+
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+import stat
+import struct
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# header data types
+INT16 = 3
+INT32 = 4
+STRING = 6
+BIN = 7
+STRING_ARRAY = 8
+I18NSTRING = 9
+
+TYPE_ALIGN = {INT16: 2, INT32: 4}
+
+HEADER_MAGIC = b'\x8e\xad\xe8\x01\x00\x00\x00\x00'
+LEAD_MAGIC = b'\xed\xab\xee\xdb'
+
+# region tags
+HEADERSIGNATURES = 62
+HEADERIMMUTABLE = 63
+
+# signature tags
+SIG_SHA1 = 269
+SIG_SHA256 = 273
+SIG_SIZE = 1000
+SIG_MD5 = 1004
+SIG_PAYLOADSIZE = 1007
+
+HEADERI18NTABLE = 100
+NAME = 1000
+VERSION = 1001
+RELEASE = 1002
+SUMMARY = 1004
+DESCRIPTION = 1005
+BUILDTIME = 1006
+BUILDHOST = 1007
+SIZE = 1009
+LICENSE = 1014
+GROUP = 1016
+URL = 1020
+OS = 1021
+ARCH = 1022
+FILESIZES = 1028
+FILEMODES = 1030
+FILERDEVS = 1033
+FILEMTIMES = 1034
+FILEDIGESTS = 1035
+FILELINKTOS = 1036
+FILEFLAGS = 1037
+FILEUSERNAME = 1039
+FILEGROUPNAME = 1040
+SOURCERPM = 1044
+FILEVERIFYFLAGS = 1045
+PROVIDENAME = 1047
+REQUIREFLAGS = 1048
+REQUIRENAME = 1049
+REQUIREVERSION = 1050
+FILEDEVICES = 1095
+FILEINODES = 1096
+FILELANGS = 1097
+PREFIXES = 1098
+PROVIDEFLAGS = 1112
+PROVIDEVERSION = 1113
+DIRINDEXES = 1116
+BASENAMES = 1117
+DIRNAMES = 1118
+PAYLOADFORMAT = 1124
+PAYLOADCOMPRESSOR = 1125
+PAYLOADFLAGS = 1126
+PLATFORM = 1132
+FILEDIGESTALGO = 5011
+ENCODING = 5062
+PAYLOADDIGEST = 5092
+PAYLOADDIGESTALGO = 5093
+
+SENSE_EQUAL = 0x08
+SENSE_RPMLIB = 0x01000000 | 0x08 | 0x02
+PGPHASHALGO_SHA256 = 8
+
+# name: (default level, rpmlib() feature it needs or None)
+COMPRESSIONS = {
+    'gzip': (9, None),
+    'bzip2': (9, ('rpmlib(PayloadIsBzip2)', '3.0.5-1')),
+    'xz': (2, ('rpmlib(PayloadIsXz)', '5.2-1')),
+    'zstd': (19, ('rpmlib(PayloadIsZstd)', '5.4.18-1')),
+    # not every rpm reads an uncompressed payload, but all of them read
+    # gzip, and level 0 gzip is the data in stored blocks
+    'none': (0, None),
+}
+DEFAULT_COMPRESSION = 'gzip'
+
+
+def compressions():
+    '''The payload compressions usable here'''
+    names = sorted(COMPRESSIONS)
+    if zstandard is None:
+        names.remove('zstd')
+    return names
+
+
+def compress(data, compression, level=None):
+    if compression not in compressions():
+        raise ValueError('unsupported payload compression %s' % compression)
+    if level is None:
+        level = COMPRESSIONS[compression][0]
+    if compression in ('gzip', 'none'):
+        return gzip.compress(data, level, mtime=0)
+    if compression == 'bzip2':
+        return bz2.compress(data, level)
+    if compression == 'xz':
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def decompress(data, compression):
+    if compression in ('gzip', 'none'):
+        return gzip.decompress(data)
+    if compression == 'bzip2':
+        return bz2.decompress(data)
+    if compression == 'xz':
+        return lzma.decompress(data)
+    if compression == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError('unsupported payload compression %s' % compression)
+
+
+def _encode(tagtype, value):
+    '''(data, count) for a header entry'''
+    if tagtype == INT16:
+        return (struct.pack('>%dH' % len(value), *value), len(value))
+    if tagtype == INT32:
+        return (struct.pack('>%dI' % len(value), *[x & 0xffffffff for x in value]), len(value))
+    if tagtype in (STRING, I18NSTRING):
+        return (_b(value) + b'\0', 1)
+    if tagtype == STRING_ARRAY:
+        return (b''.join([_b(x) + b'\0' for x in value]), len(value))
+    return (value, len(value))
+
+
+def _b(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8', 'surrogateescape')
+
+
+def build_header(tags, region):
+    '''Serialize {tag: (type, value)} as a header with an immutable region'''
+    index = []
+    data = b''
+    for tag in sorted(tags):
+        (tagtype, value) = tags[tag]
+        (blob, count) = _encode(tagtype, value)
+        pad = -len(data) % TYPE_ALIGN.get(tagtype, 1)
+        data += b'\0' * pad
+        index.append((tag, tagtype, len(data), count))
+        data += blob
+
+    # the region entry points at a trailer whose negative offset covers
+    # every index entry, itself included
+    nindex = len(index) + 1
+    index.insert(0, (region, BIN, len(data), 16))
+    data += struct.pack('>iiii', region, BIN, -nindex * 16, 16)
+
+    return HEADER_MAGIC + struct.pack('>II', nindex, len(data)) + \
+        b''.join([struct.pack('>IIiI', *x) for x in index]) + data
+
+
+def _cpio_entry(name, mode, size, mtime, ino):
+    name = _b(name) + b'\0'
+    hdr = b'070701' + b''.join([b'%08x' % x for x in (
+        ino, mode, 0, 0, 1, mtime, size, 0, 0, 0, 0, len(name), 0
+    )]) + name
+    return hdr + b'\0' * (-len(hdr) % 4)
+
+
+class RpmWriter(object):
+
+    def __init__(self, name, version, release='1', prefix=None,
+                 summary=None, description=None, license='unknown',
+                 url='http://example.com/no-uri-given', group='default',
+                 compression=DEFAULT_COMPRESSION, level=None, buildtime=None,
+                 buildhost='localhost'):
+        self.name = name
+        self.version = version
+        self.release = release
+        self.prefix = prefix
+        self.summary = summary or 'no description given'
+        self.description = description or self.summary
+        self.license = license
+        self.url = url
+        self.group = group
+        if compression not in compressions():
+            raise ValueError('unsupported payload compression %s' % compression)
+        self.compression = compression
+        if level is None:
+            level = COMPRESSIONS[compression][0]
+        self.level = level
+        if buildtime is None and 'SOURCE_DATE_EPOCH' in os.environ:
+            buildtime = int(os.environ['SOURCE_DATE_EPOCH'])
+        # None means the newest file's mtime
+        self.buildtime = buildtime
+        self.buildhost = buildhost
+        # install path -> source path
+        self.files = {}
+
+    def payload_compressor(self):
+        '''What the payload is compressed with, as rpm names it'''
+        if self.compression == 'none':
+            return 'gzip'
+        return self.compression
+
+    def add_file(self, src, path):
+        '''Package src as path, below the prefix if there is one'''
+        if self.prefix:
+            path = os.path.join(self.prefix, path.lstrip('/'))
+        self.files[os.path.normpath('/' + path.lstrip('/'))] = src
+
+    def add_tree(self, basedir, *paths):
+        '''Add the files in paths (relative to basedir) under their relative names'''
+        for path in paths:
+            top = os.path.join(basedir, path)
+            if not os.path.isdir(top) or os.path.islink(top):
+                self.add_file(top, path)
+                continue
+            for (dirpath, dirnames, filenames) in os.walk(top):
+                # symlinked dirs are packaged as links, not descended into
+                for dn in dirnames:
+                    if os.path.islink(os.path.join(dirpath, dn)):
+                        filenames.append(dn)
+                for fn in filenames:
+                    fsrc = os.path.join(dirpath, fn)
+                    self.add_file(fsrc, os.path.relpath(fsrc, basedir))
+
+    def _payload(self, paths):
+        '''(cpio archive, per file metadata) for the sorted install paths'''
+        cpio = []
+        files = []
+        for (ino, path) in enumerate(paths, 1):
+            src = self.files[path]
+            st = os.lstat(src)
+            mtime = int(st.st_mtime)
+            if stat.S_ISLNK(st.st_mode):
+                data = _b(os.readlink(src))
+                linkto = data
+                digest = ''
+            elif stat.S_ISREG(st.st_mode):
+                with open(src, 'rb') as f:
+                    data = f.read()
+                linkto = ''
+                digest = hashlib.sha256(data).hexdigest()
+            else:
+                raise ValueError('can not package %s, not a file or symlink' % src)
+            cpio.append(_cpio_entry('.' + path, st.st_mode, len(data), mtime, ino))
+            cpio.append(data + b'\0' * (-len(data) % 4))
+            files.append({
+                'path': path,
+                'mode': st.st_mode,
+                'size': len(data),
+                'mtime': mtime,
+                'digest': digest,
+                'linkto': linkto,
+                'ino': ino,
+            })
+        cpio.append(_cpio_entry('TRAILER!!!', 0, 0, 0, 0))
+        return (b''.join(cpio), files)
+
+    def _tags(self, files, payload, payload_digest):
+        nvr = '%s-%s-%s' % (self.name, self.version, self.release)
+        buildtime = self.buildtime
+        if buildtime is None:
+            buildtime = max([x['mtime'] for x in files] or [0])
+        tags = {
+            HEADERI18NTABLE: (STRING_ARRAY, ['C']),
+            NAME: (STRING, self.name),
+            VERSION: (STRING, self.version),
+            RELEASE: (STRING, self.release),
+            SUMMARY: (I18NSTRING, self.summary),
+            DESCRIPTION: (I18NSTRING, self.description),
+            BUILDTIME: (INT32, [buildtime]),
+            BUILDHOST: (STRING, self.buildhost),
+            SIZE: (INT32, [sum([x['size'] for x in files])]),
+            LICENSE: (STRING, self.license),
+            GROUP: (I18NSTRING, self.group),
+            URL: (STRING, self.url),
+            OS: (STRING, 'linux'),
+            ARCH: (STRING, 'noarch'),
+            PLATFORM: (STRING, 'noarch-unknown-linux'),
+            # an rpm without a source rpm is taken to be a source rpm
+            SOURCERPM: (STRING, '%s.src.rpm' % nvr),
+            ENCODING: (STRING, 'utf-8'),
+            PAYLOADFORMAT: (STRING, 'cpio'),
+            PAYLOADCOMPRESSOR: (STRING, self.payload_compressor()),
+            PAYLOADFLAGS: (STRING, str(self.level)),
+            PAYLOADDIGEST: (STRING_ARRAY, [payload_digest]),
+            PAYLOADDIGESTALGO: (INT32, [PGPHASHALGO_SHA256]),
+            PROVIDENAME: (STRING_ARRAY, [self.name]),
+            PROVIDEFLAGS: (INT32, [SENSE_EQUAL]),
+            PROVIDEVERSION: (STRING_ARRAY, ['%s-%s' % (self.version, self.release)]),
+        }
+
+        requires = [
+            ('rpmlib(CompressedFileNames)', '3.0.4-1'),
+            ('rpmlib(PayloadFilesHavePrefix)', '4.0-1'),
+        ]
+        if COMPRESSIONS[self.compression][1]:
+            requires.append(COMPRESSIONS[self.compression][1])
+        if files:
+            requires.append(('rpmlib(FileDigests)', '4.6.0-1'))
+        requires.sort()
+        tags[REQUIRENAME] = (STRING_ARRAY, [x[0] for x in requires])
+        tags[REQUIREFLAGS] = (INT32, [SENSE_RPMLIB] * len(requires))
+        tags[REQUIREVERSION] = (STRING_ARRAY, [x[1] for x in requires])
+
+        if self.prefix:
+            tags[PREFIXES] = (STRING_ARRAY, [os.path.normpath(self.prefix)])
+
+        if not files:
+            return tags
+
+        dirnames = {}
+        dirindexes = []
+        for f in files:
+            dirname = os.path.dirname(f['path']).rstrip('/') + '/'
+            dirindexes.append(dirnames.setdefault(dirname, len(dirnames)))
+        dirnames = sorted(dirnames, key=dirnames.get)
+
+        count = len(files)
+        tags.update({
+            FILESIZES: (INT32, [x['size'] for x in files]),
+            FILEMODES: (INT16, [x['mode'] & 0xffff for x in files]),
+            FILERDEVS: (INT16, [0] * count),
+            FILEMTIMES: (INT32, [x['mtime'] for x in files]),
+            FILEDIGESTS: (STRING_ARRAY, [x['digest'] for x in files]),
+            FILELINKTOS: (STRING_ARRAY, [x['linkto'] for x in files]),
+            FILEFLAGS: (INT32, [0] * count),
+            FILEUSERNAME: (STRING_ARRAY, ['root'] * count),
+            FILEGROUPNAME: (STRING_ARRAY, ['root'] * count),
+            FILEVERIFYFLAGS: (INT32, [-1] * count),
+            FILEDEVICES: (INT32, [1] * count),
+            FILEINODES: (INT32, [x['ino'] for x in files]),
+            FILELANGS: (STRING_ARRAY, [''] * count),
+            FILEDIGESTALGO: (INT32, [PGPHASHALGO_SHA256]),
+            DIRINDEXES: (INT32, dirindexes),
+            BASENAMES: (STRING_ARRAY, [os.path.basename(x['path']) for x in files]),
+            DIRNAMES: (STRING_ARRAY, dirnames),
+        })
+        return tags
+
+    def build(self):
+        '''The rpm file's bytes'''
+        # rpm looks files up by binary search, so the list must be sorted
+        paths = sorted(self.files, key=_b)
+        (cpio, files) = self._payload(paths)
+        payload = compress(cpio, self.compression, self.level)
+        header = build_header(
+            self._tags(files, payload, hashlib.sha256(payload).hexdigest()),
+            HEADERIMMUTABLE
+        )
+
+        md5 = hashlib.md5(header)
+        md5.update(payload)
+        signature = build_header({
+            SIG_SHA1: (STRING, hashlib.sha1(header).hexdigest()),
+            SIG_SHA256: (STRING, hashlib.sha256(header).hexdigest()),
+            SIG_SIZE: (INT32, [len(header) + len(payload)]),
+            SIG_MD5: (BIN, md5.digest()),
+            SIG_PAYLOADSIZE: (INT32, [len(cpio)]),
+        }, HEADERSIGNATURES)
+        signature += b'\0' * (-len(signature) % 8)
+
+        nvr = _b('%s-%s-%s' % (self.name, self.version, self.release))[:65]
+        # binary package, noarch, linux, header style signature
+        lead = LEAD_MAGIC + struct.pack('>BBhh66shh16s', 3, 0, 0, 255, nvr, 1, 5, b'')
+
+        return lead + signature + header + payload
+
+    def write(self, filename):
+        '''Build the rpm into filename, returns the number of files packaged'''
+        data = self.build()
+        with open(filename, 'wb') as f:
+            f.write(data)
+        return len(self.files)
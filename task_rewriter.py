@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+# Point the module calls in integration target tasks at the collection.
+#
+#   - ios_command:                  - jctanner.network_ios.ios_command:
+#       commands: show version  ->      commands: show version
+#
+# The collection's module names are compiled once into a single regex,
+# factored like a trie (ios_(?:command|config)...), that only matches a
+# whole name in key position at the start of a line. So xios_command:,
+# values and task names are left alone, and one pass per file does every
+# module at once.
+#
+# Roles pulled in with include_role/import_role are never renamed. Their
+# names are collected so assembly can check the role target came along
+# with the collection.
+
+import os
+import re
+
+
+MODULE_EXTENSIONS = ['.py', '.ps1', '.ps2']
+
+ROLE_KEY_RE = re.compile(r'^([ \t]*)(?:-[ \t]+)?(?:include|import)_role[ \t]*:[ \t]*(.*)$')
+ROLE_NAME_RE = re.compile(r'^[ \t]*name[ \t]*:[ \t]*[\'"]?([^\'"#\s]+)')
+ROLE_INLINE_RE = re.compile(r'\bname=[\'"]?([^\'"\s]+)')
+
+
+def module_short_name(path):
+    name = os.path.basename(path)
+    (base, ext) = os.path.splitext(name)
+    if ext in MODULE_EXTENSIONS:
+        return base
+    return name
+
+
+def _trie_pattern(words):
+    # one alternation per trie node instead of one per word
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def _pattern(node):
+        if list(node.keys()) == ['']:
+            return ''
+        end = '' in node
+        alts = []
+        for char in sorted([x for x in node if x]):
+            alts.append(re.escape(char) + _pattern(node[char]))
+        if len(alts) == 1 and not end:
+            return alts[0]
+        pattern = '(?:' + '|'.join(alts) + ')'
+        if end:
+            pattern += '?'
+        return pattern
+
+    return _pattern(trie)
+
+
+class ModuleRefRewriter(object):
+
+    def __init__(self, modules, namespace, name):
+        self.fqcn = {}
+        for module in modules:
+            short = module_short_name(module)
+            if short and short != '__init__':
+                self.fqcn[short] = '%s.%s.%s' % (namespace, name, short)
+        self.key_re = None
+        if self.fqcn:
+            self.key_re = re.compile(
+                r'^([ \t]*(?:-[ \t]+)?)(' + _trie_pattern(sorted(self.fqcn)) + r')(?=[ \t]*:(?:[ \t]|$))',
+                re.MULTILINE
+            )
+
+    def _replace(self, match):
+        return match.group(1) + self.fqcn[match.group(2)]
+
+    def rewrite(self, text):
+        '''Return (text, references rewritten)'''
+        if self.key_re is None:
+            return (text, 0)
+        return self.key_re.subn(self._replace, text)
+
+    def role_refs(self, text):
+        '''Names of the roles text includes or imports'''
+        if '_role' not in text:
+            return []
+        roles = []
+        lines = text.split('\n')
+        for (idx, line) in enumerate(lines):
+            match = ROLE_KEY_RE.match(line)
+            if not match:
+                continue
+            inline = ROLE_INLINE_RE.search(match.group(2))
+            if inline:
+                roles.append(inline.group(1))
+                continue
+            # the name: key of the block below, indented deeper
+            indent = len(match.group(1))
+            for nextline in lines[idx + 1:]:
+                if not nextline.strip():
+                    continue
+                if len(nextline) - len(nextline.lstrip()) <= indent:
+                    break
+                name = ROLE_NAME_RE.match(nextline)
+                if name:
+                    roles.append(name.group(1))
+                    break
+        # templated names can not be checked
+        return [x for x in roles if '{' not in x]
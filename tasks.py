@@ -10,6 +10,13 @@ import time
 from bs4 import BeautifulSoup
 from celery import Celery
 
+from downloader import download_files
+from downloader import fetch_listing
+from downloader import make_session
+from import_scanner import scan_module_utils_imports
+from release_manifest import ReleaseManifest
+from release_source import extract_releases
+
 #CELERY_BROKER_URL: pyamqp://rabbit:5672
 #CELERY_RESULT_BACKEND: mongodb://mongo:27017
 #CELERY_MONGODB_BACKEND_DATABASE: gravity
@@ -88,10 +95,21 @@ def run_command(cmd=None):
 
 
 @celery.task(name='tasks.get_releases')
-def get_releases():
+def get_releases(download_jobs=4):
+    cachedir = os.path.join(VARDIR, 'releases')
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir)
+
+    manifest = ReleaseManifest(os.path.join(cachedir, 'manifest.json'))
+    session = make_session(pool_size=download_jobs)
     baseurl = 'https://releases.ansible.com/ansible/'
-    rr = requests.get(baseurl)
-    soup = BeautifulSoup(rr.text, u'html.parser')
+    listing = fetch_listing(
+        session,
+        baseurl,
+        os.path.join(cachedir, 'index.html'),
+        manifest=manifest
+    )
+    soup = BeautifulSoup(listing, u'html.parser')
     links = soup.findAll('a')
     hrefs = [x.attrs['href'] for x in links]
     tarballs = [x for x in hrefs if x.endswith('tar.gz')]
@@ -104,32 +122,25 @@ def get_releases():
     tarballs = [x for x in tarballs if 'rc' not in x]
     tarballs = sorted(tarballs)
 
-    cachedir = os.path.join(VARDIR, 'releases')
-    if not os.path.exists(cachedir):
-        os.makedirs(cachedir)
-
+    # fetch the tarballs, the manifest decides what needs the network
+    downloads = []
     for tb in tarballs:
-        # fetch the tarball
         url = baseurl + '/' + tb
         dst = os.path.join(cachedir, tb)
-        if not os.path.exists(dst):
-            logging.info('fetching %s' % url)
-            rr = requests.get(url, allow_redirects=True)
-            open(dst, 'wb').write(rr.content)
-
-        # extract the tarball
-        edir = tb.replace('.tar.gz', '')
-        epath = os.path.join(cachedir, edir)
-        if not os.path.exists(epath):
-            logging.info('extracing %s' % tb)
-            cmd = 'cd %s; tar xzvf %s' % (cachedir, tb)
-            p = subprocess.Popen(
-                cmd,
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            )
-            (so, se) = p.communicate()
+        downloads.append((url, dst))
+    download_files(downloads, jobs=download_jobs, session=session, manifest=manifest)
+    manifest.save()
+
+    # extract the tarballs, unchanged ones are skipped by their marker. One
+    # at a time, a prefork worker is daemonic and can not start a process
+    # pool. The downloads above use threads, which are fine.
+    paths = [dst for (url, dst) in downloads if os.path.exists(dst)]
+    digests = {}
+    for (url, dst) in downloads:
+        entry = manifest.get(url)
+        if entry:
+            digests[dst] = entry.get('sha256')
+    extract_releases(paths, cachedir, digests=digests, jobs=1)
 
     return {}
 
@@ -196,23 +207,8 @@ def build_collections():
             #from ansible.module_utils.basic import AnsibleModule
             #from ansible.module_utils._text import to_text, to_native
             #from ansible.module_utils.vmware import ...
-            cmd = 'fgrep "from ansible.module_utils" %s' % mfn
-            #logging.info(cmd)
-            (rc, so, se) = _run_command(cmd)
-            if rc != 0:
-                logging.info('%s rc:%s' % (cmd, rc))
-                logging.info(se)
-            logging.info(so)
-            mutils = so.split('\n')
-            mutils = [x.strip() for x in mutils if x.strip()]
-            mutils = [x.split()[1] for x in mutils]
-
-            for idx,x in enumerate(mutils):
-                try:
-                    parts = x.split('.')
-                    mutils[idx] = '.'.join(parts[2:])
-                except:
-                    logging.info('can not split %s' % x)
+            mutils = scan_module_utils_imports(mfn)
+            logging.info(mutils)
 
             collections[dirn]['module_utils'] += mutils
             collections[dirn]['module_utils'] = \
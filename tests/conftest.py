@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the modules under test live at the top of the repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# fixture trees hold test_*.py files of their own
+collect_ignore = ['fixtures']
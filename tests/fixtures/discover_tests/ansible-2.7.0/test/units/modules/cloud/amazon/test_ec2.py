@@ -0,0 +1,2 @@
+def test_ec2():
+    pass
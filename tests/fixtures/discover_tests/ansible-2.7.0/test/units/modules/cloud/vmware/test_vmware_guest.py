@@ -0,0 +1,2 @@
+def test_guest(patch_ansible_module):
+    pass
@@ -0,0 +1,6 @@
+import pytest
+
+
+@pytest.fixture
+def patch_ansible_module(request):
+    pass
@@ -0,0 +1,6 @@
+import pytest
+
+
+@pytest.mark.parametrize("patch_ansible_module", [{}], indirect=True)
+def test_facts(patch_ansible_module):
+    pass
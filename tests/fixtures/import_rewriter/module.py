@@ -0,0 +1,46 @@
+#!/usr/bin/python
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = '''
+module: vmware_guest
+notes:
+  - from ansible.module_utils.vmware import connect_to_api
+'''
+
+import json
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils._text import to_native
+from ansible.module_utils.vmware import connect_to_api, find_obj
+from ansible.module_utils.vmware import (gather_vm_facts,
+                                         vmware_argument_spec)  # facts
+from ansible.module_utils.vmware import (
+    PyVmomi,
+    wait_for_task,
+)
+from ansible.module_utils.vmware import TaskError as VmwareTaskError, wait_for_vm_ip
+from ansible.module_utils.vmware_rest import VmwareRestClient
+from ansible.module_utils.network.ios.ios import get_config, \
+    load_config
+from ansible.module_utils.network.common.utils import to_list
+from ansible.module_utils import vmware
+from ansible.module_utils.network.ios import ios as ios_utils
+import ansible.module_utils.vmware as vmw
+import ansible.module_utils.network.common.utils
+
+try:
+    from ansible.module_utils.network.common.config import NetworkConfig, dumps
+    HAS_CONFIG = True
+except ImportError:
+    HAS_CONFIG = False
+
+
+def main():
+    # from ansible.module_utils.vmware import nothing
+    module = AnsibleModule(argument_spec=vmware_argument_spec())
+    print("from ansible.module_utils.vmware import nothing")
+
+
+if __name__ == '__main__':
+    main()
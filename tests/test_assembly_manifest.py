@@ -0,0 +1,106 @@
+import json
+import os
+
+import pytest
+
+import assembly_manifest
+from assembly_manifest import build_manifest
+from assembly_manifest import digest_sources
+from assembly_manifest import read_manifest
+
+
+def _write(path, data):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+@pytest.fixture
+def hashed(monkeypatch):
+    '''The files actually read to digest them'''
+    calls = []
+    sha256_file = assembly_manifest.sha256_file
+
+    def counting(path):
+        calls.append(os.path.basename(path))
+        return sha256_file(path)
+
+    monkeypatch.setattr(assembly_manifest, 'sha256_file', counting)
+    return calls
+
+
+@pytest.fixture
+def release(tmpdir):
+    basedir = str(tmpdir.join('ansible-2.7.0'))
+    paths = []
+    for fn in ['vmware_guest.py', 'vmware_host.py']:
+        path = os.path.join(basedir, 'lib', 'ansible', 'modules', 'cloud', 'vmware', fn)
+        _write(path, fn)
+        os.utime(path, (1546300800, 1546300800))
+        paths.append(path)
+    return (basedir, paths)
+
+
+def test_digests_are_reused(release, hashed):
+    (basedir, paths) = release
+    first = digest_sources(basedir, paths)
+    assert sorted(hashed) == ['vmware_guest.py', 'vmware_host.py']
+    assert first['lib/ansible/modules/cloud/vmware/vmware_guest.py']['size'] == len('vmware_guest.py')
+
+    # nothing changed, nothing read
+    assert digest_sources(basedir, paths, first) == first
+    assert len(hashed) == 2
+
+    # the same size but a new mtime is read again
+    _write(paths[0], 'VMWARE_GUEST.py')
+    second = digest_sources(basedir, paths, first)
+    assert hashed[2:] == ['vmware_guest.py']
+    relpath = 'lib/ansible/modules/cloud/vmware/vmware_guest.py'
+    assert second[relpath]['size'] == first[relpath]['size']
+    assert second[relpath]['sha256'] != first[relpath]['sha256']
+
+    # and so is a new size under the old mtime
+    _write(paths[1], 'vmware_host.py, longer')
+    os.utime(paths[1], (1546300800, 1546300800))
+    digest_sources(basedir, paths, second)
+    assert hashed[3:] == ['vmware_host.py']
+
+
+def test_missing_source(release, hashed):
+    (basedir, paths) = release
+    missing = os.path.join(basedir, 'lib', 'ansible', 'modules', 'gone.py')
+    sources = digest_sources(basedir, paths + [missing])
+    assert sources['lib/ansible/modules/gone.py'] is None
+
+
+def test_fingerprint(release):
+    (basedir, paths) = release
+    meta = {'name': 'cloud_vmware', 'plugins': {'modules': ['vmware_guest']}}
+    sources = digest_sources(basedir, paths)
+    manifest = build_manifest(meta, sources, namespace='jctanner', rewriter=1)
+
+    # stable across runs and key order, and survives a json round trip
+    again = build_manifest(dict(reversed(list(meta.items()))), dict(sources), rewriter=1, namespace='jctanner')
+    assert again['fingerprint'] == manifest['fingerprint']
+    assert json.loads(json.dumps(manifest)) == manifest
+
+    # but not a change to the meta entry, the params or any source
+    assert build_manifest({'name': 'cloud_vmware'}, sources, namespace='jctanner', rewriter=1)['fingerprint'] \
+        != manifest['fingerprint']
+    assert build_manifest(meta, sources, namespace='ansible', rewriter=1)['fingerprint'] \
+        != manifest['fingerprint']
+    _write(paths[0], 'VMWARE_GUEST.py')
+    changed = digest_sources(basedir, paths, sources)
+    assert build_manifest(meta, changed, namespace='jctanner', rewriter=1)['fingerprint'] \
+        != manifest['fingerprint']
+
+
+def test_read_manifest(tmpdir):
+    assert read_manifest(str(tmpdir.join('missing.json'))) == {}
+    broken = str(tmpdir.join('broken.json'))
+    _write(broken, '{"fingerprint": ')
+    assert read_manifest(broken) == {}
+    good = str(tmpdir.join('good.json'))
+    _write(good, json.dumps({'fingerprint': 'abc'}))
+    assert read_manifest(good) == {'fingerprint': 'abc'}
@@ -0,0 +1,112 @@
+import os
+import subprocess
+
+import pytest
+
+from build_ansible_rpm import stage_checkout
+
+
+def _write(rdir, path, data=''):
+    fn = os.path.join(rdir, path)
+    if not os.path.exists(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    with open(fn, 'w') as f:
+        f.write(data)
+
+
+def _tree(top):
+    '''{relpath: ('link', target) or ('file', content)} below top'''
+    tree = {}
+    for (dirpath, dirnames, filenames) in os.walk(top):
+        for fn in filenames + [x for x in dirnames if os.path.islink(os.path.join(dirpath, x))]:
+            path = os.path.join(dirpath, fn)
+            relpath = os.path.relpath(path, top)
+            if relpath.startswith('.git/'):
+                continue
+            if os.path.islink(path):
+                tree[relpath] = ('link', os.readlink(path))
+            else:
+                with open(path, 'r') as f:
+                    tree[relpath] = ('file', f.read())
+    return tree
+
+
+@pytest.fixture
+def checkout(tmpdir):
+    src = str(tmpdir.join('checkout'))
+    _write(src, 'Makefile', 'rpm:\n\tgit describe --always\n')
+    _write(src, 'lib/ansible/cli/galaxy.py', 'galaxy\n')
+    _write(src, 'lib/ansible/modules/__init__.py')
+    _write(src, 'lib/ansible/modules/cloud/vmware/vmware_guest.py', 'guest\n')
+    _write(src, 'lib/ansible/module_utils/basic.py', 'basic\n')
+    _write(src, 'lib/ansible/module_utils/vmware.py', 'vmware\n')
+    _write(src, 'lib/ansible/module_utils/six/__init__.py', 'six\n')
+    _write(src, 'lib/ansible/module_utils/sixty/__init__.py', 'sixty\n')
+    _write(src, 'lib/ansible/plugins/doc_fragments/__init__.py')
+    _write(src, 'lib/ansible/plugins/doc_fragments/vmware.py', 'fragment\n')
+    _write(src, 'hacking/tests/units.txt', 'units\n')
+    # a file symlink, a dir symlink, a dangling one, and one that is dropped
+    os.symlink('galaxy.py', os.path.join(src, 'lib/ansible/cli/mazer.py'))
+    os.symlink('hacking/tests', os.path.join(src, 'tests'))
+    os.symlink('nowhere', os.path.join(src, 'lib/ansible/cli/gone.py'))
+    os.symlink('basic.py', os.path.join(src, 'lib/ansible/module_utils/_basic.py'))
+    subprocess.check_output(['git', 'init', '-q'], cwd=src)
+    subprocess.check_output(['git', 'add', '-A'], cwd=src)
+    subprocess.check_output(
+        ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '-q', '-m', 'base'],
+        cwd=src
+    )
+    return src
+
+
+EXPECTED = {
+    'Makefile': ('file', 'rpm:\n\tgit describe --always\n'),
+    'lib/ansible/cli/galaxy.py': ('file', 'galaxy\n'),
+    'lib/ansible/cli/mazer.py': ('link', 'galaxy.py'),
+    'lib/ansible/cli/gone.py': ('link', 'nowhere'),
+    'lib/ansible/modules/__init__.py': ('file', ''),
+    'lib/ansible/module_utils/basic.py': ('file', 'basic\n'),
+    'lib/ansible/module_utils/six/__init__.py': ('file', 'six\n'),
+    'lib/ansible/plugins/doc_fragments/__init__.py': ('file', ''),
+    'hacking/tests/units.txt': ('file', 'units\n'),
+    'tests': ('link', 'hacking/tests'),
+}
+
+
+def test_stage_checkout(checkout, tmpdir):
+    dst = str(tmpdir.join('build'))
+    stage_checkout(checkout, dst, materialize='copy')
+    assert _tree(dst) == EXPECTED
+
+    # nothing is shared with the source checkout
+    for relpath in EXPECTED:
+        if EXPECTED[relpath][0] == 'file':
+            assert not os.path.samefile(os.path.join(checkout, relpath), os.path.join(dst, relpath))
+
+    # git works in the staged checkout, so make can ask it
+    head = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=checkout)
+    assert subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=dst) == head
+
+
+def test_restage(checkout, tmpdir):
+    dst = str(tmpdir.join('build'))
+    stage_checkout(checkout, dst, materialize='copy')
+
+    # a link becomes a file, a file a link, and a dir link goes away
+    os.remove(os.path.join(checkout, 'lib/ansible/cli/mazer.py'))
+    _write(checkout, 'lib/ansible/cli/mazer.py', 'mazer\n')
+    os.remove(os.path.join(checkout, 'lib/ansible/cli/galaxy.py'))
+    os.symlink('mazer.py', os.path.join(checkout, 'lib/ansible/cli/galaxy.py'))
+    os.remove(os.path.join(checkout, 'tests'))
+
+    stage_checkout(checkout, dst, materialize='copy')
+    expected = dict(EXPECTED)
+    expected['lib/ansible/cli/mazer.py'] = ('file', 'mazer\n')
+    expected['lib/ansible/cli/galaxy.py'] = ('link', 'mazer.py')
+    expected.pop('tests')
+    assert _tree(dst) == expected
+
+
+def test_no_hardlinks(checkout, tmpdir):
+    with pytest.raises(ValueError):
+        stage_checkout(checkout, str(tmpdir.join('build')), materialize='hardlink')
@@ -0,0 +1,68 @@
+import json
+import os
+import tarfile
+
+import pytest
+
+from build_collections import _discover_tests
+from release_source import open_release
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'discover_tests')
+
+# expected.json is what the find(1) discovery _index_collections did
+# before ReleaseTestIndex (049771b^) made of the fixture tree, absolute
+# paths written as <rdir>. It was run with yaml.SafeLoader, as PyYAML 6
+# no longer loads without a Loader.
+
+
+def _load(name):
+    with open(os.path.join(FIXTURES, name), 'r') as f:
+        return json.load(f)
+
+
+def _discovered(collections, rdir):
+    res = {}
+    for (k, v) in collections.items():
+        res[k] = {
+            'units': [x.replace(rdir, '<rdir>') for x in v['units']],
+            'targets': v['targets'],
+        }
+    return res
+
+
+@pytest.fixture
+def releasedir(tmpdir):
+    # a tarball of the fixture tree, next to nothing extracted
+    with tarfile.open(str(tmpdir.join('ansible-2.7.0.tar.gz')), 'w:gz') as tar:
+        tar.add(os.path.join(FIXTURES, 'ansible-2.7.0'), arcname='ansible-2.7.0')
+    return str(tmpdir)
+
+
+def test_discover_tests_extracted():
+    collections = _load('collections.json')
+    release = open_release('ansible-2.7.0', FIXTURES)
+    rdir = os.path.join(FIXTURES, 'ansible-2.7.0')
+
+    _discover_tests(collections, release, rdir)
+    assert _discovered(collections, rdir) == _load('expected.json')
+
+
+def test_discover_tests_streamed(releasedir):
+    collections = _load('collections.json')
+    release = open_release('ansible-2.7.0.tar.gz', releasedir, stream=True)
+    rdir = os.path.join(releasedir, 'ansible-2.7.0')
+
+    _discover_tests(collections, release, rdir)
+    assert _discovered(collections, rdir) == _load('expected.json')
+
+
+def test_discover_tests_keys():
+    collections = _load('collections.json')
+    release = open_release('ansible-2.7.0', FIXTURES)
+    rdir = os.path.join(FIXTURES, 'ansible-2.7.0')
+
+    _discover_tests(collections, release, rdir, keys=['network/ios'])
+    assert 'units' not in collections['cloud/amazon']
+    assert _discovered({'network/ios': collections['network/ios']}, rdir)['network/ios'] == \
+        _load('expected.json')['network/ios']
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import threading
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from downloader import download_file
+from downloader import download_files
+from downloader import make_session
+from release_manifest import ReleaseManifest
+
+
+class _Handler(BaseHTTPRequestHandler):
+    '''Serves server.files with ETags, conditional GETs and byte ranges'''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        etag = '"%s"' % hashlib.sha256(data).hexdigest()[:16]
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        rng = self.headers.get('Range')
+        if rng and self.headers.get('If-Range', etag) == etag:
+            start = int(rng.split('=')[1].rstrip('-'))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%s' % len(data))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (start, len(data) - 1, len(data)))
+            body = data[start:]
+        else:
+            self.send_response(200)
+            body = data
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.files = {}
+    httpd.requests = []
+    httpd.url = 'http://127.0.0.1:%s' % httpd.server_address[1]
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _read(fn):
+    with open(fn, 'rb') as f:
+        return f.read()
+
+
+def _write(fn, data):
+    with open(fn, 'wb') as f:
+        f.write(data)
+
+
+def _etag(data):
+    return '"%s"' % hashlib.sha256(data).hexdigest()[:16]
+
+
+def test_fetch_then_not_modified(server, tmpdir):
+    data = os.urandom(300000)
+    server.files['/a.tar.gz'] = data
+    url = server.url + '/a.tar.gz'
+    dst = str(tmpdir.join('a.tar.gz'))
+    manifest = ReleaseManifest(str(tmpdir.join('manifest.json')))
+    session = make_session()
+
+    res = download_file(session, url, dst, manifest=manifest)
+    assert res['status'] == 'fetched'
+    assert res['bytes'] == len(data)
+    assert _read(dst) == data
+    assert not os.path.exists(dst + '.part')
+    assert not os.path.exists(dst + '.part.json')
+    assert manifest.get(url)['sha256'] == hashlib.sha256(data).hexdigest()
+
+    res = download_file(session, url, dst, manifest=manifest)
+    assert res['status'] == 'cached'
+    assert len(server.requests) == 1
+
+    res = download_file(session, url, dst, manifest=manifest, revalidate=True)
+    assert res['status'] == 'not-modified'
+    assert server.requests[-1][1]['If-None-Match'] == _etag(data)
+
+
+def test_resume(server, tmpdir):
+    data = os.urandom(300000)
+    server.files['/a.tar.gz'] = data
+    dst = str(tmpdir.join('a.tar.gz'))
+    _write(dst + '.part', data[:1000])
+    _write(dst + '.part.json', json.dumps({'etag': _etag(data)}).encode('utf-8'))
+
+    res = download_file(make_session(), server.url + '/a.tar.gz', dst)
+    assert res['status'] == 'resumed'
+    assert res['bytes'] == len(data) - 1000
+    assert server.requests[-1][1]['Range'] == 'bytes=1000-'
+    assert server.requests[-1][1]['If-Range'] == _etag(data)
+    assert _read(dst) == data
+
+
+def test_resume_changed_upstream(server, tmpdir):
+    # If-Range does not match, the server sends the whole new file
+    data = os.urandom(300000)
+    server.files['/a.tar.gz'] = data
+    dst = str(tmpdir.join('a.tar.gz'))
+    _write(dst + '.part', os.urandom(1000))
+    _write(dst + '.part.json', json.dumps({'etag': '"old"'}).encode('utf-8'))
+
+    res = download_file(make_session(), server.url + '/a.tar.gz', dst)
+    assert res['status'] == 'fetched'
+    assert _read(dst) == data
+
+
+def test_part_without_validator_is_refetched(server, tmpdir):
+    data = os.urandom(300000)
+    server.files['/a.tar.gz'] = data
+    dst = str(tmpdir.join('a.tar.gz'))
+    _write(dst + '.part', os.urandom(1000))
+
+    res = download_file(make_session(), server.url + '/a.tar.gz', dst)
+    assert res['status'] == 'fetched'
+    assert 'Range' not in server.requests[-1][1]
+    assert _read(dst) == data
+
+
+def test_complete_part_is_refetched(server, tmpdir):
+    # a run that died between writing the whole .part and renaming it
+    data = os.urandom(300000)
+    server.files['/a.tar.gz'] = data
+    dst = str(tmpdir.join('a.tar.gz'))
+    _write(dst + '.part', data)
+    _write(dst + '.part.json', json.dumps({'etag': _etag(data)}).encode('utf-8'))
+
+    res = download_file(make_session(), server.url + '/a.tar.gz', dst)
+    assert res['status'] == 'fetched'
+    assert [x[1].get('Range') for x in server.requests] == ['bytes=300000-', None]
+    assert _read(dst) == data
+
+    # and the next run does not try it again
+    res = download_file(make_session(), server.url + '/a.tar.gz', dst)
+    assert res['status'] == 'cached'
+
+
+def test_failure_does_not_stop_the_others(server, tmpdir):
+    downloads = []
+    for idx in range(4):
+        server.files['/%s.tar.gz' % idx] = os.urandom(50000 + idx)
+        downloads.append((server.url + '/%s.tar.gz' % idx, str(tmpdir.join('%s.tar.gz' % idx))))
+    downloads.insert(2, (server.url + '/missing.tar.gz', str(tmpdir.join('missing.tar.gz'))))
+    manifest = ReleaseManifest(str(tmpdir.join('manifest.json')))
+
+    results = download_files(downloads, jobs=3, manifest=manifest)
+    statuses = dict([(os.path.basename(x['dst']), x['status']) for x in results])
+    assert statuses == {
+        '0.tar.gz': 'fetched',
+        '1.tar.gz': 'fetched',
+        '2.tar.gz': 'fetched',
+        '3.tar.gz': 'fetched',
+        'missing.tar.gz': 'failed',
+    }
+    assert '404' in [x for x in results if x['status'] == 'failed'][0]['error']
+    for idx in range(4):
+        assert _read(str(tmpdir.join('%s.tar.gz' % idx))) == server.files['/%s.tar.gz' % idx]
+    assert not os.path.exists(str(tmpdir.join('missing.tar.gz')))
+    assert os.path.exists(str(tmpdir.join('manifest.json')))
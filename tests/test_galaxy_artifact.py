@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import tarfile
+
+import pytest
+
+from galaxy_artifact import artifact_name
+from galaxy_artifact import build_artifact
+from galaxy_artifact import semver
+
+
+GALAXY_YML = '''namespace: jctanner
+name: cloud_vmware
+version: 2.10.0.dev0
+authors:
+  - ansible
+license: GPL-3.0-or-later
+'''
+
+
+def _write(path, data, mode=0o644):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(data)
+    os.chmod(path, mode)
+
+
+@pytest.fixture
+def cdir(tmpdir):
+    cdir = str(tmpdir.join('ansible_collections', 'jctanner', 'cloud_vmware'))
+    _write(os.path.join(cdir, 'galaxy.yml'), GALAXY_YML)
+    _write(os.path.join(cdir, 'plugins', 'modules', 'vmware_guest.py'), '# guest\n')
+    _write(os.path.join(cdir, 'plugins', 'module_utils', 'vmware.py'), '# utils\n')
+    _write(os.path.join(cdir, 'plugins', 'scripts', 'inventory.sh'), '#!/bin/sh\n', 0o750)
+    _write(os.path.join(cdir, 'tests', 'unit', 'test_vmware_guest.py'), 'def test():\n    pass\n')
+    # what ansible-galaxy leaves out
+    _write(os.path.join(cdir, 'plugins', 'modules', 'vmware_guest.pyc'), 'pyc')
+    _write(os.path.join(cdir, 'plugins', 'modules', '__pycache__', 'x.pyc'), 'pyc')
+    _write(os.path.join(cdir, 'tests', 'output', 'junit.xml'), '<xml/>')
+    return cdir
+
+
+def _members(dst):
+    with tarfile.open(dst, 'r:gz') as tar:
+        return [(x, tar.extractfile(x).read() if x.isfile() else None) for x in tar.getmembers()]
+
+
+def test_reproducible(cdir, tmpdir):
+    (first, second) = (str(tmpdir.join('first.tar.gz')), str(tmpdir.join('second.tar.gz')))
+    build_artifact(cdir, first)
+
+    # new mtimes and a different umask do not show
+    for (dirpath, dirnames, filenames) in os.walk(cdir):
+        for fn in filenames:
+            os.utime(os.path.join(dirpath, fn), (1, 1))
+    os.chmod(os.path.join(cdir, 'plugins', 'modules', 'vmware_guest.py'), 0o600)
+    build_artifact(cdir, second)
+
+    with open(first, 'rb') as f1, open(second, 'rb') as f2:
+        assert f1.read() == f2.read()
+
+
+def test_files_json(cdir, tmpdir):
+    dst = str(tmpdir.join('artifact.tar.gz'))
+    res = build_artifact(cdir, dst, version='2.10.0.dev0')
+    members = _members(dst)
+    names = [x[0].name for x in members]
+    assert names == [
+        'plugins',
+        'plugins/module_utils',
+        'plugins/module_utils/vmware.py',
+        'plugins/modules',
+        'plugins/modules/vmware_guest.py',
+        'plugins/scripts',
+        'plugins/scripts/inventory.sh',
+        'tests',
+        'tests/unit',
+        'tests/unit/test_vmware_guest.py',
+        'FILES.json',
+        'MANIFEST.json',
+    ]
+    assert res == {'files': 4, 'version': '2.10.0-dev0'}
+
+    content = dict([(x[0].name, x[1]) for x in members])
+    for (ti, data) in members:
+        assert (ti.mtime, ti.uid, ti.gid, ti.uname, ti.gname) == (1546300800, 0, 0, '', '')
+        expected = 0o755 if ti.isdir() or ti.name.endswith('.sh') else 0o644
+        assert ti.mode == expected
+
+    files = json.loads(content['FILES.json'].decode('utf-8'))
+    assert files['files'][0]['name'] == '.'
+    listed = dict([(x['name'], x) for x in files['files'][1:]])
+    assert sorted(listed) == sorted(names[:-2])
+    for (name, entry) in listed.items():
+        if entry['ftype'] == 'dir':
+            assert entry['chksum_sha256'] is None
+        else:
+            assert entry['chksum_type'] == 'sha256'
+            assert entry['chksum_sha256'] == hashlib.sha256(content[name]).hexdigest()
+
+    manifest = json.loads(content['MANIFEST.json'].decode('utf-8'))
+    assert manifest['file_manifest_file']['chksum_sha256'] == hashlib.sha256(content['FILES.json']).hexdigest()
+    assert manifest['collection_info']['namespace'] == 'jctanner'
+    assert manifest['collection_info']['version'] == '2.10.0-dev0'
+    assert manifest['collection_info']['license'] == ['GPL-3.0-or-later']
+
+
+def test_version_mismatch(cdir, tmpdir):
+    with pytest.raises(ValueError):
+        build_artifact(cdir, str(tmpdir.join('artifact.tar.gz')), version='2.9.0')
+
+
+@pytest.mark.parametrize('version,expected', [
+    ('2.10.0', '2.10.0'),
+    ('2.10.0.dev0', '2.10.0-dev0'),
+    ('2.9.0rc1', '2.9.0-rc1'),
+    ('2.10.0.dev0+pull.12345', '2.10.0-dev0+pull.12345'),
+    ('2.10.0+stable.2.9', '2.10.0+stable.2.9'),
+])
+def test_semver(version, expected):
+    assert semver(version) == expected
+    assert artifact_name('jctanner', 'cloud_vmware', version) == 'jctanner-cloud_vmware-%s.tar.gz' % expected
@@ -0,0 +1,132 @@
+import os
+
+from import_rewriter import module_util_table
+from import_rewriter import rewrite_imports
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'import_rewriter')
+
+NAMESPACE = 'jctanner'
+NAME = 'cloud_vmware'
+MODULE_UTILS = [
+    'vmware',
+    'vmware_rest',
+    'network.ios.ios',
+    'network.common.utils',
+    'network.common.config',
+    '_text',
+    'basic',
+]
+BLACKLIST = ['_text', 'basic']
+
+
+def old_rewrite(mdata, module_utils):
+    '''The single line path of the per-module_util loop rewrite_imports replaced
+
+    Parenthesized and backslash continued imports were re-emitted as a
+    sorted block there, which rewrite_imports deliberately does not do.
+    '''
+    for mu in module_utils:
+        if not mu or mu in BLACKLIST:
+            continue
+        si = 'ansible.module_utils.%s' % mu
+        di = 'ansible_collections.%s.%s.plugins.module_utils.%s' % (NAMESPACE, NAME, mu)
+        mdlines = mdata.split('\n')
+        for idx, x in enumerate(mdlines):
+            if not x.startswith('from '):
+                continue
+            if si in x:
+                newx = x.replace(si, di)
+                if len(newx) < 160 and ('(' not in x) and '\\' not in x:
+                    mdlines[idx] = newx
+        mdata = '\n'.join(mdlines)
+    return mdata
+
+
+def _table():
+    return module_util_table(MODULE_UTILS, NAMESPACE, NAME, blacklist=BLACKLIST)
+
+
+def _read(fn):
+    with open(os.path.join(FIXTURES, fn), 'r') as f:
+        return f.read()
+
+
+def test_golden_module():
+    (out, count) = rewrite_imports(_read('module.py'), _table())
+    assert out == _read('module.expected.py')
+    assert count == 11
+    compile(out, 'module.expected.py', 'exec')
+
+
+def test_same_as_old_rewrite():
+    # what the old loop got right has to come out the same
+    source = '\n'.join([
+        'from ansible.module_utils.basic import AnsibleModule',
+        'from ansible.module_utils.vmware import connect_to_api, find_obj',
+        'from ansible.module_utils.vmware import TaskError as VmwareTaskError, wait_for_vm_ip',
+        'from ansible.module_utils.network.ios.ios import get_config, load_config',
+        'from ansible.module_utils.network.common.utils import to_list',
+        'from ansible.module_utils.network.common.config import NetworkConfig',
+        '',
+        'x = 1',
+        '',
+    ])
+    (out, count) = rewrite_imports(source, _table())
+    assert count == 5
+    assert out == old_rewrite(source, MODULE_UTILS)
+
+
+def test_parenthesized_imports():
+    source = (
+        'from ansible.module_utils.vmware import (a, b)\n'
+        'from ansible.module_utils.network.ios.ios import (\n'
+        '    get_config,  # comment\n'
+        '    load_config as lc,\n'
+        ')\n'
+    )
+    (out, count) = rewrite_imports(source, _table())
+    assert count == 2
+    assert out == (
+        'from ansible_collections.jctanner.cloud_vmware.plugins.module_utils.vmware import (a, b)\n'
+        'from ansible_collections.jctanner.cloud_vmware.plugins.module_utils.network.ios.ios import (\n'
+        '    get_config,  # comment\n'
+        '    load_config as lc,\n'
+        ')\n'
+    )
+
+
+def test_aliased_imports():
+    source = (
+        'import ansible.module_utils.vmware as vmw\n'
+        'from ansible.module_utils.network.ios import ios as ios_utils\n'
+        'from ansible.module_utils.vmware import connect_to_api as connect\n'
+        # without an alias the code refers to the full dotted name
+        'import ansible.module_utils.network.common.utils\n'
+    )
+    (out, count) = rewrite_imports(source, _table())
+    assert count == 3
+    assert out == (
+        'import ansible_collections.jctanner.cloud_vmware.plugins.module_utils.vmware as vmw\n'
+        'from ansible_collections.jctanner.cloud_vmware.plugins.module_utils.network.ios import ios as ios_utils\n'
+        'from ansible_collections.jctanner.cloud_vmware.plugins.module_utils.vmware import connect_to_api as connect\n'
+        'import ansible.module_utils.network.common.utils\n'
+    )
+
+
+def test_names_match_exactly():
+    source = 'from ansible.module_utils.vmware_rest import VmwareRestClient\n'
+    table = module_util_table(['vmware'], NAMESPACE, NAME)
+    assert rewrite_imports(source, table) == (source, 0)
+    # where the old substring match went wrong
+    assert 'plugins.module_utils.vmware_rest' in old_rewrite(source, ['vmware'])
+
+
+def test_long_lines_are_wrapped():
+    names = ', '.join(['helper_%02d' % x for x in range(12)])
+    source = 'from ansible.module_utils.network.common.utils import %s\n' % names
+    (out, count) = rewrite_imports(source, _table())
+    assert count == 1
+    assert out.startswith('from ansible_collections.jctanner.cloud_vmware.plugins.module_utils.network.common.utils import (\n')
+    assert '    helper_11,\n' in out
+    compile(out, '<wrapped>', 'exec')
@@ -0,0 +1,87 @@
+import sqlite3
+import time
+
+import pytest
+
+from index_cache import IndexCache
+
+
+def _digests(filename):
+    conn = sqlite3.connect(filename)
+    try:
+        return sorted([x[0] for x in conn.execute('SELECT digest FROM entries')])
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def db(tmpdir):
+    return str(tmpdir.join('meta', 'index-cache.sqlite'))
+
+
+def test_digest_hits(db):
+    calls = []
+
+    def scan(source):
+        calls.append(source)
+        return {'module_utils': [source.decode('utf-8')]}
+
+    with IndexCache(db) as cache:
+        assert cache.get_or_compute(b'vmware', scan, kind='.py') == {'module_utils': ['vmware']}
+        # the same bytes from another file or release are not scanned again
+        assert cache.get_or_compute(b'vmware', scan, kind='.py') == {'module_utils': ['vmware']}
+        # but the same bytes as another kind of file are
+        cache.get_or_compute(b'vmware', scan, kind='.ps1')
+    assert calls == [b'vmware', b'vmware']
+
+    # and it holds across runs and processes
+    with IndexCache(db) as cache:
+        assert cache.get_or_compute(b'vmware', scan, kind='.py') == {'module_utils': ['vmware']}
+        cache.get_or_compute(b'ios', scan, kind='.py')
+        assert (cache.hits, cache.misses) == (1, 1)
+    assert calls == [b'vmware', b'vmware', b'ios']
+
+
+def test_version_bump_invalidates(db):
+    with IndexCache(db, version=1) as cache:
+        cache.get_or_compute(b'vmware', lambda x: 'v1')
+
+    with IndexCache(db, version=2) as cache:
+        assert cache.get_or_compute(b'vmware', lambda x: 'v2') == 'v2'
+        assert cache.misses == 1
+        assert cache.get_or_compute(b'vmware', lambda x: 'v3') == 'v2'
+
+    # the old version's rows went with the close
+    assert len(_digests(db)) == 1
+    with IndexCache(db, version=1) as cache:
+        assert cache.get_or_compute(b'vmware', lambda x: 'v1 again') == 'v1 again'
+
+
+def test_eviction_keeps_the_recently_used(db, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+
+    with IndexCache(db, max_entries=3) as cache:
+        for name in [b'a', b'b', b'c', b'd']:
+            now[0] += 1
+            cache.put(IndexCache.digest(name), name.decode('utf-8'))
+            cache.flush()
+        now[0] += 1
+        # a is used again, so b is now the oldest
+        assert cache.get(IndexCache.digest(b'a')) == 'a'
+    assert cache.evictions == 1
+
+    expected = sorted([IndexCache.digest(x) for x in [b'a', b'c', b'd']])
+    assert _digests(db) == expected
+
+
+def test_closed_on_error(db):
+    with pytest.raises(RuntimeError):
+        with IndexCache(db) as cache:
+            cache.get_or_compute(b'vmware', lambda x: 'scanned')
+            raise RuntimeError('indexing failed')
+
+    # what was computed before the error is kept, and the db is closed
+    with pytest.raises(sqlite3.ProgrammingError):
+        cache.conn.execute('SELECT 1')
+    assert _digests(db) == [IndexCache.digest(b'vmware')]
@@ -0,0 +1,123 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+import build_collections
+
+
+MODULE = '''
+DOCUMENTATION = """
+module: %(name)s
+extends_documentation_fragment:
+  - %(fragment)s
+"""
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.%(util)s import connect
+'''
+
+
+def _write(rdir, path, data=''):
+    fn = os.path.join(rdir, path)
+    if not os.path.exists(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    with open(fn, 'w') as f:
+        f.write(data)
+
+
+def _module(rdir, path, util='vmware', fragment='vmware.documentation'):
+    name = os.path.splitext(os.path.basename(path))[0]
+    _write(rdir, 'lib/ansible/modules/' + path, MODULE % {'name': name, 'util': util, 'fragment': fragment})
+
+
+def _git(rdir, *args):
+    subprocess.check_output(
+        ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args),
+        cwd=rdir
+    )
+
+
+def _meta(vardir):
+    metadir = os.path.join(vardir, 'meta')
+    with open(os.path.join(metadir, 'ansible-2.10.0.dev0-meta.json'), 'r') as f:
+        meta = json.loads(f.read())
+    with open(os.path.join(metadir, 'ansible-2.10.0.dev0-meta.state.json'), 'r') as f:
+        state = json.loads(f.read())
+    return (meta, state)
+
+
+@pytest.fixture
+def devel(tmpdir, monkeypatch):
+    vardir = str(tmpdir)
+    monkeypatch.setattr(build_collections, 'VARDIR', vardir)
+
+    rdir = os.path.join(vardir, 'releases', 'devel.git')
+    _write(rdir, 'lib/ansible/release.py', "__version__ = '2.10.0.dev0'\n")
+    _write(rdir, 'lib/ansible/modules/__init__.py')
+    _module(rdir, 'cloud/vmware/vmware_guest.py')
+    _module(rdir, 'cloud/vmware/vmware_host.py')
+    _module(rdir, 'network/ios/ios_command.py', util='network.ios.ios', fragment='ios')
+    _write(rdir, 'test/units/modules/cloud/vmware/test_vmware_guest.py', 'def test_guest():\n    pass\n')
+    _write(rdir, 'test/integration/targets/ios_command/tasks/main.yml', '- ios_command:\n')
+    _git(rdir, 'init', '-q')
+    _git(rdir, 'add', '-A')
+    _git(rdir, 'commit', '-q', '-m', 'base')
+    return (vardir, rdir)
+
+
+def _index(vardir, **kwargs):
+    releasedir = os.path.join(vardir, 'releases')
+    colbasedir = os.path.join(vardir, 'collections')
+    build_collections._index_collections('devel.git', releasedir, colbasedir, **kwargs)
+
+
+def test_incremental_matches_full_index(devel, monkeypatch):
+    (vardir, rdir) = devel
+    _index(vardir)
+
+    # a changed, an added and a removed module, a new collection and a test
+    _module(rdir, 'cloud/vmware/vmware_guest.py', util='vmware_rest', fragment='vmware_rest')
+    _module(rdir, 'cloud/vmware/vmware_cluster.py')
+    _module(rdir, 'cloud/amazon/ec2.py', util='ec2', fragment='aws')
+    os.remove(os.path.join(rdir, 'lib/ansible/modules/network/ios/ios_command.py'))
+    _write(rdir, 'test/integration/targets/vmware_cluster/tasks/main.yml', '- vmware_cluster:\n')
+    _git(rdir, 'add', '-A')
+    _git(rdir, 'commit', '-q', '-m', 'change')
+
+    scanned = []
+    _scan_modules = build_collections._scan_modules
+
+    def scan_modules(files, *args):
+        scanned.extend(files)
+        return _scan_modules(files, *args)
+
+    monkeypatch.setattr(build_collections, '_scan_modules', scan_modules)
+
+    # no refresh, HEAD moved so the meta gets patched from the diff
+    _index(vardir)
+    assert sorted(scanned) == ['./cloud/amazon/ec2.py', './cloud/vmware/vmware_cluster.py',
+                               './cloud/vmware/vmware_guest.py']
+    (incremental, istate) = _meta(vardir)
+    assert incremental['cloud/vmware']['module_utils'] == ['basic', 'vmware', 'vmware_rest']
+    assert incremental['cloud/vmware']['targets'] == ['vmware_cluster']
+    assert incremental['network/ios']['modules'] == []
+
+    _index(vardir, refresh=True, force=True)
+    (full, fstate) = _meta(vardir)
+    assert incremental == full
+    assert istate == fstate
+
+
+def test_unchanged_checkout_is_not_reindexed(devel, monkeypatch):
+    (vardir, rdir) = devel
+    _index(vardir)
+    (meta, state) = _meta(vardir)
+
+    def open_release(*args, **kwargs):
+        raise AssertionError('reindexed an unchanged checkout')
+
+    monkeypatch.setattr(build_collections, 'open_release', open_release)
+    _index(vardir)
+    assert _meta(vardir) == (meta, state)
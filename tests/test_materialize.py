@@ -0,0 +1,152 @@
+import errno
+import os
+
+import pytest
+
+import materialize
+from materialize import Materializer
+
+
+def _write(path, data):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def _read(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+@pytest.fixture
+def src(tmpdir):
+    src = str(tmpdir.join('release'))
+    _write(os.path.join(src, 'modules', 'vmware_guest.py'), 'guest\n')
+    _write(os.path.join(src, 'modules', 'vmware_host.py'), 'host\n')
+    _write(os.path.join(src, 'module_utils', 'vmware.py'), 'utils\n')
+    return src
+
+
+@pytest.fixture
+def no_reflink(monkeypatch):
+    calls = []
+
+    def ioctl(fd, request, arg):
+        calls.append(request)
+        raise OSError(errno.EOPNOTSUPP, 'not supported')
+
+    monkeypatch.setattr(materialize.fcntl, 'ioctl', ioctl)
+    return calls
+
+
+def test_reflink(src, tmpdir, monkeypatch):
+    def ioctl(fd, request, arg):
+        # what FICLONE leaves behind, without a filesystem that has it
+        assert request == materialize.FICLONE
+        os.lseek(arg, 0, os.SEEK_SET)
+        os.write(fd, os.read(arg, 1024))
+
+    monkeypatch.setattr(materialize.fcntl, 'ioctl', ioctl)
+    dst = str(tmpdir.join('col', 'vmware_guest.py'))
+    os.makedirs(os.path.dirname(dst))
+    mat = Materializer()
+    assert mat.place(os.path.join(src, 'modules', 'vmware_guest.py'), dst) == 'reflinked'
+    assert _read(dst) == 'guest\n'
+    assert not os.path.samefile(dst, os.path.join(src, 'modules', 'vmware_guest.py'))
+
+
+def test_reflink_falls_back_to_hardlink(src, tmpdir, no_reflink):
+    col = str(tmpdir.join('col'))
+    os.makedirs(col)
+    mat = Materializer()
+    for fn in ['vmware_guest.py', 'vmware_host.py']:
+        assert mat.place(os.path.join(src, 'modules', fn), os.path.join(col, fn)) == 'hardlinked'
+        assert os.path.samefile(os.path.join(src, 'modules', fn), os.path.join(col, fn))
+    # the failure is remembered per pair of filesystems
+    assert len(no_reflink) == 1
+    assert mat.stats['hardlinked'] == 2
+
+
+def test_hardlink_falls_back_to_copy(src, tmpdir, no_reflink, monkeypatch):
+    def link(src, dst):
+        raise OSError(errno.EXDEV, 'cross-device link')
+
+    monkeypatch.setattr(os, 'link', link)
+    dst = str(tmpdir.join('col', 'vmware.py'))
+    os.makedirs(os.path.dirname(dst))
+    mat = Materializer()
+    assert mat.place(os.path.join(src, 'module_utils', 'vmware.py'), dst) == 'copied'
+    assert _read(dst) == 'utils\n'
+    assert mat.stats['bytes_copied'] == len('utils\n')
+
+
+def test_copy_mode_never_links(src, tmpdir, no_reflink):
+    dst = str(tmpdir.join('col', 'vmware.py'))
+    os.makedirs(os.path.dirname(dst))
+    mat = Materializer(mode='copy')
+    assert mat.place(os.path.join(src, 'module_utils', 'vmware.py'), dst) == 'copied'
+    assert not os.path.samefile(dst, os.path.join(src, 'module_utils', 'vmware.py'))
+    assert no_reflink == []
+
+
+def test_other_errors_are_raised(src, tmpdir, monkeypatch):
+    def ioctl(fd, request, arg):
+        raise OSError(errno.EIO, 'io error')
+
+    monkeypatch.setattr(materialize.fcntl, 'ioctl', ioctl)
+    dst = str(tmpdir.join('col', 'vmware.py'))
+    os.makedirs(os.path.dirname(dst))
+    with pytest.raises(OSError):
+        Materializer().place(os.path.join(src, 'module_utils', 'vmware.py'), dst)
+    assert os.listdir(os.path.dirname(dst)) == []
+
+
+def test_current_and_transform(src, tmpdir, no_reflink):
+    fsrc = os.path.join(src, 'modules', 'vmware_guest.py')
+    dst = str(tmpdir.join('col', 'vmware_guest.py'))
+    os.makedirs(os.path.dirname(dst))
+    Materializer().place(fsrc, dst)
+
+    mat = Materializer()
+    assert mat.place(fsrc, dst) == 'current'
+
+    # a changed file is written anew, the release keeps its content
+    assert mat.place(fsrc, dst, transform=lambda d, data: data.upper()) == 'written'
+    assert _read(dst) == 'GUEST\n'
+    assert _read(fsrc) == 'guest\n'
+    assert mat.place(fsrc, dst, transform=lambda d, data: data.upper()) == 'unchanged'
+
+
+def test_copytree_and_prune(src, tmpdir, no_reflink):
+    col = str(tmpdir.join('col'))
+    _write(os.path.join(col, 'modules', 'removed.py'), 'gone\n')
+    _write(os.path.join(col, 'old', 'deep', 'x.py'), 'gone\n')
+    os.symlink('modules', os.path.join(col, 'old_link'))
+
+    mat = Materializer()
+    mat.copytree(src, col)
+    mat.prune(col)
+    found = []
+    for (dirpath, dirnames, filenames) in os.walk(col):
+        found += [os.path.relpath(os.path.join(dirpath, x), col) for x in filenames + dirnames]
+    assert sorted(found) == [
+        'module_utils',
+        'module_utils/vmware.py',
+        'modules',
+        'modules/vmware_guest.py',
+        'modules/vmware_host.py',
+    ]
+    assert mat.stats['pruned'] == 3
+
+
+def test_link(tmpdir):
+    col = str(tmpdir.join('col'))
+    _write(os.path.join(col, 'tests', 'x.py'), 'x\n')
+    mat = Materializer()
+    # a dir where the link goes is replaced
+    assert mat.link('../units', os.path.join(col, 'tests')) == 'linked'
+    assert os.readlink(os.path.join(col, 'tests')) == '../units'
+    assert mat.link('../units', os.path.join(col, 'tests')) == 'current'
+    mat.prune(col)
+    assert os.path.islink(os.path.join(col, 'tests'))
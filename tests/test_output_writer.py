@@ -0,0 +1,117 @@
+import os
+
+from output_writer import OutputWriter
+from output_writer import same_content
+from output_writer import same_files
+
+
+def _write(path, data):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def _read(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+def _age(path):
+    '''Back-date path so an untouched file can be told from a rewritten one'''
+    os.utime(path, (1546300800, 1546300800))
+    return os.stat(path).st_mtime_ns
+
+
+def test_write_if_changed(tmpdir):
+    dst = str(tmpdir.join('galaxy.yml'))
+    out = OutputWriter()
+    assert out.write(dst, 'name: cloud_vmware\n') == 'written'
+    mtime = _age(dst)
+    ino = os.stat(dst).st_ino
+
+    assert out.write(dst, 'name: cloud_vmware\n') == 'unchanged'
+    assert out.write(dst, b'name: cloud_vmware\n') == 'unchanged'
+    assert os.stat(dst).st_mtime_ns == mtime
+    assert os.stat(dst).st_ino == ino
+
+    # a change is renamed into place, not written into the old inode
+    assert out.write(dst, 'name: cloud_azure\n') == 'written'
+    assert _read(dst) == 'name: cloud_azure\n'
+    assert os.stat(dst).st_mtime_ns != mtime
+    assert os.stat(dst).st_ino != ino
+    assert out.stats['written'] == 2
+    assert out.stats['unchanged'] == 2
+    assert out.stats['bytes_written'] == len('name: cloud_vmware\n') + len('name: cloud_azure\n')
+    assert os.listdir(str(tmpdir)) == ['galaxy.yml']
+
+
+def test_write_mode(tmpdir):
+    script = str(tmpdir.join('release', 'inventory.sh'))
+    _write(script, '#!/bin/sh\n')
+    os.chmod(script, 0o755)
+    dst = str(tmpdir.join('inventory.sh'))
+    _write(dst, '#!/bin/sh\n')
+    os.chmod(dst, 0o644)
+
+    out = OutputWriter()
+    # same bytes, but not the mode of the file it is like
+    assert out.write(dst, '#!/bin/sh\n', like=script) == 'written'
+    assert os.stat(dst).st_mode & 0o777 == 0o755
+    assert out.write(dst, '#!/bin/sh\n', like=script) == 'unchanged'
+
+    # without like, a rewritten file keeps its own mode
+    os.chmod(dst, 0o700)
+    assert out.write(dst, '#!/bin/bash\n') == 'written'
+    assert os.stat(dst).st_mode & 0o777 == 0o700
+
+
+def test_publish(tmpdir):
+    dst = str(tmpdir.join('cloud_vmware.rpm'))
+    tmp = str(tmpdir.join('.cloud_vmware.rpm.tmp'))
+    out = OutputWriter()
+
+    _write(tmp, 'rpm 1')
+    assert out.publish(tmp, dst) == 'written'
+    assert not os.path.exists(tmp)
+    mtime = _age(dst)
+
+    # the same package again is dropped and the old one keeps its mtime
+    _write(tmp, 'rpm 1')
+    assert out.publish(tmp, dst) == 'unchanged'
+    assert not os.path.exists(tmp)
+    assert os.stat(dst).st_mtime_ns == mtime
+
+    _write(tmp, 'rpm 2')
+    assert out.publish(tmp, dst) == 'written'
+    assert _read(dst) == 'rpm 2'
+    assert os.stat(dst).st_mtime_ns != mtime
+
+
+def test_prune(tmpdir):
+    top = str(tmpdir.join('repos'))
+    for fn in ['rpm/kept.rpm', 'rpm/stale.rpm', 'old/deep/stale.rpm']:
+        _write(os.path.join(top, fn), fn)
+    os.symlink('rpm', os.path.join(top, 'latest'))
+
+    out = OutputWriter()
+    out.write(os.path.join(top, 'rpm', 'kept.rpm'), 'rpm/kept.rpm')
+    out.prune(top)
+    found = []
+    for (dirpath, dirnames, filenames) in os.walk(top):
+        found += [os.path.relpath(os.path.join(dirpath, x), top) for x in filenames + dirnames]
+    assert sorted(found) == ['rpm', 'rpm/kept.rpm']
+    assert out.stats['pruned'] == 3
+
+
+def test_same(tmpdir):
+    fn1 = str(tmpdir.join('a'))
+    fn2 = str(tmpdir.join('b'))
+    _write(fn1, 'x' * 100)
+    _write(fn2, 'x' * 99 + 'y')
+    assert same_content(fn1, b'x' * 100)
+    assert not same_content(fn1, b'x' * 99)
+    assert not same_content(str(tmpdir.join('missing')), b'')
+    assert same_files(fn1, fn1)
+    assert not same_files(fn1, fn2, chunk_size=10)
+    assert not same_files(fn1, str(tmpdir.join('missing')))
@@ -0,0 +1,127 @@
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+import build_collections
+from build_collections import _package_result
+from build_collections import _publish_job
+from build_collections import _run_package_jobs
+from output_writer import OutputWriter
+
+
+def _write(path, data):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def _job(k, v, cdir, dst, fail):
+    def build(tmpfile):
+        if k in fail:
+            _write(tmpfile, 'partial')
+            raise Exception('%s does not build' % k)
+        with open(os.path.join(cdir, 'plugins', 'modules', k + '.py'), 'r') as f:
+            _write(tmpfile, 'package of ' + f.read())
+    return _publish_job(_package_result(k, dst), dst, build)
+
+
+@pytest.fixture
+def packages(tmpdir, monkeypatch):
+    vardir = str(tmpdir)
+    monkeypatch.setattr(build_collections, 'VARDIR', vardir)
+    pkgdir = os.path.join(vardir, 'repos', 'rpm')
+    os.makedirs(pkgdir)
+    todo = {}
+    manifests = {}
+    for (idx, k) in enumerate(['amazon', 'azure', 'vmware', 'ios']):
+        cdir = os.path.join(vardir, 'collections', k)
+        # sizes differ so the order is known
+        _write(os.path.join(cdir, 'plugins', 'modules', k + '.py'), k * (idx + 1))
+        dst = os.path.join(pkgdir, '%s.rpm' % k)
+        todo[dst] = (k, {'name': k}, cdir)
+        manifests[dst] = (os.path.join(vardir, 'repos', 'manifests', 'rpm', k + '.rpm.json'), {'name': k})
+    return (vardir, pkgdir, todo, manifests)
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_failures_do_not_stop_the_others(packages, jobs):
+    (vardir, pkgdir, todo, manifests) = packages
+    skipped = [_package_result('gcp', os.path.join(pkgdir, 'gcp.rpm'), 'skipped', 'unchanged')]
+    results = _run_package_jobs('rpm', todo, _job, (['azure', 'ios'],), jobs=jobs,
+                                results=skipped, manifests=manifests)
+
+    assert [(x['package'], x['status']) for x in results] == [
+        ('amazon.rpm', 'built'),
+        ('azure.rpm', 'failed'),
+        ('gcp.rpm', 'skipped'),
+        ('ios.rpm', 'failed'),
+        ('vmware.rpm', 'built'),
+    ]
+    failed = [x for x in results if x['status'] == 'failed']
+    assert failed[0]['error'] == 'Exception: azure does not build'
+    assert 'Traceback' in failed[0]['traceback']
+
+    # the built ones are in place, the failed ones leave nothing behind
+    assert sorted(os.listdir(pkgdir)) == ['amazon.rpm', 'vmware.rpm']
+    with open(os.path.join(pkgdir, 'vmware.rpm'), 'r') as f:
+        assert f.read() == 'package of vmwarevmwarevmware'
+
+    # only a built package gets its manifest, a failed one is retried next run
+    assert sorted(os.listdir(os.path.join(vardir, 'repos', 'manifests', 'rpm'))) == \
+        ['amazon.rpm.json', 'vmware.rpm.json']
+
+    with open(os.path.join(vardir, 'repos', 'rpm-build-summary.json'), 'r') as f:
+        summary = json.loads(f.read())
+    assert [(x['package'], x['status'], x['reason']) for x in summary] == [
+        ('amazon.rpm', 'built', None),
+        ('azure.rpm', 'failed', None),
+        ('gcp.rpm', 'skipped', 'unchanged'),
+        ('ios.rpm', 'failed', None),
+        ('vmware.rpm', 'built', None),
+    ]
+    for res in summary:
+        assert 'stats' not in res
+        assert sorted(res) == ['collection', 'duration', 'error', 'package', 'reason', 'status', 'traceback']
+        assert res['duration'] >= 0
+    assert summary[1]['error'] == 'Exception: azure does not build'
+
+
+def test_rebuild_unchanged_is_not_republished(packages):
+    (vardir, pkgdir, todo, manifests) = packages
+    _run_package_jobs('rpm', todo, _job, ([],))
+    mtime = os.stat(os.path.join(pkgdir, 'amazon.rpm')).st_mtime_ns
+    time.sleep(0.01)
+    results = _run_package_jobs('rpm', todo, _job, ([],))
+    assert [x['status'] for x in results] == ['built'] * 4
+    assert sum([x['stats']['unchanged'] for x in results]) == 4
+    assert os.stat(os.path.join(pkgdir, 'amazon.rpm')).st_mtime_ns == mtime
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='the workers have to inherit the patched publish')
+def test_io_jobs(packages, monkeypatch, tmpdir):
+    (vardir, pkgdir, todo, manifests) = packages
+    log = str(tmpdir.join('publish.log'))
+    publish = OutputWriter.publish
+
+    def slow_publish(self, tmpfile, dst):
+        start = time.time()
+        time.sleep(0.2)
+        res = publish(self, tmpfile, dst)
+        with open(log, 'a') as f:
+            f.write('%s %s\n' % (start, time.time()))
+        return res
+
+    monkeypatch.setattr(OutputWriter, 'publish', slow_publish)
+    results = _run_package_jobs('rpm', todo, _job, ([],), jobs=4, io_jobs=1)
+    assert [x['status'] for x in results] == ['built'] * 4
+
+    with open(log, 'r') as f:
+        spans = sorted([tuple(map(float, x.split())) for x in f.read().splitlines()])
+    assert len(spans) == 4
+    for (first, second) in zip(spans, spans[1:]):
+        assert first[1] <= second[0]
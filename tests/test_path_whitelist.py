@@ -0,0 +1,67 @@
+import pytest
+
+from path_whitelist import DESCEND
+from path_whitelist import DROP
+from path_whitelist import KEEP
+from path_whitelist import PathWhitelist
+
+
+@pytest.fixture
+def whitelist():
+    return PathWhitelist({
+        'lib/ansible/modules': ['__init__.py'],
+        'lib/ansible/module_utils': ['__init__.py', 'six', 'common', 'facts/system/distribution.py'],
+    })
+
+
+@pytest.mark.parametrize('path,expected', [
+    # outside any restricted dir
+    ('lib/ansible/cli', KEEP),
+    ('lib/ansible/cli/galaxy.py', KEEP),
+    ('Makefile', KEEP),
+    ('lib/ansible/modules_extra/x.py', KEEP),
+    # above a restricted dir
+    ('lib', DESCEND),
+    ('lib/ansible', DESCEND),
+    # the restricted dirs themselves
+    ('lib/ansible/modules', DESCEND),
+    ('lib/ansible/module_utils', DESCEND),
+    # whitelisted paths and what is below them
+    ('lib/ansible/modules/__init__.py', KEEP),
+    ('lib/ansible/module_utils/six', KEEP),
+    ('lib/ansible/module_utils/six/__init__.py', KEEP),
+    ('lib/ansible/module_utils/common/text/converters.py', KEEP),
+    ('lib/ansible/module_utils/facts/system/distribution.py', KEEP),
+    # above a whitelisted path
+    ('lib/ansible/module_utils/facts', DESCEND),
+    ('lib/ansible/module_utils/facts/system', DESCEND),
+    # everything else in a restricted dir
+    ('lib/ansible/modules/cloud', DROP),
+    ('lib/ansible/modules/cloud/vmware/vmware_guest.py', DROP),
+    ('lib/ansible/module_utils/vmware.py', DROP),
+    ('lib/ansible/module_utils/facts/system/selinux.py', DROP),
+    ('lib/ansible/module_utils/facts/network', DROP),
+    # components match whole, not by prefix
+    ('lib/ansible/module_utils/sixty', DROP),
+    ('lib/ansible/module_utils/sixty/x.py', DROP),
+    ('lib/ansible/module_utils/si', DROP),
+    ('lib/ansible/module_utils/commonplace.py', DROP),
+    ('lib/ansible/modules/__init__.pyc', DROP),
+])
+def test_match(whitelist, path, expected):
+    assert whitelist.match(path) == expected
+
+
+@pytest.mark.parametrize('path', [
+    './lib/ansible/module_utils/six',
+    'lib/ansible/module_utils/six/',
+    'lib//ansible/module_utils/./six',
+])
+def test_match_normalizes(whitelist, path):
+    assert whitelist.match(path) == KEEP
+
+
+def test_nothing_restricted():
+    wl = PathWhitelist({})
+    assert wl.match('lib/ansible/modules/cloud') == KEEP
+    assert wl.match('.') == DESCEND
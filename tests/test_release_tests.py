@@ -0,0 +1,150 @@
+import os
+import subprocess
+
+import pytest
+
+from release_tests import ReleaseTestIndex
+
+
+# the find(1) per lookup discovery _index_collections did before the index
+
+def old_find_unit_files(units_dir, filename):
+    so = subprocess.check_output(['find', units_dir, '-type', 'f', '-name', filename])
+    return so.decode('utf-8').strip()
+
+
+def old_uses_patch_ansible_module(mudir):
+    so = subprocess.check_output(['find', mudir, '-type', 'f', '-name', '*.py'])
+    for uf in [x.strip() for x in so.decode('utf-8').split('\n') if x.strip()]:
+        with open(uf, 'r') as f:
+            if 'patch_ansible_module' in f.read():
+                return True
+    return False
+
+
+def old_target_yaml_files(target_dir, target):
+    so = subprocess.check_output(['find', os.path.join(target_dir, target), '-type', 'f', '-name', '*.yml'])
+    return [x.strip() for x in so.decode('utf-8').split('\n') if x.strip()]
+
+
+def _write(rdir, path, data=''):
+    fn = os.path.join(rdir, path)
+    if not os.path.exists(os.path.dirname(fn)):
+        os.makedirs(os.path.dirname(fn))
+    with open(fn, 'w') as f:
+        f.write(data)
+
+
+def _link(rdir, target, path):
+    os.symlink(target, os.path.join(rdir, path))
+
+
+@pytest.fixture
+def release(tmpdir):
+    rdir = str(tmpdir.join('ansible-2.7.0'))
+    units = 'test/units/'
+    for path in [
+        'modules/__init__.py',
+        'modules/conftest.py',
+        'modules/cloud/__init__.py',
+        'modules/cloud/amazon/__init__.py',
+        'modules/cloud/amazon/test_ec2.py',
+        'modules/cloud/amazon/test_s3.py',
+        'modules/cloud/vmware/__init__.py',
+        'modules/cloud/vmware/fixtures/data.json',
+        'modules/network/__init__.py',
+        'modules/network/ios/__init__.py',
+        'modules/network/ios/test_ios_command.py',
+        'modules/network/nxos/test_nxos_command.py',
+        # the same basename twice
+        'modules/network/ios/test_ios_config.py',
+        'modules/network/ios/old/test_ios_config.py',
+        'module_utils/__init__.py',
+        'module_utils/test_cloud.py',
+        'module_utils/network/__init__.py',
+        'module_utils/network/ios/test_ios.py',
+    ]:
+        _write(rdir, units + path, 'import pytest\n')
+    _write(rdir, units + 'modules/cloud/vmware/test_vmware_guest.py',
+           'def test_x(patch_ansible_module):\n    pass\n')
+    _write(rdir, units + 'modules/network/nxos/deep/er/test_nxos_facts.py',
+           '@pytest.mark.parametrize("patch_ansible_module", [{}], indirect=True)\n')
+
+    # a symlinked test file, a symlinked unit dir and a dangling link
+    _link(rdir, 'test_ec2.py', units + 'modules/cloud/amazon/test_ec2_alias.py')
+    _link(rdir, 'ios', units + 'modules/network/ios_alias')
+    _link(rdir, 'nowhere.py', units + 'modules/cloud/amazon/test_gone.py')
+
+    targets = 'test/integration/targets/'
+    for path in [
+        'ec2/aliases',
+        'ec2/tasks/main.yml',
+        'ec2/tasks/setup.yml',
+        'ec2/defaults/main.yml',
+        'ec2/meta/main.yaml',
+        'ios_command/tests/cli/contains.yaml',
+        'ios_command/tasks/main.yml',
+        'setup_ec2/tasks/main.yml',
+        'empty/aliases',
+    ]:
+        _write(rdir, targets + path, '- ec2:\n')
+    _link(rdir, 'ec2', targets + 'ec2_alias')
+    _link(rdir, 'nowhere', targets + 'gone')
+    return rdir
+
+
+UNIT_FILES = [
+    'test_ec2.py', 'test_ec2_alias.py', 'test_gone.py', 'test_s3.py', 'test_ios_config.py',
+    'test_ios_command.py', 'test_nxos_facts.py', '__init__.py', 'conftest.py', 'test_missing.py',
+]
+UNIT_DIRS = [
+    'modules/cloud', 'modules/cloud/amazon', 'modules/cloud/vmware', 'modules/network/ios',
+    'modules/network/ios_alias', 'modules/network/ios_alias/test_ios_command.py',
+    'modules/network/ios_alias/missing', 'modules/network/nxos', 'modules/network/nxos/deep',
+    'modules/network/eos', 'module_utils/network', 'module_utils/test_cloud.py',
+    'module_utils/network/ios', 'module_utils/missing',
+]
+TARGETS = ['ec2', 'ec2_alias', 'gone', 'ios_command', 'setup_ec2', 'empty', 'missing']
+
+
+def test_unit_files_match_find(release):
+    index = ReleaseTestIndex(release)
+    for name in UNIT_FILES:
+        assert '\n'.join(index.find_unit_files(name)) == old_find_unit_files(index.units_dir, name), name
+
+
+def test_unit_paths_match_exists(release):
+    index = ReleaseTestIndex(release)
+    for path in UNIT_DIRS:
+        path = os.path.join(index.units_dir, path)
+        assert index.unit_exists(path) == os.path.exists(path), path
+
+
+def test_patch_ansible_module_matches_find(release):
+    index = ReleaseTestIndex(release)
+    for path in UNIT_DIRS:
+        path = os.path.join(index.units_dir, path)
+        if not path.startswith(os.path.join(index.units_dir, 'modules')) or not os.path.isdir(path):
+            continue
+        assert index.uses_patch_ansible_module(path) == old_uses_patch_ansible_module(path), path
+
+
+def test_targets_match_find(release):
+    index = ReleaseTestIndex(release)
+    for target in TARGETS:
+        assert index.target_exists(target) == os.path.exists(os.path.join(index.target_dir, target)), target
+        if index.target_exists(target):
+            assert index.target_yaml_files(target) == old_target_yaml_files(index.target_dir, target), target
+
+
+def test_entries_match_disk(release):
+    # what release_source feeds the index for a streamed tarball
+    from release_tests import find_entries
+    disk = ReleaseTestIndex(release)
+    entries = list(find_entries(os.path.join(release, 'test')))
+    fed = ReleaseTestIndex(release, entries=entries)
+    assert fed.unit_paths == disk.unit_paths
+    assert fed.unit_files_by_name == disk.unit_files_by_name
+    assert fed.patched_dirs == disk.patched_dirs
+    assert fed.targets == disk.targets
+    assert fed.target_yaml == disk.target_yaml
@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import io
+import os
+
+from xml.etree import ElementTree
+
+import pytest
+
+from repodata import COMMON_NS
+from repodata import FILELISTS_NS
+from repodata import OTHER_NS
+from repodata import REPO_NS
+from repodata import read_header
+from repodata import read_rpm
+from repodata import update_repodata
+from rpm_writer import RpmWriter
+
+
+PREFIX = '/usr/share/ansible/collections/ansible_collections/jctanner'
+
+
+def _write(path, data):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _build(tmpdir, repodir, name, version):
+    cdir = str(tmpdir.join('src', name))
+    _write(os.path.join(cdir, 'plugins', 'modules', name + '.py'), '# %s %s\n' % (name, version))
+    _write(os.path.join(cdir, 'plugins', 'bin', 'helper'), '#!/bin/sh\n')
+    os.symlink(name + '.py', os.path.join(cdir, 'plugins', 'modules', '_' + name + '.py'))
+    rpm = RpmWriter(
+        'ansible-collection-' + name,
+        version,
+        prefix=os.path.join(PREFIX, name),
+        summary='the %s collection' % name
+    )
+    rpm.add_tree(cdir, 'plugins')
+    dst = os.path.join(repodir, 'ansible-collection-%s-%s.rpm' % (name, version))
+    rpm.write(dst)
+    return (dst, sorted(rpm.files))
+
+
+def _repomd(repodir):
+    '''{type: parsed xml} of repomd.xml, after checking each file against it'''
+    root = ElementTree.parse(os.path.join(repodir, 'repodata', 'repomd.xml')).getroot()
+    files = {}
+    for data in root.findall('{%s}data' % REPO_NS):
+        href = data.find('{%s}location' % REPO_NS).get('href')
+        with open(os.path.join(repodir, href), 'rb') as f:
+            gzdata = f.read()
+        xml = gzip.decompress(gzdata)
+        assert data.find('{%s}checksum' % REPO_NS).text == _sha256(gzdata)
+        assert data.find('{%s}open-checksum' % REPO_NS).text == _sha256(xml)
+        assert int(data.find('{%s}size' % REPO_NS).text) == len(gzdata)
+        assert int(data.find('{%s}open-size' % REPO_NS).text) == len(xml)
+        files[data.get('type')] = ElementTree.fromstring(xml)
+    return files
+
+
+@pytest.fixture
+def repo(tmpdir):
+    repodir = str(tmpdir.join('rpm'))
+    os.makedirs(repodir)
+    rpms = {}
+    for (name, version) in [('cloud_vmware', '2.10.0.dev0'), ('network_ios', '2.7.0')]:
+        rpms['ansible-collection-' + name] = _build(tmpdir, repodir, name, version) + (version,)
+    return (repodir, str(tmpdir.join('cache.json')), rpms)
+
+
+def test_round_trip(repo):
+    (repodir, cache_file, rpms) = repo
+    counts = update_repodata(repodir, cache_file)
+    assert counts['packages'] == 2
+    assert counts['read'] == 2
+
+    files = _repomd(repodir)
+    assert sorted(files) == ['filelists', 'other', 'primary']
+
+    primary = files['primary']
+    assert primary.get('packages') == '2'
+    packages = primary.findall('{%s}package' % COMMON_NS)
+    assert sorted([x.find('{%s}name' % COMMON_NS).text for x in packages]) == sorted(rpms)
+    for pkg in packages:
+        name = pkg.find('{%s}name' % COMMON_NS).text
+        (dst, paths, version) = rpms[name]
+        with open(dst, 'rb') as f:
+            assert pkg.find('{%s}checksum' % COMMON_NS).text == _sha256(f.read())
+        assert pkg.find('{%s}version' % COMMON_NS).get('ver') == version
+        assert pkg.find('{%s}location' % COMMON_NS).get('href') == os.path.basename(dst)
+        assert pkg.find('{%s}size' % COMMON_NS).get('package') == str(os.path.getsize(dst))
+
+        # only the bin/ file is a primary file
+        pfiles = [x.text for x in pkg.iter('{%s}file' % COMMON_NS)]
+        assert pfiles == [x for x in paths if '/bin/' in x]
+
+        rng = pkg.find('{%s}format' % COMMON_NS).find('{http://linux.duke.edu/metadata/rpm}header-range')
+        hdr = read_rpm(dst)
+        assert (int(rng.get('start')), int(rng.get('end'))) == (hdr['header_start'], hdr['header_end'])
+
+    filelists = files['filelists'].findall('{%s}package' % FILELISTS_NS)
+    for pkg in filelists:
+        (dst, paths, version) = rpms[pkg.get('name')]
+        assert sorted([x.text for x in pkg.findall('{%s}file' % FILELISTS_NS)]) == paths
+
+    other = files['other'].findall('{%s}package' % OTHER_NS)
+    assert sorted([x.get('name') for x in other]) == sorted(rpms)
+
+
+def test_unchanged_repo_is_not_rewritten(repo):
+    (repodir, cache_file, rpms) = repo
+    update_repodata(repodir, cache_file)
+    with open(os.path.join(repodir, 'repodata', 'repomd.xml'), 'rb') as f:
+        repomd = f.read()
+
+    counts = update_repodata(repodir, cache_file)
+    assert counts['changed'] is False
+    assert counts['cached'] == 2
+    with open(os.path.join(repodir, 'repodata', 'repomd.xml'), 'rb') as f:
+        assert f.read() == repomd
+
+
+def test_truncated_rpms_are_left_out(repo):
+    (repodir, cache_file, rpms) = repo
+    (dst, paths, version) = rpms['ansible-collection-network_ios']
+    with open(dst, 'rb') as f:
+        data = f.read()
+    end = read_rpm(dst)['header_end']
+    # in the lead, the signature, the main header's index and its data
+    for size in [50, 100, 130, 400, end - 200, end - 1]:
+        with open(os.path.join(repodir, 'truncated-%s.rpm' % size), 'wb') as f:
+            f.write(data[:size])
+
+    counts = update_repodata(repodir, cache_file)
+    assert counts['packages'] == 2
+    primary = _repomd(repodir)['primary']
+    assert primary.get('packages') == '2'
+
+
+def test_read_header_truncated():
+    with pytest.raises(ValueError):
+        read_header(io.BytesIO(b'\x8e\xad\xe8\x01\0\0\0\0\0\0\0\x02\0\0\0\x10' + b'\0' * 20))
+    # an INT32 tag pointing past the data
+    index = b'\0\0\x03\xe8\0\0\0\x04\0\0\0\x0e\0\0\0\x01'
+    with pytest.raises(ValueError):
+        read_header(io.BytesIO(b'\x8e\xad\xe8\x01\0\0\0\0\0\0\0\x01\0\0\0\x10' + index + b'\0' * 16))
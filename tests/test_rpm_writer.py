@@ -0,0 +1,186 @@
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+
+import pytest
+
+from repodata import read_rpm
+from rpm_writer import BASENAMES
+from rpm_writer import DIRINDEXES
+from rpm_writer import DIRNAMES
+from rpm_writer import FILEDIGESTS
+from rpm_writer import FILELINKTOS
+from rpm_writer import FILEMODES
+from rpm_writer import NAME
+from rpm_writer import PAYLOADCOMPRESSOR
+from rpm_writer import PAYLOADDIGEST
+from rpm_writer import RpmWriter
+from rpm_writer import SIG_PAYLOADSIZE
+from rpm_writer import SIG_SHA256
+from rpm_writer import SIG_SIZE
+from rpm_writer import VERSION
+from rpm_writer import compressions
+from rpm_writer import decompress
+
+
+PREFIX = '/usr/share/ansible/collections/ansible_collections/jctanner/cloud_vmware'
+
+FILES = {
+    'plugins/modules/vmware_guest.py': ('# guest\n' * 200, 0o644),
+    'plugins/modules/__init__.py': ('', 0o644),
+    'plugins/module_utils/vmware.py': ('import ssl\n' * 50, 0o644),
+    'plugins/scripts/inventory.sh': ('#!/bin/sh\necho {}\n', 0o755),
+}
+LINKS = {
+    'plugins/modules/_vmware_guest_facts.py': 'vmware_guest.py',
+}
+
+
+def _dump(rpmfile):
+    '''{path: (mode, digest, linkto)}, by rpm -qp --dump when there is one'''
+    files = {}
+    if shutil.which('rpm'):
+        so = subprocess.check_output(['rpm', '-qp', '--dump', '--nosignature', rpmfile])
+        for line in so.decode('utf-8').splitlines():
+            # path size mtime digest mode owner group isconfig isdoc rdev symlink
+            parts = line.split(' ')
+            digest = '' if parts[3].strip('0') == '' else parts[3]
+            files[parts[0]] = (int(parts[4], 8), digest, '' if parts[10] == 'X' else parts[10])
+        return files
+    h = read_rpm(rpmfile)['header']
+    for (idx, bn) in enumerate(h[BASENAMES]):
+        path = h[DIRNAMES][h[DIRINDEXES][idx]] + bn
+        files[path] = (h[FILEMODES][idx], h[FILEDIGESTS][idx], h[FILELINKTOS][idx])
+    return files
+
+
+def _payload(rpmfile, compression):
+    '''{path: (mode, data)} of the cpio payload, by rpm2cpio when there is one'''
+    if shutil.which('rpm2cpio'):
+        cpio = subprocess.check_output(['rpm2cpio', rpmfile])
+    else:
+        end = read_rpm(rpmfile)['header_end']
+        with open(rpmfile, 'rb') as f:
+            f.seek(end)
+            cpio = decompress(f.read(), compression)
+
+    files = {}
+    pos = 0
+    while True:
+        assert cpio[pos:pos + 6] == b'070701'
+        fields = [int(cpio[pos + 6 + x * 8:pos + 14 + x * 8], 16) for x in range(13)]
+        (mode, size, namesize) = (fields[1], fields[6], fields[11])
+        pos += 110
+        name = cpio[pos:pos + namesize - 1].decode('utf-8')
+        pos += namesize + (-(110 + namesize) % 4)
+        data = cpio[pos:pos + size]
+        pos += size + (-size % 4)
+        if name == 'TRAILER!!!':
+            break
+        files[name[1:]] = (mode, data)
+    return files
+
+
+@pytest.fixture
+def cdir(tmpdir):
+    cdir = str(tmpdir.join('cloud_vmware'))
+    for (path, (data, mode)) in FILES.items():
+        fn = os.path.join(cdir, path)
+        if not os.path.exists(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        with open(fn, 'w') as f:
+            f.write(data)
+        os.chmod(fn, mode)
+    for (path, target) in LINKS.items():
+        os.symlink(target, os.path.join(cdir, path))
+    return cdir
+
+
+def _build(cdir, dst, compression):
+    rpm = RpmWriter(
+        'ansible-collection-cloud_vmware',
+        '2.10.0.dev0',
+        prefix=PREFIX,
+        compression=compression
+    )
+    rpm.add_tree(cdir, 'plugins')
+    rpm.write(dst)
+    return rpm
+
+
+@pytest.mark.parametrize('compression', compressions())
+def test_rpm(cdir, tmpdir, compression):
+    dst = str(tmpdir.join('test.rpm'))
+    rpm = _build(cdir, dst, compression)
+
+    with open(dst, 'rb') as f:
+        data = f.read()
+    info = read_rpm(dst)
+    (sig, h) = (info['signature'], info['header'])
+    assert h[NAME] == 'ansible-collection-cloud_vmware'
+    assert h[VERSION] == '2.10.0.dev0'
+    assert h[PAYLOADCOMPRESSOR] == rpm.payload_compressor()
+
+    # the signature covers the header and the payload
+    header = data[info['header_start']:info['header_end']]
+    payload = data[info['header_end']:]
+    assert sig[SIG_SHA256] == hashlib.sha256(header).hexdigest()
+    assert sig[SIG_SIZE] == [len(header) + len(payload)]
+    assert h[PAYLOADDIGEST] == [hashlib.sha256(payload).hexdigest()]
+    assert sig[SIG_PAYLOADSIZE] == [len(decompress(payload, compression))]
+
+    expected = {}
+    for (path, (content, mode)) in FILES.items():
+        expected[os.path.join(PREFIX, path)] = (
+            stat.S_IFREG | mode, hashlib.sha256(content.encode('utf-8')).hexdigest(), ''
+        )
+    for (path, target) in LINKS.items():
+        expected[os.path.join(PREFIX, path)] = (stat.S_IFLNK | 0o777, '', target)
+    assert _dump(dst) == expected
+
+    files = _payload(dst, compression)
+    assert sorted(files) == sorted(expected)
+    for (path, (mode, content)) in files.items():
+        assert mode == expected[path][0]
+        if expected[path][2]:
+            assert content.decode('utf-8') == expected[path][2]
+        else:
+            assert hashlib.sha256(content).hexdigest() == expected[path][1]
+
+
+def test_none_is_stored_gzip(cdir, tmpdir):
+    dst = str(tmpdir.join('test.rpm'))
+    rpm = _build(cdir, dst, 'none')
+    assert rpm.payload_compressor() == 'gzip'
+    info = read_rpm(dst)
+    with open(dst, 'rb') as f:
+        f.seek(info['header_end'])
+        payload = f.read()
+    # level 0, stored blocks are no smaller than the cpio archive
+    assert len(payload) > info['signature'][SIG_PAYLOADSIZE][0]
+
+
+@pytest.mark.parametrize('compression', compressions())
+def test_reproducible(cdir, tmpdir, compression):
+    (first, second) = (str(tmpdir.join('first.rpm')), str(tmpdir.join('second.rpm')))
+    _build(cdir, first, compression)
+    _build(cdir, second, compression)
+    with open(first, 'rb') as f1, open(second, 'rb') as f2:
+        assert f1.read() == f2.read()
+
+    # mtimes are packaged, so a touched file makes a new rpm
+    os.utime(os.path.join(cdir, 'plugins', 'modules', '__init__.py'), (1546300800, 1546300800))
+    _build(cdir, second, compression)
+    with open(first, 'rb') as f1, open(second, 'rb') as f2:
+        assert f1.read() != f2.read()
+
+    _build(cdir, first, compression)
+    with open(first, 'rb') as f1, open(second, 'rb') as f2:
+        assert f1.read() == f2.read()
+
+
+def test_unsupported_compression():
+    with pytest.raises(ValueError):
+        RpmWriter('x', '1.0', compression='lz4')